@@ -0,0 +1,53 @@
+"""
+Benchmark of the payload codecs over representative payloads, reporting
+encode and decode throughput and the encoded size.
+
+Run from the repository root with:
+    python -m benchmarks.codec
+"""
+import timeit
+
+from emitter.codec import JsonCodec, MsgpackCodec
+
+
+PAYLOADS = {
+    "telemetry": {"device": "sensor-0042", "ts": 1577833210123, "temperature": 21.5, "humidity": 48, "ok": True},
+    "presence": {"time": 1577833210, "event": "status", "channel": "chat/room/",
+                 "who": [{"id": "ABCDE12345FGHIJ678910KLMNO%d" % i, "username": "User%d" % i} for i in range(50)]},
+    "records": [{"id": i, "name": "item %d" % i, "price": i * 1.25, "tags": ["a", "b", "c"], "stock": {"eu": i, "us": 2 * i}}
+                for i in range(500)],
+}
+
+def codecs():
+    found = [JsonCodec("json")]
+    for library in JsonCodec.LIBRARIES:
+        try:
+            found.append(JsonCodec(library))
+        except ImportError:
+            pass
+    try:
+        found.append(MsgpackCodec())
+    except ImportError:
+        pass
+    return found
+
+def ops_per_sec(func, budget=0.2):
+    number, elapsed = timeit.Timer(func).autorange()
+    runs = max(1, int(number * budget / max(elapsed, 1e-9)))
+    return runs / min(timeit.repeat(func, number=runs, repeat=3))
+
+def run():
+    print("{:<10} {:<10} {:>10} {:>14} {:>14}".format("payload", "codec", "bytes", "encode ops/s", "decode ops/s"))
+    for name, obj in PAYLOADS.items():
+        for codec in codecs():
+            label = getattr(codec, "library", codec.name)
+            encoded = codec.encode(obj)
+            if isinstance(encoded, str):
+                encoded = encoded.encode("utf-8")
+            encode = ops_per_sec(lambda: codec.encode(obj))
+            decode = ops_per_sec(lambda: codec.decode(encoded))
+            print("{:<10} {:<10} {:>10} {:>14.0f} {:>14.0f}".format(name, label, len(encoded), encode, decode))
+
+
+if __name__ == "__main__":
+    run()
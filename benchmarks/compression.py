@@ -0,0 +1,62 @@
+"""
+Benchmark of the CPU against bytes trade-off of payload compression: for JSON
+documents of several sizes, the compressed size and the time to compress and
+decompress one payload, per algorithm and level. zstd is included when the
+zstandard package is installed.
+
+Run from the repository root with:
+    python -m benchmarks.compression
+"""
+import json
+import timeit
+
+from emitter.compression import Compressor
+
+
+SIZES = (256, 1024, 4096, 16384, 65536, 262144)
+SETTINGS = (("zlib", 1), ("zlib", 6), ("zlib", 9), ("zstd", 1), ("zstd", 3), ("zstd", 9))
+
+def document(size):
+    """
+    * Returns a JSON document of about size bytes, as telemetry records.
+    """
+    records = []
+    length = 2
+    i = 0
+    while length < size:
+        record = {"device": "sensor-%04d" % (i % 500), "ts": 1577833210123 + i * 250,
+                  "temperature": round(20 + (i * 7 % 100) / 10.0, 1), "humidity": 40 + i % 20, "ok": i % 7 != 0}
+        records.append(record)
+        length += len(json.dumps(record)) + 2
+        i += 1
+    return json.dumps(records).encode("utf-8")
+
+def micros_per_op(func, budget=0.2):
+    number, elapsed = timeit.Timer(func).autorange()
+    runs = max(1, int(number * budget / max(elapsed, 1e-9)))
+    return min(timeit.repeat(func, number=runs, repeat=3)) / runs * 1e6
+
+def compressors():
+    for algorithm, level in SETTINGS:
+        try:
+            yield "%s-%d" % (algorithm, level), Compressor(threshold=0, level=level, algorithm=algorithm)
+        except ImportError:
+            pass
+
+def run():
+    print("{:>8} {:<8} {:>10} {:>8} {:>14} {:>16} {:>14}".format(
+        "bytes", "codec", "sent", "ratio", "compress us", "decompress us", "us/KiB saved"))
+    for size in SIZES:
+        payload = document(size)
+        for label, compressor in compressors():
+            compressed = compressor.compress(payload)
+            compress = micros_per_op(lambda: compressor.compress(payload))
+            decompress = micros_per_op(lambda: compressor.decompress(compressed))
+            saved = (len(payload) - len(compressed)) / 1024.0
+            print("{:>8} {:<8} {:>10} {:>8.2f} {:>14.1f} {:>16.1f} {:>14.1f}".format(
+                len(payload), label, len(compressed), len(payload) / float(len(compressed)), compress, decompress,
+                (compress + decompress) / saved if saved > 0 else float("nan")))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,184 @@
+"""
+End-to-end benchmarks of the client through a broker: messages per second,
+p50 and p99 latency and peak memory for
+ - publish: one publisher and one subscriber,
+ - fanout: one publisher and several subscribers to the same channel,
+ - shared: one publisher and the members of a share group,
+ - control: keygen and me requests, several of them in flight.
+
+Messages carry the time they were published, so latencies are measured from
+publish() to the handler. They run on the local broker stand-in, in this very
+process, unless --host and --port point to another broker, for instance one
+started with:
+    python -m emitter.localbroker --port 8080
+
+Run from the repository root with:
+    python -m benchmarks.e2e [count] [--scenario NAME] [--size BYTES] [--host HOST --port PORT --key KEY]
+"""
+import argparse
+import struct
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from emitter import Client
+from emitter.localbroker import LocalBroker
+from emitter.metrics import Histogram
+
+
+KEY = "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha"
+STAMP = struct.Struct("!d")
+SUBSCRIBERS = 8
+IN_FLIGHT = 64
+
+def connect(host, port):
+    client = Client()
+    connected = threading.Event()
+    client.on_connect = connected.set
+    client.connect(host=host, port=port, secure=False)
+    client.loop_start()
+    connected.wait()
+    return client
+
+def close(*clients):
+    for client in clients:
+        client.disconnect()
+        client.loop_stop()
+
+def peak_memory():
+    """
+    * Returns the peak resident memory of the process in MiB, when known.
+    """
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class Receiver(object):
+    """
+    * Counts the stamped messages received by any number of handlers, and
+    * records their latency.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.latency = Histogram()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, message):
+        now = time.perf_counter()
+        sent, = STAMP.unpack_from(message.as_binary())
+        with self._lock:
+            self.latency.record(now - sent)
+            self.received += 1
+            if self.received >= self.expected:
+                self.done.set()
+
+def stamped(size):
+    padding = b"x" * max(size - STAMP.size, 0)
+    return lambda: STAMP.pack(time.perf_counter()) + padding
+
+def sync(*clients):
+    # A control request answered means the earlier packets of the connection,
+    # subscriptions included, went through the broker.
+    for client in clients:
+        client.me_async().result(10)
+
+def stream(publisher, key, channel, count, size, receiver):
+    payload = stamped(size)
+    start = time.perf_counter()
+    for _ in range(count):
+        publisher.publish(key, channel, payload())
+    receiver.done.wait(60)
+    return time.perf_counter() - start
+
+def publish(host, port, key, count, size):
+    publisher, subscriber = connect(host, port), connect(host, port)
+    receiver = Receiver(count)
+    subscriber.subscribe(key, "bench/publish/", receiver)
+    sync(subscriber)
+    elapsed = stream(publisher, key, "bench/publish/", count, size, receiver)
+    close(publisher, subscriber)
+    return receiver.received, elapsed, receiver.latency
+
+def fanout(host, port, key, count, size):
+    publisher = connect(host, port)
+    subscribers = [connect(host, port) for _ in range(SUBSCRIBERS)]
+    receiver = Receiver(count * len(subscribers))
+    for subscriber in subscribers:
+        subscriber.subscribe(key, "bench/fanout/", receiver)
+    sync(*subscribers)
+    elapsed = stream(publisher, key, "bench/fanout/", count, size, receiver)
+    close(publisher, *subscribers)
+    return receiver.received, elapsed, receiver.latency
+
+def shared(host, port, key, count, size):
+    publisher = connect(host, port)
+    members = [connect(host, port) for _ in range(SUBSCRIBERS)]
+    receiver = Receiver(count)
+    for member in members:
+        member.subscribe_with_group(key, "bench/shared/", "bench", receiver)
+    sync(*members)
+    elapsed = stream(publisher, key, "bench/shared/", count, size, receiver)
+    close(publisher, *members)
+    return receiver.received, elapsed, receiver.latency
+
+def control(host, port, key, count, size):
+    client = connect(host, port)
+    latency = Histogram()
+    slots = threading.BoundedSemaphore(IN_FLIGHT)
+    done = threading.Event()
+    completed = [0]
+    lock = threading.Lock()
+
+    def on_done(sent, future):
+        latency_seconds = time.perf_counter() - sent
+        slots.release()
+        with lock:
+            latency.record(latency_seconds)
+            completed[0] += 1
+            if completed[0] == count:
+                done.set()
+
+    start = time.perf_counter()
+    for i in range(count):
+        slots.acquire()
+        sent = time.perf_counter()
+        future = client.keygen_async(key, "bench/control/", "rw") if i % 2 else client.me_async()
+        future.add_done_callback(lambda f, sent=sent: on_done(sent, f))
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    close(client)
+    return completed[0], elapsed, latency
+
+SCENARIOS = {"publish": publish, "fanout": fanout, "shared": shared, "control": control}
+
+def run(scenarios, count, size, host, port, key):
+    print("{:<10} {:>10} {:>12} {:>10} {:>10} {:>12}".format(
+        "scenario", "messages", "msgs/sec", "p50 ms", "p99 ms", "peak MiB"))
+    for name in scenarios:
+        received, elapsed, latency = SCENARIOS[name](host, port, key, count, size)
+        print("{:<10} {:>10} {:>12.0f} {:>10.2f} {:>10.2f} {:>12.1f}".format(
+            name, received, received / elapsed, latency.quantile(0.5) * 1e3,
+            latency.quantile(0.99) * 1e3, peak_memory()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("count", type=int, nargs="?", default=20000)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--key", default=KEY)
+    args = parser.parse_args()
+    scenarios = args.scenario or ["publish", "fanout", "shared", "control"]
+    if args.host:
+        run(scenarios, args.count, args.size, args.host, args.port, args.key)
+    else:
+        with LocalBroker() as broker:
+            run(scenarios, args.count, args.size, "127.0.0.1", broker.port, args.key)
@@ -0,0 +1,132 @@
+"""
+A load generator: publishers send stamped messages at a steady rate to a set
+of channels while subscribers receive them, and every second it prints the
+messages sent and received per second and the p50 and p99 latency over that
+second. Unlike benchmarks.e2e, which publishes as fast as it can, the rate is
+fixed, so latencies are not those of a backlog.
+
+Run from the repository root with:
+    python -m benchmarks.loadgen [--rate MSGS] [--duration SECONDS] [--size BYTES]
+        [--publishers N] [--subscribers N] [--channels N] [--group NAME] [--qos 0|1]
+        [--host HOST --port PORT --key KEY]
+
+Without --host, it runs against the local broker stand-in in this process.
+"""
+import argparse
+import threading
+import time
+
+from emitter import Client
+from emitter.localbroker import LocalBroker
+from emitter.metrics import Histogram
+
+from .e2e import KEY, close, connect, peak_memory, stamped, STAMP, sync
+
+
+class Window(object):
+    """
+    * The messages received and their latency since the last report.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0
+        self.latency = Histogram()
+
+    def reset(self):
+        """
+        * Starts a new window, returns the count and latency of the last one.
+        """
+        with self._lock:
+            current = (self.received, self.latency)
+            self.received = 0
+            self.latency = Histogram()
+        return current
+
+    def __call__(self, message):
+        now = time.perf_counter()
+        sent, = STAMP.unpack_from(message.as_binary())
+        with self._lock:
+            self.received += 1
+            self.latency.record(now - sent)
+
+def publish(client, key, channels, rate, duration, size, options, sent, stop):
+    payload = stamped(size)
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    deadline = next_send + duration
+    i = 0
+    while not stop.is_set() and next_send < deadline:
+        # Open loop: messages late behind the schedule are sent right away, so
+        # a slow broker shows as latency rather than as a lower rate.
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client.publish(key, channels[i % len(channels)], payload(), options)
+        sent[0] += 1
+        i += 1
+        next_send += interval
+
+def run(args, host, port):
+    channels = ["load/%d/" % i for i in range(args.channels)]
+    options = {Client.with_at_least_once()} if args.qos else set()
+    window = Window()
+
+    subscribers = [connect(host, port) for _ in range(args.subscribers)]
+    for subscriber in subscribers:
+        for channel in channels:
+            if args.group:
+                subscriber.subscribe_with_group(args.key, channel, args.group, window)
+            else:
+                subscriber.subscribe(args.key, channel, window)
+    sync(*subscribers)
+
+    publishers = [connect(host, port) for _ in range(args.publishers)]
+    stop = threading.Event()
+    counters = [[0] for _ in publishers]
+    threads = [threading.Thread(target=publish, args=(client, args.key, channels, args.rate / len(publishers),
+                                                      args.duration, args.size, options, sent, stop))
+               for client, sent in zip(publishers, counters)]
+    for thread in threads:
+        thread.start()
+
+    print("{:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format("second", "sent/s", "recv/s", "p50 ms", "p99 ms", "peak MiB"))
+    reported = 0
+    started = time.perf_counter()
+    second = 0
+    try:
+        while any(thread.is_alive() for thread in threads):
+            second += 1
+            time.sleep(max(started + second - time.perf_counter(), 0))
+            total = sum(sent[0] for sent in counters)
+            received, latency = window.reset()
+            print("{:>6} {:>10} {:>10} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+                second, total - reported, received, latency.quantile(0.5) * 1e3,
+                latency.quantile(0.99) * 1e3, peak_memory()))
+            reported = total
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in threads:
+        thread.join()
+    close(*(publishers + subscribers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=1000, help="messages per second, across publishers")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--publishers", type=int, default=1)
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--group", help="subscribe through this share group")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--key", default=KEY)
+    args = parser.parse_args()
+    if args.host:
+        run(args, args.host, args.port)
+    else:
+        with LocalBroker() as broker:
+            run(args, "127.0.0.1", broker.port)
@@ -0,0 +1,70 @@
+"""
+Throughput benchmark of Client.publish_many against one publish call per
+message, on a local broker stand-in.
+
+Run from the repository root with:
+    python -m benchmarks.publish_many [count]
+"""
+import sys
+import threading
+import time
+
+from emitter import Client
+from emitter.localbroker import LocalBroker
+
+
+KEY = "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha"
+PAYLOAD = b"x" * 128
+
+def connect(broker):
+    client = Client()
+    connected = threading.Event()
+    client.on_connect = connected.set
+    client.connect(host="127.0.0.1", port=broker.port, secure=False)
+    client.loop_start()
+    connected.wait()
+    return client
+
+def publish_loop(client, messages):
+    infos = [client._mqtt.publish(Client._format_channel(KEY, channel, options), payload,
+                                  *Client._get_header(options or ()))
+             for channel, payload, options in messages]
+    for info in infos:
+        info.wait_for_publish()
+
+def publish_loop_sequential(client, messages):
+    for channel, payload, options in messages:
+        qos, retain = Client._get_header(options or ())
+        info = client._mqtt.publish(Client._format_channel(KEY, channel, options), payload, qos=qos, retain=retain)
+        info.wait_for_publish()
+
+def publish_many(window):
+    def run(client, messages):
+        client.publish_many(KEY, messages, window=window).wait()
+    return run
+
+def run(count=20000):
+    qos1 = {Client.with_at_least_once()}
+    messages = [("bench/%d/" % (i % 100), PAYLOAD, qos1) for i in range(count)]
+    cases = [
+        ("publish, wait each", publish_loop_sequential),
+        ("publish, wait all", publish_loop),
+        ("publish_many w=10", publish_many(10)),
+        ("publish_many w=100", publish_many(100)),
+        ("publish_many w=1000", publish_many(1000)),
+    ]
+
+    print("{:<22} {:>12}".format("qos1, %d msgs" % count, "msgs/sec"))
+    with LocalBroker() as broker:
+        for name, case in cases:
+            client = connect(broker)
+            start = time.perf_counter()
+            case(client, messages)
+            elapsed = time.perf_counter() - start
+            client.loop_stop()
+            client.disconnect()
+            print("{:<22} {:>12.0f}".format(name, count / elapsed))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
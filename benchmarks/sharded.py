@@ -0,0 +1,84 @@
+"""
+Round-trip throughput of ShardedClient for 1, 2, 4 and 8 connections: QoS1
+messages published with publish_many over many channels, and received back by
+the same client, on a local broker stand-in.
+
+The stand-in broker runs on a single asyncio loop in this very process, so it
+caps the figures early. Point it at a real broker with --host and --port to
+measure the client side.
+
+Run from the repository root with:
+    python -m benchmarks.sharded [count] [--host HOST --port PORT --key KEY]
+"""
+import argparse
+import threading
+import time
+
+from emitter import Client
+from emitter.localbroker import LocalBroker
+from emitter.sharded import ShardedClient
+
+
+KEY = "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha"
+PAYLOAD = b"x" * 128
+CHANNELS = 256
+
+def connect(connections, host, port):
+    client = ShardedClient(connections=connections)
+    connected = threading.Event()
+    client.on_connect = connected.set
+    client.connect(host=host, port=port, secure=False)
+    client.loop_start()
+    connected.wait()
+    return client
+
+def round_trip(client, key, count):
+    channels = ["bench/%d/" % i for i in range(CHANNELS)]
+    lock = threading.Lock()
+    received = [0]
+    done = threading.Event()
+    def handler(message):
+        with lock:
+            received[0] += 1
+            if received[0] == target[0]:
+                done.set()
+
+    # Every subscription is in place once a message went through each channel.
+    target = [len(channels)]
+    for channel in channels:
+        client.subscribe(key, channel, handler)
+    for channel in channels:
+        client.publish(key, channel, b"sync")
+    done.wait()
+    done.clear()
+
+    qos1 = {Client.with_at_least_once()}
+    messages = [(channels[i % len(channels)], PAYLOAD, qos1) for i in range(count)]
+    target[0] += count
+    start = time.perf_counter()
+    client.publish_many(key, messages, window=100).wait()
+    done.wait()
+    return time.perf_counter() - start
+
+def run(count, host, port, key):
+    print("{:<14} {:>12}".format("connections", "msgs/sec"))
+    for connections in (1, 2, 4, 8):
+        client = connect(connections, host, port)
+        elapsed = round_trip(client, key, count)
+        client.loop_stop()
+        client.disconnect()
+        print("{:<14} {:>12.0f}".format(connections, count / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("count", type=int, nargs="?", default=20000)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--key", default=KEY)
+    args = parser.parse_args()
+    if args.host:
+        run(args.count, args.host, args.port, args.key)
+    else:
+        with LocalBroker() as broker:
+            run(args.count, "127.0.0.1", broker.port, args.key)
@@ -0,0 +1,47 @@
+"""
+Benchmark of single SubTrie inserts as the trie grows, as Client.subscribe
+does them: the time per insert over successive blocks, for a flat layout where
+every channel is a sibling and a gateway-like one, inserted one at a time and
+in blocks with insert_many. Published snapshots hold the children of a node in
+a plain dict, so a single insert under a wide node copies it, while a batch
+copies it once per block.
+
+Run from the repository root with:
+    python -m benchmarks.subtrie_insert [count]
+"""
+import sys
+import time
+
+from emitter.subtrie import SubTrie
+
+
+LAYOUTS = {
+    "flat": lambda i: "device%d/" % i,
+    "gateway": lambda i: "tenant%d/device%d/telemetry/" % (i % 1000, i),
+}
+
+def handler(message):
+    pass
+
+def run(count=100000):
+    blocks = 10
+    size = max(count // blocks, 1)
+    print("{:<10} {:>12} {:>14} {:>14}".format("layout", "trie size", "us/insert", "us/batched"))
+    for name, channel in LAYOUTS.items():
+        trie = SubTrie()
+        batched = SubTrie()
+        for block in range(blocks):
+            items = [(channel(i), handler) for i in range(block * size, (block + 1) * size)]
+            start = time.perf_counter()
+            for topic, h in items:
+                trie.insert(topic, h)
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            batched.insert_many(items)
+            batch_elapsed = time.perf_counter() - start
+            print("{:<10} {:>12} {:>14.2f} {:>14.2f}".format(
+                name, (block + 1) * size, elapsed / size * 1e6, batch_elapsed / size * 1e6))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of SubTrie.lookup against the previous recursive matcher.
+
+Run from the repository root with:
+    python -m benchmarks.subtrie_lookup
+"""
+import itertools
+import timeit
+
+from emitter.subtrie import SubTrie
+
+from .legacy import SubTrie as LegacySubTrie
+
+
+def deep_topics(trie):
+    # One subscription per prefix of a 16 level channel.
+    words = ["level%d" % i for i in range(16)]
+    for i in range(1, len(words) + 1):
+        trie.insert("/".join(words[:i]) + "/", i)
+    return ["/".join(words) + "/"]
+
+def wildcard_topics(trie):
+    # Every combination of exact word and "+" over 6 levels: 64 matching patterns.
+    words = ["w%d" % i for i in range(6)]
+    for mask in itertools.product((False, True), repeat=len(words)):
+        pattern = [("+" if wild else w) for w, wild in zip(words, mask)]
+        trie.insert("/".join(pattern) + "/", mask)
+    return ["/".join(words) + "/", "/".join(["x"] + words[1:]) + "/"]
+
+def fanout_topics(trie):
+    # A wide trie of 10k channels where each lookup only hits a few nodes.
+    for i in range(10000):
+        trie.insert("app/%d/events/" % i, i)
+        trie.insert("app/+/events/%d/" % (i % 100), i)
+    return ["app/%d/events/%d/" % (i, i % 100) for i in range(0, 10000, 997)]
+
+
+SCENARIOS = [("deep", deep_topics), ("wildcard", wildcard_topics), ("fanout", fanout_topics)]
+
+def run(number=20000):
+    print("{:<10} {:>14} {:>14} {:>8}".format("scenario", "legacy us/op", "current us/op", "speedup"))
+    for name, build in SCENARIOS:
+        legacy = LegacySubTrie()
+        current = SubTrie(cache_size=0)
+        topics = build(legacy)
+        build(current)
+
+        for topic in topics:
+            assert list(legacy.lookup(topic)) == list(current.lookup(topic))
+
+        results = []
+        for trie in (legacy, current):
+            lookup = trie.lookup
+            def bench():
+                for topic in topics:
+                    lookup(topic)
+            elapsed = min(timeit.repeat(bench, number=number, repeat=3))
+            results.append(elapsed / (number * len(topics)) * 1e6)
+
+        print("{:<10} {:>14.2f} {:>14.2f} {:>7.2f}x".format(name, results[0], results[1], results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    run()
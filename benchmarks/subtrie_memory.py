@@ -0,0 +1,45 @@
+"""
+Memory benchmark of SubTrie, reporting bytes per subscription for the original
+node layout and the current compact one.
+
+Run from the repository root with:
+    python -m benchmarks.subtrie_memory [count]
+"""
+import gc
+import sys
+import tracemalloc
+
+from emitter.subtrie import SubTrie
+
+from .legacy import SubTrie as LegacySubTrie
+
+
+def handler(message):
+    pass
+
+def channels(count):
+    # Gateway-like layout: a thousand tenants, one telemetry channel per device.
+    for i in range(count):
+        yield "tenant%d/device%d/telemetry/" % (i % 1000, i)
+
+def measure(trie_class, count):
+    gc.collect()
+    tracemalloc.start()
+    trie = trie_class()
+    for channel in channels(count):
+        trie.insert(channel, handler)
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del trie
+    return used
+
+def run(count=1000000):
+    print("{:<10} {:>14} {:>16}".format("trie", "total MiB", "bytes/channel"))
+    for name, trie_class in (("legacy", LegacySubTrie), ("current", SubTrie)):
+        used = measure(trie_class, count)
+        print("{:<10} {:>14.1f} {:>16.1f}".format(name, used / 1048576.0, used / float(count)))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -1 +1,6 @@
+import sys
+
 from .emitter import Client
+
+if sys.version_info >= (3, 7):
+    from .asyncclient import AsyncClient
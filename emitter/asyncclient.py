@@ -0,0 +1,281 @@
+"""
+An Emitter client driven by an asyncio event loop instead of paho's blocking
+or threaded network loops.
+"""
+import asyncio
+import re
+
+import paho.mqtt.client as mqtt
+try:
+    from .emitter import Client
+    from .subtrie import SubTrie
+except ImportError:
+    from emitter import Client
+    from subtrie import SubTrie
+
+
+_CLOSED = object()
+
+
+class MessageStream(object):
+    """
+    * An asynchronous iterator over the messages received on a channel. Streams
+    * are created with AsyncClient.messages() and end once closed.
+    """
+
+    def __init__(self, client, channel):
+        self.channel = channel
+        self._client = client
+        self._queue = asyncio.Queue()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._queue.get()
+        if message is _CLOSED:
+            raise StopAsyncIteration
+        return message
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def _put(self, message):
+        self._queue.put_nowait(message)
+
+    def close(self):
+        """
+        * Stops receiving messages. Iteration ends after the pending messages.
+        """
+        if not self._closed:
+            self._closed = True
+            self._client._remove_stream(self)
+            self._queue.put_nowait(_CLOSED)
+
+
+class AsyncClient(Client):
+    """
+    * Represents a client connection to an Emitter server, with the MQTT socket
+    * registered on the running asyncio event loop. Every callback and handler
+    * runs on the event loop thread.
+    """
+
+    def __init__(self):
+        super(AsyncClient, self).__init__()
+        self._loop = None
+        self._misc_task = None
+        self._connect_future = None
+        self._disconnect_future = None
+        self._pending = {}
+        self._streams = {}
+        self._stream_trie = SubTrie()
+        self._all_streams = ()
+
+    async def connect(self, host="api.emitter.io", port=443, secure=True, keepalive=30, username=None, max_inflight=100):
+        """
+        * Connects to an Emitter server and waits for the connection to be acknowledged.
+        """
+        self._loop = asyncio.get_running_loop()
+        formatted_host = re.sub(r"/.*?:\/\//g", "", host)
+        self._mqtt = self._create_mqtt(secure, username, max_inflight)
+        self._mqtt.on_subscribe = self._on_subscribe
+        self._mqtt.on_unsubscribe = self._on_unsubscribe
+        self._mqtt.on_socket_open = self._on_socket_open
+        self._mqtt.on_socket_close = self._on_socket_close
+        self._mqtt.on_socket_register_write = self._on_socket_register_write
+        self._mqtt.on_socket_unregister_write = self._on_socket_unregister_write
+
+        self._connect_future = self._loop.create_future()
+        # Name resolution, TCP and TLS handshakes block, keep them off the loop.
+        await self._loop.run_in_executor(None, lambda: self._mqtt.connect(host=formatted_host, port=port, keepalive=keepalive))
+        self._misc_task = self._loop.create_task(self._misc_loop())
+        await self._connect_future
+
+    async def disconnect(self):
+        """
+        * Disconnects from the connected Emitter server and closes every message stream.
+        """
+        self._disconnect_future = self._loop.create_future()
+        self._mqtt.disconnect()
+        await self._disconnect_future
+
+    async def publish(self, key, channel, message, options={}):
+        """
+        * Publishes a message to a channel, encoded and compressed as by
+        * Client.publish(). With QoS1, waits for the broker acknowledgement,
+        * unless the message went to the outbox.
+        """
+        topic = self._format_channel(await self._key_for(key, channel), channel, options)
+        qos, retain = Client._get_header(options)
+
+        info = self._send(self._mqtt, channel, topic, self._prepare(channel, message), qos, retain)
+        if info is None:
+            return
+        self._check(info.rc)
+        if qos > 0:
+            await self._wait_for(info.mid)
+
+    async def subscribe(self, key, channel, optional_handler=None, options={}):
+        """
+        * Subscribes to a channel and waits for the broker acknowledgement.
+        """
+        topic = Client._format_channel(await self._key_for(key, channel), channel, options)
+        if optional_handler is not None:
+            self._handler_trie_message.insert(channel, optional_handler)
+
+        self._remember_subscription(key, channel, None, options)
+        rc, mid = self._mqtt.subscribe(topic)
+        self._check(rc)
+        self._subscribed(self._mqtt, ((channel, None),))
+        await self._wait_for(mid)
+
+    async def subscribe_with_group(self, key, channel, share_group, optional_handler=None, options={}):
+        """
+        * Subscribes to a particual share group and waits for the broker acknowledgement.
+        """
+        topic = Client._format_channel_share(await self._key_for(key, channel), channel, share_group, options)
+        if optional_handler is not None:
+            self._handler_trie_message.insert(channel, optional_handler)
+
+        self._remember_subscription(key, channel, share_group, options)
+        rc, mid = self._mqtt.subscribe(topic)
+        self._check(rc)
+        self._subscribed(self._mqtt, ((channel, share_group),))
+        await self._wait_for(mid)
+
+    async def unsubscribe(self, key, channel):
+        """
+        * Unsubscribes from a particular channel and waits for the broker acknowledgement.
+        """
+        topic = self._format_channel(await self._key_for(key, channel), channel)
+        self._handler_trie_message.delete(channel)
+        self._forget_subscription(channel)
+        rc, mid = self._mqtt.unsubscribe(topic)
+        self._check(rc)
+        await self._wait_for(mid)
+
+    async def _key_for(self, key, channel):
+        # Awaits keys from the key manager, the event loop reads the responses.
+        if key is not None:
+            return key
+        return await asyncio.wrap_future(self._key_futures((channel,))[channel], loop=self._loop)
+
+    def _request(self, kind, payload, timeout, match=None):
+        # The *_async requests return awaitable asyncio futures.
+        future = super(AsyncClient, self)._request(kind, payload, timeout, match)
+        return asyncio.wrap_future(future, loop=self._loop)
+
+    def messages(self, channel=None):
+        """
+        * Returns a stream of the messages received on a channel, wildcards included,
+        * or of every message when no channel is given. This does not subscribe.
+        """
+        stream = MessageStream(self, channel)
+        if channel is None:
+            self._all_streams += (stream,)
+        else:
+            streams = self._streams.get(channel, ()) + (stream,)
+            self._streams[channel] = streams
+            self._stream_trie.insert(channel, streams)
+        return stream
+
+    def _remove_stream(self, stream):
+        if stream.channel is None:
+            self._all_streams = tuple(s for s in self._all_streams if s is not stream)
+            return
+
+        streams = tuple(s for s in self._streams.get(stream.channel, ()) if s is not stream)
+        if streams:
+            self._streams[stream.channel] = streams
+            self._stream_trie.insert(stream.channel, streams)
+        else:
+            self._streams.pop(stream.channel, None)
+            self._stream_trie.delete(stream.channel)
+
+    def _invoke_trie_handlers(self, trie, default_handler, message):
+        if trie is self._handler_trie_message:
+            for stream in self._all_streams:
+                stream._put(message)
+            for streams in self._stream_trie.lookup(message.channel):
+                for stream in streams:
+                    stream._put(message)
+
+        super(AsyncClient, self)._invoke_trie_handlers(trie, default_handler, message)
+
+    @staticmethod
+    def _check(rc):
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(mqtt.error_string(rc))
+
+    async def _wait_for(self, mid):
+        future = self._loop.create_future()
+        self._pending[mid] = future
+        await future
+
+    def _resolve(self, mid):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def _misc_loop(self):
+        # Keepalives and retries, the part of paho's loop that is not socket driven.
+        while self._mqtt.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _call_soon(self, func, *args):
+        # Socket callbacks fire on the executor thread during connect().
+        self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_soon(self._loop.add_reader, sock, self._mqtt.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_soon(self._loop.add_writer, sock, self._mqtt.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        future = self._connect_future
+        if future is not None and not future.done():
+            if rc == 0:
+                future.set_result(None)
+            else:
+                future.set_exception(ConnectionError(mqtt.connack_string(rc)))
+        super(AsyncClient, self)._on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+        error = ConnectionError(mqtt.error_string(rc))
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+        for stream in self._all_streams + tuple(s for streams in self._streams.values() for s in streams):
+            stream.close()
+
+        future = self._disconnect_future
+        if future is not None and not future.done():
+            future.set_result(None)
+        super(AsyncClient, self)._on_disconnect(client, userdata, rc)
+
+    def _on_publish(self, client, userdata, mid):
+        self._resolve(mid)
+        super(AsyncClient, self)._on_publish(client, userdata, mid)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        self._resolve(mid)
+
+    def _on_unsubscribe(self, client, userdata, mid):
+        self._resolve(mid)
@@ -0,0 +1,130 @@
+import asyncio
+try:
+    from .asyncclient import AsyncClient
+    from .emitter import Client
+    from .keys import KeyManager
+    from .localbroker import LocalBroker
+except ImportError:
+    from asyncclient import AsyncClient
+    from emitter import Client
+    from keys import KeyManager
+    from localbroker import LocalBroker
+
+KEY = "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha"
+
+
+def run(test):
+    async def main():
+        broker = await LocalBroker().start()
+        client = AsyncClient()
+        await client.connect(host="127.0.0.1", port=broker.port, secure=False)
+        try:
+            await asyncio.wait_for(test(client), 5)
+        finally:
+            await client.disconnect()
+            await broker.stop()
+    asyncio.run(main())
+
+def test_publish_subscribe_stream():
+    async def test(client):
+        stream = client.messages("test/")
+        await client.subscribe(KEY, "test/")
+        await client.publish(KEY, "test/", "hello")
+
+        message = await stream.__anext__()
+        assert message.channel == "test/"
+        assert message.as_binary() == b"hello"
+    run(test)
+
+def test_publish_qos1_waits_for_ack():
+    async def test(client):
+        stream = client.messages()
+        await client.subscribe(KEY, "test/")
+        await client.publish(KEY, "test/", "hello", {Client.with_at_least_once()})
+        message = await stream.__anext__()
+        assert message.as_binary() == b"hello"
+    run(test)
+
+def test_publish_encodes_objects():
+    async def test(client):
+        stream = client.messages("test/")
+        await client.subscribe(KEY, "test/")
+        await client.publish(KEY, "test/", {"v": 1})
+
+        message = await stream.__anext__()
+        assert message.as_object() == {"v": 1}
+    run(test)
+
+def test_keys_from_key_manager():
+    async def test(client):
+        client.key_manager = KeyManager(client, KEY)
+        stream = client.messages("test/")
+        await client.subscribe(None, "test/")
+        await client.publish(None, "test/", "hello")
+
+        assert (await stream.__anext__()).as_binary() == b"hello"
+        await client.unsubscribe(None, "test/")
+    run(test)
+
+def test_streams_are_filtered_by_channel():
+    async def test(client):
+        a = client.messages("a/")
+        b = client.messages("b/+/")
+        await client.subscribe(KEY, "a/")
+        await client.subscribe(KEY, "b/")
+
+        await client.publish(KEY, "a/1/", "a1")
+        await client.publish(KEY, "b/1/", "b1")
+        await client.publish(KEY, "b/", "b")
+        await client.publish(KEY, "a/2/", "a2")
+
+        assert (await a.__anext__()).as_binary() == b"a1"
+        assert (await a.__anext__()).as_binary() == b"a2"
+        assert (await b.__anext__()).as_binary() == b"b1"
+    run(test)
+
+def test_stream_ends_when_closed():
+    async def test(client):
+        received = []
+        async with client.messages("test/") as stream:
+            await client.subscribe(KEY, "test/")
+            await client.publish(KEY, "test/", "1")
+            await client.publish(KEY, "test/", "2")
+            async for message in stream:
+                received.append(message.as_binary())
+                if len(received) == 2:
+                    stream.close()
+        assert received == [b"1", b"2"]
+    run(test)
+
+def test_handlers_and_unsubscribe():
+    async def test(client):
+        received = []
+        stream = client.messages()
+        await client.subscribe(KEY, "test/", lambda m: received.append(m.as_binary()))
+        await client.subscribe(KEY, "other/")
+        await client.publish(KEY, "test/", "1")
+        await stream.__anext__()
+
+        await client.unsubscribe(KEY, "test/")
+        await client.publish(KEY, "test/", "2")
+        await client.publish(KEY, "other/", "3")
+        assert (await stream.__anext__()).as_binary() == b"3"
+        assert received == [b"1"]
+    run(test)
+
+def test_without_echo():
+    async def test(client):
+        stream = client.messages()
+        await client.subscribe(KEY, "test/")
+        await client.publish(KEY, "test/", "1", [Client.without_echo()])
+        await client.publish(KEY, "test/", "2")
+        assert (await stream.__anext__()).as_binary() == b"2"
+    run(test)
+
+def test_request_is_awaitable():
+    async def test(client):
+        me = await client.me_async(timeout=5)
+        assert me["id"]
+        assert me["req"] > 0
+    run(test)
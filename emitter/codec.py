@@ -0,0 +1,64 @@
+"""
+Payload codecs used to encode published objects and decode received payloads.
+"""
+import json
+
+
+class JsonCodec(object):
+    """
+    * Encodes payloads as JSON. Uses the fastest JSON library installed among
+    * orjson, ujson and rapidjson, and falls back to the standard library. A
+    * library name can also be given explicitly, "json" being the standard one.
+    """
+    name = "json"
+    LIBRARIES = ("orjson", "ujson", "rapidjson")
+
+    def __init__(self, library=None):
+        module = None
+        for candidate in ((library,) if library else self.LIBRARIES):
+            if candidate == "json":
+                break
+            try:
+                module = __import__(candidate)
+                break
+            except ImportError:
+                if library:
+                    raise
+
+        if module is None:
+            module = json
+        self.library = module.__name__
+        self._dumps = module.dumps
+        self._loads = module.loads
+
+    def __getstate__(self):
+        return self.library
+
+    def __setstate__(self, library):
+        self.__init__(library)
+
+    def encode(self, obj):
+        return self._dumps(obj)
+
+    def decode(self, data):
+        if not isinstance(data, (bytes, str)):
+            data = bytes(data)
+        return self._loads(data)
+
+
+class MsgpackCodec(object):
+    """
+    * Encodes payloads with MessagePack. Requires the msgpack package.
+    """
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, obj):
+        return self._packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return self._unpackb(data, raw=False)
@@ -0,0 +1,86 @@
+import pickle
+import pytest
+try:
+    from .codec import JsonCodec, MsgpackCodec
+    from .emitter import Client, EmitterMessage
+    from .fakes import FakeMqtt, make_message
+except ImportError:
+    from codec import JsonCodec, MsgpackCodec
+    from emitter import Client, EmitterMessage
+    from fakes import FakeMqtt, make_message
+
+def test_json_codec_libraries():
+    for library in ["json"] + [l for l in JsonCodec.LIBRARIES if _installed(l)]:
+        codec = JsonCodec(library)
+        assert codec.library == library
+        assert codec.decode(codec.encode({"a": [1, 2]})) == {"a": [1, 2]}
+        assert codec.decode(memoryview(b'{"b": true}')) == {"b": True}
+
+def _installed(library):
+    try:
+        __import__(library)
+        return True
+    except ImportError:
+        return False
+
+def test_json_codec_missing_library():
+    with pytest.raises(ImportError):
+        JsonCodec("not_a_json_library")
+
+def test_json_codec_pickle():
+    codec = pickle.loads(pickle.dumps(JsonCodec("json")))
+    assert codec.library == "json"
+
+def test_msgpack_codec():
+    pytest.importorskip("msgpack")
+    codec = MsgpackCodec()
+    assert codec.decode(codec.encode({"a": b"\x00"})) == {"a": b"\x00"}
+
+def test_message_uses_codec():
+    class Upper(object):
+        def decode(self, data):
+            return bytes(data).upper()
+
+    message = EmitterMessage(make_message("a/", b"abc"), Upper())
+    assert message.as_object() == b"ABC"
+
+def test_codec_per_channel_pattern():
+    default, a, ab, wild = JsonCodec("json"), JsonCodec("json"), JsonCodec("json"), JsonCodec("json")
+    client = Client()
+    client.codec = default
+    client.set_codec("a/", a)
+    client.set_codec("a/b/", ab)
+    client.set_codec("a/+/c/", wild)
+
+    assert client._codec_for("x/") is default
+    assert client._codec_for("a/") is a
+    assert client._codec_for("a/x/") is a
+    assert client._codec_for("a/b/") is ab
+    assert client._codec_for("a/b/c/") is wild
+
+    client.set_codec("a/+/c/", None)
+    assert client._codec_for("a/b/c/") is ab
+
+def test_received_messages_use_channel_codec():
+    class Reverse(object):
+        def decode(self, data):
+            return bytes(data)[::-1]
+
+    client = Client()
+    client.set_codec("r/", Reverse())
+    received = []
+    client.on_message = lambda m: received.append(m.as_object())
+
+    client._on_message(None, None, make_message("r/1/", b"abc"))
+    client._on_message(None, None, make_message("j/", b'{"a": 1}'))
+
+    assert received == [b"cba", {"a": 1}]
+
+def test_publish_encodes_objects():
+    client = Client()
+    client._mqtt = FakeMqtt()
+    client.set_codec("m/", JsonCodec("json"))
+    client.publish("key", "m/", {"a": 1})
+    client.publish("key", "m/", "raw")
+
+    assert [payload for _, payload, _ in client._mqtt.published] == ['{"a": 1}', "raw"]
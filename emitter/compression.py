@@ -0,0 +1,111 @@
+"""
+Transparent compression of large payloads, marked so that receivers only
+decompress the payloads which were compressed.
+"""
+import zlib
+
+
+# A compressed payload starts with the marker and the algorithm. No UTF-8 text,
+# so no JSON, starts with 0xff, and neither does a valid MessagePack document
+# longer than a byte.
+MARKER = b"\xffEMz"
+ZLIB = 1
+ZSTD = 2
+
+
+class Compressor(object):
+    """
+    * Compresses the published payloads of threshold bytes or more, once
+    * assigned to the compression property of a client, and decompresses the
+    * received ones which were compressed. With threshold None, payloads are
+    * only decompressed.
+    *
+    * algorithm is "zlib" or "zstd", the latter requiring the zstandard
+    * package. By default, zstd is used when installed. Payloads which do not
+    * shrink are sent as they are.
+    *
+    * Received payloads decompressing to more than max_size bytes are rejected,
+    * so that a small payload cannot exhaust the memory of receivers. max_size
+    * None lifts the limit.
+    """
+    ALGORITHMS = ("zstd", "zlib")
+
+    def __init__(self, threshold=1024, level=None, algorithm=None, max_size=16 * 1024 * 1024):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._zstd = None
+        try:
+            import zstandard
+            self._zstd = zstandard
+        except ImportError:
+            if algorithm == "zstd":
+                raise
+
+        if algorithm is None:
+            algorithm = "zstd" if self._zstd is not None else "zlib"
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError("unknown algorithm: " + str(algorithm))
+        self.algorithm = algorithm
+        self.level = level
+
+        if algorithm == "zstd":
+            compressor = self._zstd.ZstdCompressor(level=3 if level is None else level)
+            self._compress = compressor.compress
+            self._prefix = MARKER + bytes(bytearray([ZSTD]))
+        else:
+            zlib_level = 6 if level is None else level
+            self._compress = lambda data: zlib.compress(data, zlib_level)
+            self._prefix = MARKER + bytes(bytearray([ZLIB]))
+
+    def __getstate__(self):
+        return (self.threshold, self.level, self.algorithm, self.max_size)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def compress(self, payload):
+        """
+        * Returns the payload, compressed and marked if it reaches the threshold
+        * and shrinks. Payloads other than strings and bytes are left alone.
+        """
+        if self.threshold is None or not isinstance(payload, (bytes, bytearray, str)) or len(payload) < self.threshold:
+            return payload
+        data = payload.encode("utf-8") if isinstance(payload, str) else payload
+        compressed = self._prefix + self._compress(data)
+        return compressed if len(compressed) < len(data) else payload
+
+    def decompress(self, payload):
+        """
+        * Returns the payload, decompressed if it was compressed. Raises
+        * ValueError when it would decompress to more than max_size bytes.
+        """
+        if len(payload) <= len(MARKER) or payload[:len(MARKER)] != MARKER:
+            return payload
+        algorithm = payload[len(MARKER)]
+        data = payload[len(MARKER) + 1:]
+        max_size = self.max_size
+        if algorithm == ZLIB:
+            if max_size is None:
+                return zlib.decompress(data)
+            # One byte more than allowed tells an oversized payload apart.
+            decompressor = zlib.decompressobj()
+            decompressed = decompressor.decompress(data, max_size + 1)
+            if len(decompressed) > max_size:
+                raise ValueError("payload decompresses to more than %d bytes" % max_size)
+            if not decompressor.eof:
+                raise ValueError("truncated zlib payload")
+            return decompressed
+        if algorithm == ZSTD:
+            if self._zstd is None:
+                raise ValueError("a zstd payload requires the zstandard package")
+            if max_size is None:
+                # Frames written by compress() carry their size.
+                return self._zstd.ZstdDecompressor().decompress(data)
+            if self._zstd.frame_content_size(data) > max_size:
+                raise ValueError("payload decompresses to more than %d bytes" % max_size)
+            try:
+                # Bounds the frames which do not carry their size.
+                return self._zstd.ZstdDecompressor().decompress(data, max_output_size=max_size)
+            except self._zstd.ZstdError as error:
+                raise ValueError("payload decompresses to more than %d bytes: %s" % (max_size, error))
+        raise ValueError("unknown compression algorithm: %d" % algorithm)
@@ -0,0 +1,103 @@
+import json
+import pickle
+import pytest
+try:
+    from .compression import MARKER, Compressor
+    from .emitter import Client
+    from .fakes import RecordingMqtt, make_message
+except ImportError:
+    from compression import MARKER, Compressor
+    from emitter import Client
+    from fakes import RecordingMqtt, make_message
+
+DOCUMENT = {"readings": [{"sensor": "temperature", "value": i} for i in range(100)]}
+
+def test_threshold():
+    compressor = Compressor(threshold=100, algorithm="zlib")
+    small = b"x" * 99
+    assert compressor.compress(small) is small
+    assert compressor.compress(42) == 42
+
+    large = json.dumps(DOCUMENT)
+    compressed = compressor.compress(large)
+    assert compressed.startswith(MARKER)
+    assert len(compressed) < len(large)
+    assert compressor.decompress(compressed) == large.encode("utf-8")
+    assert compressor.decompress(small) is small
+
+def test_incompressible():
+    import os
+    payload = os.urandom(4096)
+    assert Compressor(threshold=0, algorithm="zlib").compress(payload) is payload
+
+def test_receive_only():
+    compressed = Compressor(threshold=0, algorithm="zlib").compress(b"a" * 100)
+    receiver = Compressor(threshold=None)
+    assert receiver.compress(b"a" * 100) == b"a" * 100
+    assert receiver.decompress(compressed) == b"a" * 100
+
+def test_zstd():
+    pytest.importorskip("zstandard")
+    compressor = Compressor(threshold=0, algorithm="zstd")
+    compressed = compressor.compress(b"a" * 1000)
+    assert Compressor(algorithm="zlib").decompress(compressed) == b"a" * 1000
+
+def test_max_size():
+    payload = Compressor(threshold=0, algorithm="zlib").compress(b"a" * 100000)
+    assert len(Compressor(algorithm="zlib", max_size=100000).decompress(payload)) == 100000
+    assert len(Compressor(algorithm="zlib", max_size=None).decompress(payload)) == 100000
+    with pytest.raises(ValueError):
+        Compressor(algorithm="zlib", max_size=99999).decompress(payload)
+    with pytest.raises(ValueError):
+        Compressor(algorithm="zlib").decompress(payload[:20])
+
+def test_zstd_max_size():
+    zstandard = pytest.importorskip("zstandard")
+    receiver = Compressor(algorithm="zstd", max_size=1000)
+    with pytest.raises(ValueError):
+        receiver.decompress(Compressor(threshold=0, algorithm="zstd").compress(b"a" * 1001))
+    # Without the content size in the frame header.
+    unsized = MARKER + b"\x02" + zstandard.ZstdCompressor(write_content_size=False).compress(b"a" * 1001)
+    with pytest.raises(ValueError):
+        receiver.decompress(unsized)
+
+def test_client_compression():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    client.compression = Compressor(threshold=256, algorithm="zlib")
+    client.publish("key", "a/", DOCUMENT)
+    client.publish("key", "a/", "small")
+    (_, payload, _), (_, small, _) = client._mqtt.published
+    assert payload.startswith(MARKER)
+    assert small == "small"
+
+    received = []
+    client.subscribe("key", "a/", received.append)
+    client._on_message(None, None, make_message("a/", payload))
+    message = received[0]
+    assert message.raw is payload
+    assert message.as_object() == DOCUMENT
+    assert message.raw is payload
+    assert pickle.loads(pickle.dumps(message)).as_object() == DOCUMENT
+
+    # Without a compression, payloads are left as they are.
+    client.compression = None
+    client._on_message(None, None, make_message("a/", payload))
+    assert received[1].as_binary() is payload
+
+def test_async_client_compression():
+    try:
+        from .asyncclient_test import KEY, run
+    except ImportError:
+        from asyncclient_test import KEY, run
+
+    async def test(client):
+        client.compression = Compressor(threshold=256, algorithm="zlib")
+        stream = client.messages("a/")
+        await client.subscribe(KEY, "a/")
+        await client.publish(KEY, "a/", DOCUMENT)
+
+        message = await stream.__anext__()
+        assert message.raw.startswith(MARKER)
+        assert message.as_object() == DOCUMENT
+    run(test)
@@ -0,0 +1,317 @@
+"""
+Handler dispatch strategies that take handler execution off paho's network
+thread.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _invoke(handlers, message):
+    """
+    * Runs the handlers of one message on a worker, returns the time spent.
+    """
+    start = time.perf_counter()
+    for h in handlers:
+        try:
+            h(message)
+        except Exception as exception:
+            logging.exception(exception)
+    return time.perf_counter() - start
+
+
+class Dispatcher(object):
+    """
+    * Runs message handlers on a pool of workers. Messages are sharded by
+    * channel: every message of a channel goes to the same worker, so they are
+    * handled in order, while different channels are handled in parallel.
+    *
+    * With processes=True, workers are processes. Handlers must then be
+    * picklable, which excludes lambdas and bound methods of unpicklable objects.
+    *
+    * At most maxsize messages wait for or run on the workers; dispatch() blocks
+    * until one is handled beyond that. Behind an InboundQueue, the queue then
+    * fills up and its policy applies. maxsize None leaves the backlog unbounded.
+    """
+
+    def __init__(self, workers=4, processes=False, maxsize=1000):
+        self.processes = processes
+        self.maxsize = maxsize
+        self._slots = threading.Semaphore(maxsize) if maxsize else None
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        # A single-worker executor per shard runs its tasks in submission order.
+        self._shards = [executor(max_workers=1) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._depth = [0] * workers
+        self._busy = [0.0] * workers
+        self._processed = [0] * workers
+        self._started = time.perf_counter()
+
+    @property
+    def workers(self):
+        return len(self._shards)
+
+    @property
+    def queue_depth(self):
+        """
+        * The number of messages submitted but not yet handled, across workers.
+        """
+        return sum(self._depth)
+
+    def dispatch(self, handlers, message):
+        """
+        * Queues the handlers of a message on the worker owning its channel,
+        * waiting for room when maxsize messages are pending.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        shard = hash(message.channel) % len(self._shards)
+        with self._lock:
+            self._depth[shard] += 1
+        try:
+            future = self._shards[shard].submit(_invoke, handlers, message)
+        except Exception:
+            with self._lock:
+                self._depth[shard] -= 1
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._done(shard, f))
+
+    def _done(self, shard, future):
+        try:
+            elapsed = future.result()
+        except Exception as exception:
+            # The task never ran, usually because it could not be pickled.
+            logging.exception(exception)
+            elapsed = 0.0
+
+        with self._lock:
+            self._depth[shard] -= 1
+            self._busy[shard] += elapsed
+            self._processed[shard] += 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self):
+        """
+        * Returns, for each worker, its queue depth, the number of messages it
+        * handled and the fraction of time it spent in handlers.
+        """
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        with self._lock:
+            return [{"queue_depth": self._depth[i],
+                     "processed": self._processed[i],
+                     "utilisation": min(self._busy[i] / elapsed, 1.0)}
+                    for i in range(len(self._shards))]
+
+    def shutdown(self, wait=True):
+        """
+        * Stops the workers. With wait=True, pending messages are handled first.
+        """
+        for executor in self._shards:
+            executor.shutdown(wait=wait)
+
+
+class InboundQueue(object):
+    """
+    * A bounded buffer between the network thread and handler dispatch. When it
+    * is full, the policy decides what happens to an incoming message:
+    *  - BLOCK waits for room. This stalls the network thread, which stops
+    *    reading the socket and lets TCP push back on the broker. Keepalives are
+    *    delayed as well, so keep handlers well below the keepalive interval.
+    *  - DROP_OLDEST discards the oldest queued message.
+    *  - DROP_NEWEST discards the incoming message.
+    *  - CONFLATE keeps a single pending message per channel, the latest one,
+    *    and discards incoming messages of new channels once full.
+    """
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    CONFLATE = "conflate"
+
+    def __init__(self, maxsize=10000, policy=BLOCK):
+        if policy not in (self.BLOCK, self.DROP_OLDEST, self.DROP_NEWEST, self.CONFLATE):
+            raise ValueError("unknown policy: " + str(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._items = collections.OrderedDict() if policy == self.CONFLATE else collections.deque()
+        self._dropped = collections.Counter()
+        self._closed = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def dropped(self):
+        """
+        * The number of messages dropped so far, per channel.
+        """
+        with self._cond:
+            return dict(self._dropped)
+
+    def put(self, message):
+        """
+        * Queues a message, applying the policy when the queue is full.
+        """
+        channel = message.channel
+        with self._cond:
+            items = self._items
+            if self.policy == self.CONFLATE:
+                if channel in items:
+                    self._dropped[channel] += 1
+                elif len(items) >= self.maxsize:
+                    self._dropped[channel] += 1
+                    return
+                items[channel] = message
+                self._cond.notify()
+                return
+
+            if len(items) >= self.maxsize:
+                if self.policy == self.BLOCK:
+                    while len(items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                elif self.policy == self.DROP_OLDEST:
+                    self._dropped[items.popleft().channel] += 1
+                else:
+                    self._dropped[channel] += 1
+                    return
+
+            items.append(message)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        * Removes and returns the oldest message. Returns None on timeout, or
+        * once the queue is closed and empty.
+        """
+        with self._cond:
+            items = self._items
+            if not items and not self._closed:
+                self._cond.wait_for(lambda: items or self._closed, timeout)
+            if not items:
+                return None
+
+            if self.policy == self.CONFLATE:
+                _, message = items.popitem(last=False)
+            else:
+                message = items.popleft()
+            # Wake up producers blocked on a full queue.
+            self._cond.notify_all()
+            return message
+
+    def start(self, sink):
+        """
+        * Starts a thread passing every queued message to sink, in order.
+        """
+        def run():
+            while True:
+                message = self.get()
+                if message is None:
+                    return
+                try:
+                    sink(message)
+                except Exception as exception:
+                    logging.exception(exception)
+
+        self._thread = threading.Thread(target=run, name="emitter-inbound", daemon=True)
+        self._thread.start()
+
+    def close(self, wait=True):
+        """
+        * Stops accepting messages. The thread exits once the queue is drained.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+
+class ConflatingHandler(object):
+    """
+    * Wraps a handler so that it never runs concurrently with itself and, while
+    * it is busy, only the latest pending message of each channel is kept. With
+    * max_rate, each channel is delivered at most max_rate times per second and
+    * the messages received in between are conflated as well.
+    *
+    * Calls only store the message: a dedicated thread delivers them, started
+    * on demand and exiting once there is nothing left to deliver. The hooks
+    * of the client are reported the duration of the handler from that thread.
+    """
+
+    def __init__(self, handler, max_rate=None):
+        self.handler = handler
+        self.conflated = 0
+        self._interval = 1.0 / max_rate if max_rate else 0.0
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._last = {}
+        self._prune_at = 64
+        self._worker = None
+
+    def __call__(self, message):
+        with self._cond:
+            if message.channel in self._pending:
+                self.conflated += 1
+            self._pending[message.channel] = message
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="emitter-conflate", daemon=True)
+                self._worker.start()
+            else:
+                self._cond.notify()
+
+    def _next(self, now):
+        # Returns the first channel ready to be delivered, or how long to wait.
+        wait = None
+        for channel in self._pending:
+            ready = self._last.get(channel, 0.0) + self._interval
+            if ready <= now:
+                if self._interval:
+                    self._last[channel] = now
+                return self._pending.pop(channel), None
+            wait = ready - now if wait is None else min(wait, ready - now)
+        return None, wait
+
+    def _prune(self, now):
+        # Forgets the delivery times of the channels past their interval with
+        # nothing pending, which no longer delay anything.
+        horizon = now - self._interval
+        for channel in [c for c, last in self._last.items() if last <= horizon and c not in self._pending]:
+            del self._last[channel]
+        self._prune_at = max(64, 2 * len(self._last))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if len(self._last) > self._prune_at:
+                        self._prune(now)
+                    message, wait = self._next(now)
+                    if message is not None:
+                        break
+                    if wait is None:
+                        self._prune(now)
+                        if not self._last:
+                            self._worker = None
+                            return
+                        # Wakes up to prune the channels still in their interval.
+                        wait = min(self._last.values()) + self._interval - now
+                    self._cond.wait(wait)
+
+            start = time.perf_counter()
+            try:
+                self.handler(message)
+            except Exception as exception:
+                logging.exception(exception)
+            # The hooks of the client travel with its messages.
+            hooks = getattr(message, "_hooks", None)
+            if hooks:
+                elapsed = time.perf_counter() - start
+                for hook in hooks:
+                    hook.handled(self.handler, message, elapsed)
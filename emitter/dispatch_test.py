@@ -0,0 +1,265 @@
+import threading
+import time
+import paho.mqtt.client as mqtt
+try:
+    from .dispatch import ConflatingHandler, Dispatcher, InboundQueue
+    from .emitter import Client, EmitterMessage
+    from .fakes import make_message
+except ImportError:
+    from dispatch import ConflatingHandler, Dispatcher, InboundQueue
+    from emitter import Client, EmitterMessage
+    from fakes import make_message
+
+def record(message):
+    pass
+
+def test_order_is_preserved_per_channel():
+    dispatcher = Dispatcher(workers=4)
+    received = {}
+    lock = threading.Lock()
+
+    def handler(message):
+        time.sleep(0.0001)
+        with lock:
+            received.setdefault(message.channel, []).append(message.as_binary())
+
+    for i in range(200):
+        channel = "c%d/" % (i % 8)
+        dispatcher.dispatch((handler,), EmitterMessage(make_message(channel, b"%d" % i)))
+    dispatcher.shutdown(wait=True)
+
+    for i in range(8):
+        expected = [b"%d" % j for j in range(i, 200, 8)]
+        assert received["c%d/" % i] == expected
+
+def test_stats():
+    dispatcher = Dispatcher(workers=2)
+    release = threading.Event()
+    dispatcher.dispatch((lambda m: release.wait(),), EmitterMessage(make_message("a/")))
+    dispatcher.dispatch((lambda m: None,), EmitterMessage(make_message("a/")))
+
+    assert dispatcher.queue_depth == 2
+    release.set()
+    dispatcher.shutdown(wait=True)
+
+    stats = dispatcher.stats()
+    assert len(stats) == 2
+    assert dispatcher.queue_depth == 0
+    assert sum(s["processed"] for s in stats) == 2
+    assert all(0.0 <= s["utilisation"] <= 1.0 for s in stats)
+
+def test_process_workers():
+    dispatcher = Dispatcher(workers=2, processes=True)
+    for i in range(10):
+        dispatcher.dispatch((record,), EmitterMessage(make_message("c%d/" % i, b"x")))
+    dispatcher.shutdown(wait=True)
+
+    assert sum(s["processed"] for s in dispatcher.stats()) == 10
+
+def test_client_uses_dispatcher():
+    client = Client()
+    client.dispatcher = Dispatcher(workers=2)
+    received = []
+    client.on_message = lambda m: received.append(m.channel)
+    client._handler_trie_message.insert("a/", lambda m: received.append("handler"))
+
+    client._on_message(None, None, make_message("a/"))
+    client._on_message(None, None, make_message("b/"))
+    client.dispatcher.shutdown(wait=True)
+
+    assert sorted(received) == ["b/", "handler"]
+
+def test_dispatcher_backlog_is_bounded():
+    dispatcher = Dispatcher(workers=1, maxsize=2)
+    release = threading.Event()
+    for _ in range(2):
+        dispatcher.dispatch((lambda m: release.wait(),), EmitterMessage(make_message("a/")))
+
+    producer = threading.Thread(target=lambda: dispatcher.dispatch((record,), EmitterMessage(make_message("a/"))))
+    producer.start()
+    producer.join(0.05)
+    assert producer.is_alive()
+    assert dispatcher.queue_depth == 2
+
+    release.set()
+    producer.join()
+    dispatcher.shutdown(wait=True)
+    assert sum(s["processed"] for s in dispatcher.stats()) == 3
+
+def test_inbound_policy_applies_behind_dispatcher():
+    client = Client()
+    release = threading.Event()
+    received = []
+    client.on_message = lambda m: (release.wait(), received.append(m.as_binary()))
+    client.dispatcher = Dispatcher(workers=1, maxsize=1)
+    client.inbound_queue = InboundQueue(maxsize=2, policy=InboundQueue.DROP_NEWEST)
+
+    for i in range(10):
+        client._on_message(None, None, make_message("a/", b"%d" % i))
+    release.set()
+    client.inbound_queue.close()
+    client.dispatcher.shutdown(wait=True)
+
+    # One handled, one waiting for the dispatcher, two queued.
+    assert len(received) <= 4
+    assert sum(client.inbound_queue.dropped.values()) == 10 - len(received)
+
+def message(channel, payload=b""):
+    return EmitterMessage(make_message(channel, payload))
+
+def drain(queue):
+    received = []
+    while len(queue):
+        received.append(queue.get().as_binary())
+    return received
+
+def test_inbound_drop_oldest():
+    queue = InboundQueue(maxsize=2, policy=InboundQueue.DROP_OLDEST)
+    for i in range(4):
+        queue.put(message("a/", b"%d" % i))
+
+    assert drain(queue) == [b"2", b"3"]
+    assert queue.dropped == {"a/": 2}
+
+def test_inbound_drop_newest():
+    queue = InboundQueue(maxsize=2, policy=InboundQueue.DROP_NEWEST)
+    queue.put(message("a/", b"0"))
+    queue.put(message("a/", b"1"))
+    queue.put(message("b/", b"2"))
+
+    assert drain(queue) == [b"0", b"1"]
+    assert queue.dropped == {"b/": 1}
+
+def test_inbound_conflate():
+    queue = InboundQueue(maxsize=2, policy=InboundQueue.CONFLATE)
+    queue.put(message("a/", b"a0"))
+    queue.put(message("b/", b"b0"))
+    queue.put(message("a/", b"a1"))
+    queue.put(message("c/", b"c0"))
+
+    assert drain(queue) == [b"a1", b"b0"]
+    assert queue.dropped == {"a/": 1, "c/": 1}
+
+def test_inbound_block():
+    queue = InboundQueue(maxsize=1, policy=InboundQueue.BLOCK)
+    queue.put(message("a/", b"0"))
+
+    producer = threading.Thread(target=lambda: queue.put(message("a/", b"1")))
+    producer.start()
+    producer.join(0.05)
+    assert producer.is_alive()
+
+    assert queue.get().as_binary() == b"0"
+    producer.join()
+    assert drain(queue) == [b"1"]
+    assert queue.dropped == {}
+
+def test_client_uses_inbound_queue():
+    client = Client()
+    received = []
+    client.on_message = lambda m: received.append(m.as_binary())
+    client.inbound_queue = InboundQueue(maxsize=10)
+
+    for i in range(5):
+        client._on_message(None, None, make_message("a/", b"%d" % i))
+    client.inbound_queue.close()
+
+    assert received == [b"0", b"1", b"2", b"3", b"4"]
+
+def test_conflating_handler_keeps_latest_while_busy():
+    received = []
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+
+    def handler(m):
+        received.append(m.as_binary())
+        if len(received) == 1:
+            started.set()
+            release.wait()
+        elif len(received) == 3:
+            done.set()
+
+    conflating = ConflatingHandler(handler)
+    conflating(message("a/", b"a0"))
+    assert started.wait(1)
+
+    conflating(message("a/", b"a1"))
+    conflating(message("b/", b"b0"))
+    conflating(message("a/", b"a2"))
+    release.set()
+
+    assert done.wait(1)
+    assert received == [b"a0", b"a2", b"b0"]
+    assert conflating.conflated == 1
+
+def test_conflating_handler_max_rate():
+    received = []
+    first = threading.Event()
+    done = threading.Event()
+
+    def handler(m):
+        received.append(m.as_binary())
+        first.set()
+        if m.as_binary() == b"4":
+            done.set()
+
+    conflating = ConflatingHandler(handler, max_rate=20)
+    conflating(message("a/", b"0"))
+    assert first.wait(1)
+    for i in range(1, 5):
+        conflating(message("a/", b"%d" % i))
+
+    assert received == [b"0"]
+    assert done.wait(1)
+    assert received == [b"0", b"4"]
+    assert conflating.conflated == 3
+
+def test_conflating_handler_prunes_delivery_times():
+    done = threading.Event()
+    conflating = ConflatingHandler(lambda m: done.set() if m.channel == "c99/" else None, max_rate=50)
+    for i in range(100):
+        conflating(message("c%d/" % i))
+    assert done.wait(1)
+
+    deadline = time.monotonic() + 1
+    while conflating._worker is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert conflating._worker is None
+    assert conflating._last == {}
+
+def test_subscribe_with_conflation():
+    client = Client()
+    client._mqtt = mqtt.Client()
+    client.subscribe("key", "a/", lambda m: None, max_rate=10)
+
+    handler, = client._handler_trie_message.lookup("a/")
+    assert isinstance(handler, ConflatingHandler)
+
+def test_client_conflates_without_max_rate():
+    client = Client()
+    client._mqtt = mqtt.Client()
+    received = []
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+
+    def handler(m):
+        received.append(m.as_binary())
+        started.set()
+        release.wait()
+        if m.as_binary() == b"9":
+            done.set()
+
+    client.subscribe("key", "a/", handler, conflate=True)
+    client._on_message(None, None, make_message("a/", b"0"))
+    assert started.wait(1)
+    # The network thread is not held up by the busy handler.
+    for i in range(1, 10):
+        client._on_message(None, None, make_message("a/", b"%d" % i))
+    release.set()
+
+    assert done.wait(1)
+    assert received == [b"0", b"9"]
+    conflating, = client._handler_trie_message.lookup("a/")
+    assert conflating.conflated == 8
@@ -5,15 +5,39 @@ This is the Python client for Emitter (emitter.io).
 GitHub: github.com/emitter-io/python
 License: Eclipse Public License 1.0 (EPL-1.0)
 """
+import collections
 import json
 import re
 import logging
 import ssl
+import threading
+import time
+from concurrent.futures import Future
 import paho.mqtt.client as mqtt
 try:
+    from .codec import JsonCodec
+    from .dispatch import ConflatingHandler
+    from .hooks import HookedHandler
     from .subtrie import SubTrie
+    from .tracker import RequestTracker
 except ImportError:
+   from codec import JsonCodec
+   from dispatch import ConflatingHandler
+   from hooks import HookedHandler
    from subtrie import SubTrie
+   from tracker import RequestTracker
+
+
+_CONTROL_PREFIX = "emitter/"
+
+# Payloads handed to paho as they are, anything else goes through a codec.
+_RAW_PAYLOADS = (str, bytes, bytearray, int, float, type(None))
+
+# Seconds to wait for the response to a control request, by default.
+_REQUEST_TIMEOUT = 10
+
+# Topics per SUBSCRIBE or UNSUBSCRIBE packet sent by the bulk operations.
+_SUBSCRIBE_BATCH = 500
 
 
 class Client(object):
@@ -36,6 +60,44 @@ class Client(object):
 		self._handler_me = None
 		self._handler_keygen = None
 		self._handler_keyban = None
+		self._dispatcher = None
+		self._inbound_queue = None
+		self._publish_lock = threading.Lock()
+		self._publish_pending = {}
+		# Control requests and responses are always JSON.
+		self._json = JsonCodec()
+		self._codec = self._json
+		self._codec_trie = SubTrie()
+		self._codec_patterns = {}
+		self._requests = RequestTracker()
+		self._key_manager = None
+		# The threads reading the socket of each MQTT client, which must not
+		# wait for keygen responses they read themselves.
+		self._network_threads = {}
+		# Internal components following the connection state, called with True
+		# once connected and False once disconnected.
+		self._connection_listeners = []
+		# Active subscriptions, replayed on reconnection, by channel and share group.
+		self._subscriptions = collections.OrderedDict()
+		# The subscriptions sent on the current connection of each MQTT client.
+		self._subscriptions_sent = {}
+		self._subscriptions_lock = threading.Lock()
+		self._outbox = None
+		self._outbox_lock = threading.Lock()
+		self._outbox_draining = False
+		self._metrics = None
+		self._compression = None
+		# Replaced rather than mutated, so that threads iterate a stable tuple.
+		self._hooks = ()
+		# Handlers of the "emitter/<name>/" control topics, by name.
+		self._control_handlers = {
+			"keygen": self._on_keygen,
+			"keyban": self._on_keyban,
+			"presence": self._on_presence,
+			"error": self._on_error,
+			"me": self._on_me,
+			"link": self._on_link,
+		}
 
 	@property
 	def on_connect(self):
@@ -93,6 +155,283 @@ class Client(object):
 	def on_message(self, func):
 		self._handler_message = func
 
+	@property
+	def dispatcher(self):
+		"""
+		* The Dispatcher running message handlers off the network thread, or None
+		* to run them inline.
+		"""
+		return self._dispatcher
+	@dispatcher.setter
+	def dispatcher(self, dispatcher):
+		self._dispatcher = dispatcher
+
+	@property
+	def codec(self):
+		"""
+		* The codec encoding published objects and decoding received payloads,
+		* for the channels without a codec of their own. Defaults to JSON.
+		"""
+		return self._codec
+	@codec.setter
+	def codec(self, codec):
+		self._codec = codec
+
+	@property
+	def compression(self):
+		"""
+		* The Compressor compressing large published payloads and decompressing
+		* the received ones which were compressed, or None to do neither.
+		"""
+		return self._compression
+	@compression.setter
+	def compression(self, compression):
+		self._compression = compression
+
+	def set_codec(self, channel, codec):
+		"""
+		* Sets the codec of a channel pattern, wildcards included, or removes it
+		* when codec is None. When several patterns match a channel, the longest
+		* one wins.
+		"""
+		if codec is None:
+			self._codec_patterns.pop(channel, None)
+			self._codec_trie.delete(channel)
+		else:
+			self._codec_patterns[channel] = codec
+			depth = len(list(SubTrie._get_words(channel)))
+			self._codec_trie.insert(channel, (depth, codec))
+
+	def _codec_for(self, channel):
+		if not self._codec_patterns:
+			return self._codec
+		matches = self._codec_trie.lookup(channel)
+		if not matches:
+			return self._codec
+		return max(matches, key=lambda match: match[0])[1]
+
+	@property
+	def key_manager(self):
+		"""
+		* The KeyManager resolving the key of the operations given key=None.
+		"""
+		return self._key_manager
+	@key_manager.setter
+	def key_manager(self, manager):
+		self._key_manager = manager
+
+	def _check_key(self, key):
+		"""
+		* Raises unless key is given or a key manager is set.
+		"""
+		if key is None and self._key_manager is None:
+			raise ValueError("a key is required when no key manager is set")
+
+	def _key_futures(self, channels):
+		"""
+		* Returns the futures of the keys of channels, from the key manager.
+		"""
+		self._check_key(None)
+		# Every key is requested before waiting for the first one.
+		return dict((channel, self._key_manager.key_async(channel)) for channel in channels)
+
+	def _with_key(self, key, channel, action):
+		"""
+		* Calls action with key, or else with the key of channel from the key manager.
+		"""
+		if key is not None:
+			action(key)
+			return
+		self._with_keys(None, (channel,), lambda keys: action(keys[channel]))
+
+	def _with_keys(self, key, channels, action):
+		"""
+		* Calls action with key, or else with a dict of the keys of channels from
+		* the key manager, waiting for the ones not cached yet. On a network
+		* thread, which reads the keygen responses itself, action is deferred
+		* until they arrive instead, and its failures are logged.
+		"""
+		if key is not None:
+			action(key)
+			return
+
+		futures = self._key_futures(channels)
+		pending = [future for future in futures.values() if not future.done()]
+		if not pending or not self._on_network_thread():
+			timeout = self._key_manager.timeout
+			action(dict((channel, future.result(timeout)) for channel, future in futures.items()))
+			return
+
+		remaining = [len(pending)]
+		lock = threading.Lock()
+		def resolved(_):
+			with lock:
+				remaining[0] -= 1
+				if remaining[0]:
+					return
+			try:
+				action(dict((channel, future.result()) for channel, future in futures.items()))
+			except Exception as exception:
+				logging.exception(exception)
+		for future in pending:
+			future.add_done_callback(resolved)
+
+	def _on_network_thread(self):
+		return threading.get_ident() in self._network_threads.values()
+
+	@property
+	def metrics(self):
+		"""
+		* The Metrics collecting message counts, lookup and handler times and
+		* queue depths, or None to collect nothing.
+		"""
+		return self._metrics
+	@metrics.setter
+	def metrics(self, metrics):
+		if self._metrics is not None:
+			self.remove_hook(self._metrics)
+		if metrics is not None:
+			self.add_hook(metrics)
+			metrics.gauge("paho_queue", lambda: len(self._mqtt._out_messages) if self._mqtt is not None else 0)
+			metrics.gauge("inbound_queue", lambda: len(self._inbound_queue) if self._inbound_queue is not None else 0)
+			metrics.gauge("dispatcher_queue", lambda: self._dispatcher.queue_depth if self._dispatcher is not None else 0)
+			metrics.gauge("outbox", lambda: len(self._outbox) if self._outbox is not None else 0)
+		self._metrics = metrics
+
+	def add_hook(self, hook):
+		"""
+		* Adds a Hook observing the receive path: message arrival, trie lookup,
+		* decoding and each handler invocation, with the time each one took.
+		"""
+		self._hooks = self._hooks + (hook,)
+
+	def remove_hook(self, hook):
+		"""
+		* Removes a hook added with add_hook().
+		"""
+		self._hooks = tuple(h for h in self._hooks if h is not hook)
+
+	@property
+	def outbox(self):
+		"""
+		* The Outbox keeping the messages published while disconnected, until
+		* they are sent once connected, or None to hand them to paho right away.
+		"""
+		return self._outbox
+	@outbox.setter
+	def outbox(self, outbox):
+		self._outbox = outbox
+		if outbox is not None and self._on_outbox_connection not in self._connection_listeners:
+			self._connection_listeners.append(self._on_outbox_connection)
+
+	def _prepare(self, channel, message, codec=None):
+		"""
+		* Returns a message as published: encoded with the codec of the channel
+		* unless it is a string, bytes or a number, and compressed.
+		"""
+		if not isinstance(message, _RAW_PAYLOADS):
+			message = (codec or self._codec_for(channel)).encode(message)
+		if self._compression is not None:
+			message = self._compression.compress(message)
+		return message
+
+	def _send(self, mqtt_client, channel, topic, message, qos, retain):
+		"""
+		* Publishes a prepared message, through the outbox while disconnected or
+		* while the outbox is not empty, so that messages keep their order.
+		* Returns paho's MQTTMessageInfo, or None when the message went to the outbox.
+		"""
+		if self._metrics is not None:
+			self._metrics.published(channel, _size(message))
+		outbox = self._outbox
+		if outbox is None:
+			return mqtt_client.publish(topic, message, qos=qos, retain=retain)
+
+		with self._outbox_lock:
+			connected = mqtt_client is not None and mqtt_client.is_connected()
+			if connected and not len(outbox):
+				return mqtt_client.publish(topic, message, qos=qos, retain=retain)
+			outbox.append(topic, message, qos, retain)
+		if connected:
+			self._drain_outbox()
+		return None
+
+	def _on_outbox_connection(self, connected):
+		if connected and len(self._outbox):
+			self._drain_outbox()
+
+	def _drain_outbox(self):
+		with self._outbox_lock:
+			if self._outbox_draining:
+				return
+			self._outbox_draining = True
+		# Off the network thread, which reads the acknowledgements waited for.
+		threading.Thread(target=self._run_outbox, name="emitter-outbox", daemon=True).start()
+
+	def _run_outbox(self):
+		outbox = self._outbox
+		try:
+			while True:
+				with self._outbox_lock:
+					messages, offset = outbox.peek(outbox.batch)
+					if not messages:
+						self._outbox_draining = False
+						return
+
+				if not self._send_outbox_batch(messages):
+					# Disconnected again, the batch is sent again on the next connection.
+					with self._outbox_lock:
+						self._outbox_draining = False
+					return
+				outbox.commit(offset)
+		except Exception as exception:
+			logging.exception(exception)
+			with self._outbox_lock:
+				self._outbox_draining = False
+
+	def _send_outbox_batch(self, messages):
+		infos = []
+		in_flight = collections.deque()
+		for topic, message, qos, retain in messages:
+			# The channel lies between the key and the options.
+			mqtt_client = self._mqtt_for(topic.partition("/")[2].partition("?")[0])
+			if qos > 0:
+				# paho holds back QoS1 messages above its in-flight limit, and the
+				# QoS0 ones following them would overtake them.
+				limit = getattr(mqtt_client, "_max_inflight_messages", 0)
+				while limit and len(in_flight) >= limit:
+					if not self._wait_published(in_flight.popleft()):
+						return False
+			info = mqtt_client.publish(topic, message, qos=qos, retain=retain)
+			infos.append(info)
+			if qos > 0:
+				in_flight.append(info)
+
+		return all(self._wait_published(info) for info in infos)
+
+	@staticmethod
+	def _wait_published(info):
+		try:
+			info.wait_for_publish(_REQUEST_TIMEOUT)
+		except (RuntimeError, ValueError):
+			return False
+		return info.rc == mqtt.MQTT_ERR_SUCCESS and info.is_published()
+
+	@property
+	def inbound_queue(self):
+		"""
+		* The InboundQueue buffering messages between the network thread and
+		* handler dispatch, or None to dispatch them right away.
+		"""
+		return self._inbound_queue
+	@inbound_queue.setter
+	def inbound_queue(self, queue):
+		if self._inbound_queue is not None:
+			self._inbound_queue.close()
+		self._inbound_queue = queue
+		if queue is not None:
+			queue.start(self._dispatch_message)
+
 	def loop(self, timeout):
 		"""
 		* Call regularly to process network events. This call waits in select()
@@ -133,6 +472,11 @@ class Client(object):
 		"""
 		* Occurs when connection is established.
 		"""
+		self._network_threads[client] = threading.get_ident()
+		if rc == 0:
+			self._resubscribe(client, flags)
+			for listener in self._connection_listeners:
+				listener(True)
 		if self._handler_connect:
 			self._handler_connect()
 		
@@ -141,89 +485,227 @@ class Client(object):
 		"""
 		* Occurs when the connection was lost.
 		"""
+		self._connection_lost(client)
+		for listener in self._connection_listeners:
+			listener(False)
 		if self._handler_disconnect:
 			self._handler_disconnect()
 
 	def _invoke_trie_handlers(self, trie, default_handler, message):
-		handlers = trie.lookup(message.channel)
-		if len(handlers) == 0 and default_handler:
-				default_handler(message)
+		hooks = self._hooks
+		if not hooks:
+			handlers = trie.lookup(message.channel)
+		else:
+			start = time.perf_counter()
+			handlers = trie.lookup(message.channel)
+			elapsed = time.perf_counter() - start
+			for hook in hooks:
+				hook.looked_up(message, handlers, elapsed)
+
+		if len(handlers) == 0:
+			if not default_handler:
+				return
+			handlers = (default_handler,)
+
+		if hooks:
+			# Measured where they run: processes cannot report back to hooks, and
+			# conflating handlers report from their own thread.
+			if self._dispatcher is None or not self._dispatcher.processes:
+				handlers = tuple(h if isinstance(h, ConflatingHandler) else HookedHandler(h, hooks) for h in handlers)
+
+		if self._dispatcher is not None:
+			self._dispatcher.dispatch(handlers, message)
+			return
 
 		for h in handlers:
 			h(message)
-		
+
+	def _dispatch_message(self, message):
+		self._invoke_trie_handlers(self._handler_trie_message, self._handler_message, message)
+
+	def _on_publish(self, client, userdata, mid):
+		"""
+		* Occurs when a QoS0 message was sent or a QoS1 message acknowledged.
+		"""
+		with self._publish_lock:
+			entry = self._publish_pending.pop((client, mid), None)
+		if entry is not None:
+			batch, index = entry
+			batch._acknowledged(index)
+
+	def _track_publish(self, mqtt_client, mid, batch, index):
+		# Packet ids are only unique per connection.
+		with self._publish_lock:
+			self._publish_pending[(mqtt_client, mid)] = (batch, index)
 
 	def _on_message(self, client, userdata, msg):
-		message = EmitterMessage(msg)
-		
-		# Non-emitter messages are far more frequent, so if it is one, return earlier.
-		if (not message.channel.startswith("emitter")):
-			self._invoke_trie_handlers(self._handler_trie_message, self._handler_message, message)
+		message = EmitterMessage(msg, self._json)
+		channel = message.channel
 
-		if self._handler_keygen and message.channel.startswith("emitter/keygen"):
-			# This is a keygen message.
+		# Non-emitter messages are far more frequent, so if it is one, return earlier.
+		if not channel.startswith(_CONTROL_PREFIX):
+			message.codec = self._codec_for(channel)
+			if self._compression is not None:
+				# Decompressed once a handler reads the payload.
+				message._compression = self._compression
+			hooks = self._hooks
+			if hooks:
+				message._hooks = hooks
+				for hook in hooks:
+					hook.received(message)
+			if self._inbound_queue is not None:
+				self._inbound_queue.put(message)
+			else:
+				self._dispatch_message(message)
+			return
+
+		# A control message, dispatched on the segment following "emitter/".
+		handler = self._control_handlers.get(channel[len(_CONTROL_PREFIX):].partition("/")[0])
+		if handler is not None:
+			handler(message)
+
+	def _on_keygen(self, message):
+		self._requests.resolve("keygen", message.as_object())
+		if self._handler_keygen:
 			self._handler_keygen(message.as_object())
 
-		elif self._handler_keyban and message.channel.startswith("emitter/keyban"):
-			# This is a keyban message.
+	def _on_keyban(self, message):
+		self._requests.resolve("keyban", message.as_object())
+		if self._handler_keyban:
 			self._handler_keyban(message.as_object())
 
-		elif message.channel.startswith("emitter/presence"):
-			# This is a presence message.
-			#self._invoke_trie_handlers(self._handler_trie_presence, self._handler_presence, message)
-			messageContent = message.as_object()
-			handlers = self._handler_trie_presence.lookup(messageContent["channel"])
-			if len(handlers) == 0 and self._handler_presence:
-				self._handler_presence(messageContent)
-			for h in handlers:
-				h(messageContent)
-
-		elif self._handler_error and message.channel.startswith("emitter/error"):
-			# This is an error message.
+	def _on_presence(self, message):
+		# Presence handlers are registered for the channel inside the payload.
+		messageContent = message.as_object()
+		self._requests.resolve("presence", messageContent)
+		handlers = self._handler_trie_presence.lookup(messageContent["channel"])
+		if len(handlers) == 0 and self._handler_presence:
+			self._handler_presence(messageContent)
+		for h in handlers:
+			h(messageContent)
+
+	def _on_error(self, message):
+		self._requests.fail(message.as_object())
+		if self._handler_error:
 			self._handler_error(message.as_object())
 
-		elif self._handler_me and message.channel.startswith("emitter/me"):
-			# This is a "me" message, giving information about the connection.
+	def _on_me(self, message):
+		# A "me" message gives information about the connection.
+		self._requests.resolve("me", message.as_object())
+		if self._handler_me:
 			self._handler_me(message.as_object())
-	
-	def connect(self, host="api.emitter.io", port=443, secure=True, keepalive=30, username=None):
+
+	def _on_link(self, message):
+		self._requests.resolve("link", message.as_object())
+
+	def connect(self, host="api.emitter.io", port=443, secure=True, keepalive=30, username=None, max_inflight=100):
 		"""
-		* Connects to an Emitter server.
+		* Connects to an Emitter server. max_inflight is the number of QoS1
+		* messages awaiting an acknowledgement at once, paho queues the others.
 		"""
 		formatted_host = re.sub(r"/.*?:\/\//g", "", host)
-		self._mqtt = mqtt.Client()
+		self._mqtt = self._create_mqtt(secure, username, max_inflight)
+		self._mqtt.connect(host=formatted_host, port=port, keepalive=keepalive)
+
+	def _mqtt_for(self, channel):
+		"""
+		* Returns the MQTT client carrying the traffic of a channel.
+		"""
+		return self._mqtt
+
+	def _create_mqtt(self, secure, username, max_inflight):
+		"""
+		* Creates the underlying MQTT client, with callbacks routed to this instance.
+		"""
+		client = mqtt.Client()
+		client.max_inflight_messages_set(max_inflight)
 
 		if secure:
 			ssl_ctx = ssl.create_default_context()
-			self._mqtt.tls_set_context(ssl_ctx)
+			client.tls_set_context(ssl_ctx)
 
 		if username is not None:
-			self._mqtt.username_pw_set(username)
-
-		self._mqtt.on_connect = self._on_connect
-		self._mqtt.on_disconnect = self._on_disconnect
-		self._mqtt.on_message = self._on_message
+			client.username_pw_set(username)
 
-		self._mqtt.connect(host=formatted_host, port=port, keepalive=keepalive)
+		client.on_connect = self._on_connect
+		client.on_disconnect = self._on_disconnect
+		client.on_message = self._on_message
+		client.on_publish = self._on_publish
+		return client
 
 	def publish(self, key, channel, message, options={}):
 		"""
-		* Publishes a message to a channel.
+		* Publishes a message to a channel. Strings, bytes and numbers are sent as
+		* they are, other objects are encoded with the codec of the channel. With
+		* key=None, the key comes from the key manager.
 		"""
-		topic = self._format_channel(key, channel, options)
 		qos, retain = Client._get_header(options)
+		message = self._prepare(channel, message)
+		self._with_key(key, channel, lambda key: self._send(
+			self._mqtt_for(channel), channel, self._format_channel(key, channel, options), message, qos, retain))
 
-		self._mqtt.publish(topic, message, qos=qos, retain=retain)
+	def channel(self, key, channel, options={}):
+		"""
+		* Returns a ChannelHandle for publishing repeatedly to a channel, with the
+		* topic and header formatted once. With key=None, the key comes from the
+		* key manager on each publish, so that refreshed keys are picked up.
+		"""
+		self._check_key(key)
+		return ChannelHandle(self, key, channel, options)
 
-	def subscribe(self, key, channel, optional_handler=None, options={}):
+	def publish_many(self, key, messages, window=100):
 		"""
-		* Subscribes to a particual share group.
+		* Publishes a batch of (channel, message, options) tuples, in order. QoS1
+		* messages are pipelined: up to window of them are in flight at once, and
+		* the next ones are sent as acknowledgements come back. paho queues the
+		* messages above the max_inflight limit of connect(), so the effective
+		* window is the smaller of both. QoS1 messages published while
+		* disconnected are kept by paho and sent once reconnected, so they only
+		* complete when acknowledged then. Returns a PublishBatch tracking the completion
+		* of the whole batch. With key=None, each channel gets its key from the
+		* key manager. With an outbox, a batch published while disconnected or
+		* while the outbox is not empty goes to the outbox, and its messages
+		* complete once stored.
+		"""
+		batch = PublishBatch(self, key, messages, window)
+		# Resolved upfront, as the batch is also pumped from the network thread,
+		# which must not wait for keygen responses it reads itself.
+		self._with_keys(key, set(channel for channel, _, _ in batch._messages), batch._start)
+		return batch
+
+	def subscribe(self, key, channel, optional_handler=None, options={}, conflate=False, max_rate=None):
+		"""
+		* Subscribes to a particular channel.
+		* With conflate, the handler only receives the latest message of each
+		* channel while it is busy, and runs on a thread of its own. max_rate
+		* additionally caps deliveries to that many per second and per channel,
+		* and implies conflate.
+		* With key=None, the key comes from the key manager.
 		"""
 		if optional_handler is not None:
+			if conflate or max_rate:
+				optional_handler = ConflatingHandler(optional_handler, max_rate)
 			self._handler_trie_message.insert(channel, optional_handler)
 
-		topic = Client._format_channel(key, channel, options)
-		self._mqtt.subscribe(topic)
+		self._with_key(key, channel, lambda key: self._subscribe_topic(
+			channel, None, Client._format_channel(key, channel, options)))
+		self._remember_subscription(key, channel, None, options)
+
+	def subscribe_many(self, key, channels, optional_handler=None, options={}):
+		"""
+		* Subscribes to many channels at once, sending a single SUBSCRIBE packet
+		* for up to 500 of them. optional_handler is registered for each channel.
+		* With key=None, the keys come from the key manager.
+		"""
+		channels = list(channels)
+		self._check_key(key)
+		if optional_handler is not None:
+			self._handler_trie_message.insert_many((channel, optional_handler) for channel in channels)
+
+		for channel in channels:
+			self._remember_subscription(key, channel, None, options)
+		self._with_keys(key, set(channels), lambda keys: self._send_subscriptions(
+			[(channel, None, Client._format_channel(_key_of(keys, channel), channel, options)) for channel in channels]))
 
 	def subscribe_with_group(self, key, channel, share_group, optional_handler=None, options={}):
 		"""
@@ -232,16 +714,111 @@ class Client(object):
 		if optional_handler is not None:
 			self._handler_trie_message.insert(channel, optional_handler)
 
-		topic = Client._format_channel_share(key, channel, share_group, options)
-		self._mqtt.subscribe(topic)
+		self._with_key(key, channel, lambda key: self._subscribe_topic(
+			channel, share_group, Client._format_channel_share(key, channel, share_group, options)))
+		self._remember_subscription(key, channel, share_group, options)
 
 	def unsubscribe(self, key, channel):
 		"""
 		* Unsubscribes from a particular channel.
 		"""
 		self._handler_trie_message.delete(channel)
-		topic = self._format_channel(key, channel)
-		self._mqtt.unsubscribe(topic)
+		self._forget_subscription(channel)
+		self._with_key(key, channel, lambda key: self._mqtt_for(channel).unsubscribe(self._format_channel(key, channel)))
+
+	def unsubscribe_many(self, key, channels):
+		"""
+		* Unsubscribes from many channels at once, sending a single UNSUBSCRIBE
+		* packet for up to 500 of them.
+		"""
+		channels = list(channels)
+		self._check_key(key)
+		self._handler_trie_message.delete_many(channels)
+
+		for channel in channels:
+			self._forget_subscription(channel)
+		self._with_keys(key, set(channels), lambda keys: self._send_subscriptions(
+			[(channel, None, Client._format_channel(_key_of(keys, channel), channel)) for channel in channels], unsubscribe=True))
+
+	def _remember_subscription(self, key, channel, share_group, options):
+		# Without "last", which asks for stored messages already received once.
+		# key=None is kept as is, the key manager is asked again on replay.
+		options = [o for o in options if not o.startswith("last=")] if options else ()
+		with self._subscriptions_lock:
+			self._subscriptions[(channel.strip("/"), share_group)] = (channel, key, share_group, options)
+
+	def _forget_subscription(self, channel):
+		subscription = (channel.strip("/"), None)
+		with self._subscriptions_lock:
+			self._subscriptions.pop(subscription, None)
+			for sent in self._subscriptions_sent.values():
+				sent.discard(subscription)
+
+	def _subscribed(self, mqtt_client, subscriptions):
+		# (channel, share_group) subscriptions sent on the current connection,
+		# which are not replayed once it is acknowledged.
+		with self._subscriptions_lock:
+			sent = self._subscriptions_sent.setdefault(mqtt_client, set())
+			sent.update((channel.strip("/"), share_group) for channel, share_group in subscriptions)
+
+	def _connection_lost(self, mqtt_client):
+		with self._subscriptions_lock:
+			self._subscriptions_sent.pop(mqtt_client, None)
+
+	def _subscribe_topic(self, channel, share_group, topic):
+		mqtt_client = self._mqtt_for(channel)
+		rc, _ = mqtt_client.subscribe(topic)
+		if rc == mqtt.MQTT_ERR_SUCCESS:
+			self._subscribed(mqtt_client, ((channel, share_group),))
+
+	def _send_subscriptions(self, subscriptions, unsubscribe=False):
+		"""
+		* Sends (channel, share_group, topic) subscriptions in as few packets as
+		* possible, on the connection of each channel.
+		"""
+		batches = collections.OrderedDict()
+		for subscription in subscriptions:
+			batches.setdefault(self._mqtt_for(subscription[0]), []).append(subscription)
+
+		for mqtt_client, batch in batches.items():
+			for i in range(0, len(batch), _SUBSCRIBE_BATCH):
+				packet = batch[i:i + _SUBSCRIBE_BATCH]
+				if unsubscribe:
+					mqtt_client.unsubscribe([topic for _, _, topic in packet])
+					continue
+				rc, _ = mqtt_client.subscribe([(topic, 0) for _, _, topic in packet])
+				if rc == mqtt.MQTT_ERR_SUCCESS:
+					self._subscribed(mqtt_client, [(channel, share_group) for channel, share_group, _ in packet])
+
+	def _resubscribe(self, client, flags):
+		"""
+		* Replays the subscriptions carried by a connection once it is established,
+		* unless the broker kept them in its session or they were already sent
+		* on this connection, before it was acknowledged.
+		"""
+		if isinstance(flags, dict) and flags.get("session present"):
+			return
+		with self._subscriptions_lock:
+			sent = self._subscriptions_sent.get(client, ())
+			subscriptions = [s for key, s in self._subscriptions.items() if key not in sent and self._mqtt_for(s[0]) is client]
+		if not subscriptions:
+			return
+
+		def send(keys):
+			topics = []
+			for channel, key, share_group, options in subscriptions:
+				key = key if key is not None else keys[channel]
+				if share_group is None:
+					topics.append((channel, None, Client._format_channel(key, channel, options)))
+				else:
+					topics.append((channel, share_group, Client._format_channel_share(key, channel, share_group, options)))
+			self._send_subscriptions(topics)
+
+		managed = set(channel for channel, key, _, _ in subscriptions if key is None)
+		if managed:
+			self._with_keys(None, managed, send)
+		else:
+			send(None)
 
 	def disconnect(self):
 		"""
@@ -258,7 +835,10 @@ class Client(object):
 
 		request = {"key": key, "channel": channel, "status": status, "changes": changes}
 		# Publish the request.
-		self._mqtt.publish("emitter/presence/", json.dumps(request))
+		if status:
+			self._notify("presence", self._json.encode(request), Client._presence_status(channel))
+		else:
+			self._mqtt.publish("emitter/presence/", self._json.encode(request))
 
 	def keyban(self, master_key, target_key, ban):
 		"""
@@ -266,7 +846,7 @@ class Client(object):
 		"""
 		request = {"secret": master_key, "target": target_key, "banned": ban}
 		# Publish the request.
-		self._mqtt.publish("emitter/keyban/", json.dumps(request))
+		self._notify("keyban", self._json.encode(request))
 
 	def keygen(self, key, channel, permissions, ttl=0):
 		"""
@@ -274,7 +854,7 @@ class Client(object):
 		"""
 		request = {"key": key, "channel": channel, "type": permissions, "ttl": ttl}
 		# Publish the request.
-		self._mqtt.publish("emitter/keygen/", json.dumps(request))
+		self._notify("keygen", self._json.encode(request))
 
 	def link(self, key, channel, name, subscribe, options={}):
 		"""
@@ -284,7 +864,82 @@ class Client(object):
 		request = {"key": key, "channel": formattedChannel, "name": name, "subscribe": subscribe}
 
 		# Publish the request.
-		self._mqtt.publish("emitter/link/", json.dumps(request))
+		self._notify("link", self._json.encode(request))
+
+	def _notify(self, kind, payload, match=None):
+		"""
+		* Sends a control request of which the response only goes to the handlers.
+		"""
+		# Registered all the same, so that its response is not taken for the
+		# response of a request sent with _request.
+		with self._requests.lock:
+			info = self._mqtt.publish(_CONTROL_PREFIX + kind + "/", payload)
+			if info.rc == mqtt.MQTT_ERR_SUCCESS:
+				self._requests.add_untracked(kind, _REQUEST_TIMEOUT, match)
+
+	def _request(self, kind, payload, timeout, match=None):
+		"""
+		* Sends a control request and returns a Future of its response.
+		"""
+		# With QoS1 the request gets a packet id, which the broker echoes in the
+		# "req" field of its response. The request is registered before the lock
+		# is released, so that even an immediate response finds it.
+		with self._requests.lock:
+			info = self._mqtt.publish(_CONTROL_PREFIX + kind + "/", payload, qos=1)
+			if info.rc == mqtt.MQTT_ERR_SUCCESS:
+				return self._requests.add(kind, info.mid, timeout, match)
+
+		future = Future()
+		future.set_exception(ConnectionError(mqtt.error_string(info.rc)))
+		return future
+
+	def keygen_async(self, key, channel, permissions, ttl=0, timeout=_REQUEST_TIMEOUT):
+		"""
+		* Sends a key generation request and returns a concurrent.futures.Future
+		* of the response. The future fails with an EmitterError when the server
+		* rejects the request, or with a TimeoutError after timeout seconds.
+		"""
+		request = {"key": key, "channel": channel, "type": permissions, "ttl": ttl}
+		return self._request("keygen", self._json.encode(request), timeout)
+
+	def keyban_async(self, master_key, target_key, ban, timeout=_REQUEST_TIMEOUT):
+		"""
+		* Sends a ban or unban request and returns a Future of the response.
+		"""
+		request = {"secret": master_key, "target": target_key, "banned": ban}
+		return self._request("keyban", self._json.encode(request), timeout)
+
+	def presence_async(self, key, channel, changes=False, optional_handler=None, timeout=_REQUEST_TIMEOUT):
+		"""
+		* Sends a presence status request and returns a Future of the status
+		* response. With changes, later presence events go to the presence
+		* handlers as with presence().
+		"""
+		if optional_handler is not None:
+			self._handler_trie_presence.insert(channel, optional_handler)
+
+		request = {"key": key, "channel": channel, "status": True, "changes": changes}
+		return self._request("presence", self._json.encode(request), timeout, Client._presence_status(channel))
+
+	@staticmethod
+	def _presence_status(channel):
+		# Change events about the channel are not the response.
+		expected = channel.strip("/")
+		return lambda r: r.get("event") == "status" and r.get("channel", "").strip("/") == expected
+
+	def link_async(self, key, channel, name, subscribe, options={}, timeout=_REQUEST_TIMEOUT):
+		"""
+		* Sends a link creation request and returns a Future of the response.
+		"""
+		formattedChannel = Client._format_channel_link(channel, options=options)
+		request = {"key": key, "channel": formattedChannel, "name": name, "subscribe": subscribe}
+		return self._request("link", self._json.encode(request), timeout)
+
+	def me_async(self, timeout=_REQUEST_TIMEOUT):
+		"""
+		* Requests information about the connection and returns a Future of the response.
+		"""
+		return self._request("me", "", timeout)
 
 	def publish_with_link(self, link, message):
 		"""
@@ -297,7 +952,7 @@ class Client(object):
 		"""
 		* Requests information about the connection.
 		"""
-		self._mqtt.publish("emitter/me/", "")
+		self._notify("me", "")
 
 	@staticmethod
 	def _get_header(options):
@@ -313,22 +968,13 @@ class Client(object):
 
 	@staticmethod
 	def _format_options(options):
-		formatted = ""
-
-		if options != None and len(options) > 0:
-			formatted = "?"
-			
-			for i, o in enumerate(options):
-			
-				if o.startswith("+"):
-					continue
-			
-				formatted += o
-
-				if i < len(options) - 1:
-					formatted += "&"
+		# Flags such as +r or +1 go in the MQTT header, not in the topic. The rest
+		# is sorted, so a set of options always formats to the same topic.
+		params = sorted(o for o in options if not o.startswith("+")) if options else None
+		if not params:
+			return ""
 
-		return formatted
+		return "?" + "&".join(params)
 
 
 	@staticmethod
@@ -388,39 +1034,321 @@ class Client(object):
 
 	
 
+class ChannelHandle(object):
+	"""
+	* Represents a channel prepared for publishing, see Client.channel().
+	"""
+
+	def __init__(self, client, key, channel, options={}):
+		self.client = client
+		self.key = key
+		self.channel = channel
+		self.options = options
+		self.qos, self.retain = Client._get_header(options)
+		self.codec = client._codec_for(channel)
+		# The last key from the key manager and its topic, replaced together.
+		self._topic = (key, Client._format_channel(key, channel, options)) if key is not None else (None, None)
+
+	@property
+	def topic(self):
+		return self._topic[1]
+
+	def publish(self, message):
+		"""
+		* Publishes a message to the channel.
+		"""
+		message = self.client._prepare(self.channel, message, self.codec)
+		if self.key is not None:
+			self._send(self._topic[1], message)
+			return
+		self.client._with_key(None, self.channel, lambda key: self._send(self._topic_for(key), message))
+
+	def _topic_for(self, key):
+		cached, topic = self._topic
+		if key != cached:
+			topic = Client._format_channel(key, self.channel, self.options)
+			self._topic = (key, topic)
+		return topic
+
+	def _send(self, topic, message):
+		self.client._send(self.client._mqtt_for(self.channel), self.channel, topic, message, self.qos, self.retain)
+
+
+class PublishBatch(object):
+	"""
+	* Represents a batch of messages sent with Client.publish_many().
+	"""
+
+	def __init__(self, client, key, messages, window, mqtt_client=None):
+		self._client = client
+		# Every message of a batch goes through the same connection.
+		self._mqtt = mqtt_client
+		self._key = key
+		self._messages = list(messages)
+		self._window = window
+		self._lock = threading.Lock()
+		self._send_lock = threading.RLock()
+		self._done = threading.Event()
+		self._topics = {}
+		self._next = 0
+		self._in_flight = 0
+		self._completed = 0
+		self.failures = []
+		if not self._messages:
+			self._done.set()
+
+	def __len__(self):
+		return len(self._messages)
+
+	@property
+	def done(self):
+		"""
+		* Whether every message was either sent and acknowledged, or failed.
+		"""
+		return self._done.is_set()
+
+	@property
+	def succeeded(self):
+		"""
+		* The number of messages sent (QoS0) or acknowledged (QoS1) so far.
+		"""
+		return self._completed - len(self.failures)
+
+	def wait(self, timeout=None):
+		"""
+		* Waits for the batch to complete. Returns False on timeout. Do not call it
+		* from a handler, acknowledgements are read by the same thread.
+		"""
+		return self._done.wait(timeout)
+
+	def _topic(self, channel, options):
+		cache_key = (channel, tuple(options) if options else ())
+		topic = self._topics.get(cache_key)
+		if topic is None:
+			qos, retain = Client._get_header(options or ())
+			codec = self._client._codec_for(channel)
+			topic = self._topics[cache_key] = (Client._format_channel(_key_of(self._key, channel), channel, options), qos, retain, codec)
+		return topic
+
+	def _start(self, key):
+		# The key, or the keys per channel, once known.
+		self._key = key
+		if not self._divert():
+			self._pump()
+
+	def _divert(self):
+		"""
+		* Appends the whole batch to the outbox of the client, when set and
+		* either not empty or disconnected, so that the batch is sent after
+		* the messages already waiting, once connected. Its messages are then
+		* completed as soon as stored. Returns whether the batch was diverted.
+		"""
+		client = self._client
+		outbox = client._outbox
+		if outbox is None:
+			return False
+
+		mqtt_client = self._mqtt or client._mqtt
+		with client._outbox_lock:
+			connected = mqtt_client is not None and mqtt_client.is_connected()
+			if connected and not len(outbox):
+				return False
+			for channel, message, options in self._messages:
+				topic, qos, retain, codec = self._topic(channel, options)
+				message = client._prepare(channel, message, codec)
+				if client._metrics is not None:
+					client._metrics.published(channel, _size(message))
+				outbox.append(topic, message, qos, retain)
+
+		with self._lock:
+			self._next = self._in_flight = len(self._messages)
+		for index in range(len(self._messages)):
+			self._complete(index, None)
+		if connected:
+			client._drain_outbox()
+		return True
+
+	def _pump(self):
+		mqtt_client = self._mqtt or self._client._mqtt
+		# Hold paho's outgoing message lock, which its acknowledgement callbacks
+		# also run under. Messages are then sent in order even when the network
+		# thread pumps concurrently, and cannot be acknowledged before being tracked.
+		out_lock = getattr(mqtt_client, "_out_message_mutex", None) or self._send_lock
+		while True:
+			with out_lock:
+				with self._lock:
+					if self._next >= len(self._messages) or self._in_flight >= self._window:
+						return
+					index = self._next
+					self._next += 1
+					self._in_flight += 1
+
+				channel, message, options = self._messages[index]
+				topic, qos, retain, codec = self._topic(channel, options)
+				message = self._client._prepare(channel, message, codec)
+				info = mqtt_client.publish(topic, message, qos=qos, retain=retain)
+				# paho keeps the QoS1 messages published while disconnected, and
+				# sends them once reconnected.
+				sent = info.rc == mqtt.MQTT_ERR_SUCCESS or (qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN)
+				if sent and qos > 0:
+					self._client._track_publish(mqtt_client, info.mid, self, index)
+				if self._client._metrics is not None and sent:
+					self._client._metrics.published(channel, _size(message))
+
+			if not sent:
+				self._complete(index, mqtt.error_string(info.rc))
+			elif qos == 0:
+				self._complete(index, None)
+
+	def _complete(self, index, error):
+		with self._lock:
+			self._in_flight -= 1
+			self._completed += 1
+			if error is not None:
+				self.failures.append((index, error))
+			if self._completed == len(self._messages):
+				self._done.set()
+
+	def _acknowledged(self, index):
+		self._complete(index, None)
+		self._pump()
+
+
+def _key_of(keys, channel):
+	# The key of a channel, either shared or resolved per channel in a dict.
+	return keys[channel] if isinstance(keys, dict) else keys
+
+
+def _size(payload):
+	# The size of a payload as paho sends it, without encoding it again.
+	if isinstance(payload, (bytes, bytearray, str)):
+		return len(payload)
+	return 0 if payload is None else len(str(payload))
+
+
+_UNDECODED = object()
+
+
 class EmitterMessage(object):
 	"""
 	* Represents a message received from the Emitter server.
+	* The payload is decoded lazily and at most once: every handler matched for
+	* a message shares the same EmitterMessage, and so the same decoded string
+	* and object. Handlers must not mutate the object returned by as_object().
+	* Compressed payloads are decompressed on first access, when the client
+	* has a compression set.
 	"""
+	__slots__ = ("channel", "codec", "_binary", "_view", "_text", "_object", "_hooks", "_compression", "_raw")
 
-	def __init__(self, message):
+	def __init__(self, message, codec=None):
 		"""
-		* Creates an instance of EmitterMessage.
+		* Creates an instance of EmitterMessage, decoding objects with codec, or
+		* with the standard JSON library when None.
 		"""
 		self.channel = message.topic
-		self.binary = message.payload
+		self.codec = codec
+		self._binary = message.payload
+		self._view = None
+		self._text = None
+		self._object = _UNDECODED
+		self._hooks = ()
+		self._compression = None
+		self._raw = None
+
+	def __getstate__(self):
+		if self._compression is not None:
+			self._decompress()
+		return (self.channel, self._binary, self.codec)
+
+	def __setstate__(self, state):
+		self.channel, self._binary, self.codec = state
+		self._view = None
+		self._text = None
+		self._object = _UNDECODED
+		self._hooks = ()
+		self._compression = None
+		self._raw = None
+
+	def _decompress(self):
+		compression, self._compression = self._compression, None
+		try:
+			binary = compression.decompress(self._binary)
+		except Exception as exception:
+			# The payload is left as received.
+			logging.exception(exception)
+			return
+		if binary is not self._binary:
+			self._raw = self._binary
+			self._binary = binary
+
+	@property
+	def binary(self):
+		if self._compression is not None:
+			self._decompress()
+		return self._binary
+
+	@property
+	def raw(self):
+		"""
+		* The payload as received, compressed or not, without decompressing it.
+		"""
+		return self._binary if self._raw is None else self._raw
 
 	def as_string(self):
 		"""
 		* Returns the payload as a utf-8 string.
 		"""
-		return str(self.binary)
+		if self._text is None:
+			if self._compression is not None:
+				self._decompress()
+			self._text = str(self._binary, "utf-8")
+		return self._text
 
 	# TODO: rename this one and produce a real object.
 	def as_object(self):
 		"""
-		* Returns the payload as an JSON-deserialized dictionary.
+		* Returns the payload as an object deserialized by the codec of the
+		* channel, by default a JSON-deserialized dictionary.
 		"""
-		msg = None
-		try:
-			msg = json.loads(self.binary)
-		except json.JSONDecodeError as exception:
-			logging.exception(exception)
-
-		return msg
+		if self._object is _UNDECODED:
+			if self._hooks:
+				start = time.perf_counter()
+			if self._compression is not None:
+				self._decompress()
+			msg = None
+			try:
+				if self.codec is None:
+					msg = json.loads(self._text if self._text is not None else self._binary)
+				else:
+					msg = self.codec.decode(self._binary)
+			except Exception as exception:
+				# Each codec raises its own errors on malformed payloads.
+				logging.exception(exception)
+			self._object = msg
+			if self._hooks:
+				elapsed = time.perf_counter() - start
+				for hook in self._hooks:
+					hook.decoded(self, elapsed)
+
+		return self._object
 
 	def as_binary(self):
 		"""
 		* Returns the payload as a raw binary buffer.
 		"""
-		return self.binary
+		if self._compression is not None:
+			self._decompress()
+		return self._binary
+
+	def as_memoryview(self):
+		"""
+		* Returns a read-only view of the payload, sliceable without copying.
+		"""
+		if self._view is None:
+			if self._compression is not None:
+				self._decompress()
+			if isinstance(self._binary, bytearray):
+				# Views of bytes are read-only already, only a bytearray needs a copy.
+				self._binary = bytes(self._binary)
+			self._view = memoryview(self._binary)
+		return self._view
@@ -1,8 +1,10 @@
 import pytest
 try:
-    from .emitter import Client
+    from .emitter import Client, EmitterMessage
+    from .fakes import FakeMqtt, RecordingMqtt, make_message
 except ImportError:
-    from emitter import Client
+    from emitter import Client, EmitterMessage
+    from fakes import FakeMqtt, RecordingMqtt, make_message
 
 def test_format_channel():
     tests = [
@@ -12,8 +14,11 @@ def test_format_channel():
         {"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/", "channel": "test/", "options": None, "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/"},
         # With options.
         {"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha", "channel": "test", "options": {Client.with_ttl(5)}, "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/?ttl=5"},
-        # The following test won't always work, since the enumeration of the options vary in order.
-        #{"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha", "channel": "test", "options": {Client.with_ttl(5), Client.without_echo()}, "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/?ttl=5&me=0"}
+        # Options are sorted, whatever the enumeration order of the set.
+        {"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha", "channel": "test", "options": {Client.with_ttl(5), Client.without_echo()}, "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/?me=0&ttl=5"},
+        # Header flags are left out of the topic.
+        {"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha", "channel": "test", "options": [Client.with_ttl(5), Client.with_retain()], "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/?ttl=5"},
+        {"key": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha", "channel": "test", "options": {Client.with_retain(), Client.with_at_least_once()}, "expected": "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/"},
         ]
     
     for test in tests:
@@ -29,4 +34,249 @@ def test_format_channel_link():
         formatted = Client._format_channel_link(channel=test["channel"], options=test["options"])  
         assert formatted == test["expected"]
 
+def test_channel_handle():
+    import paho.mqtt.client as mqtt
+
+    client = Client()
+    client._mqtt = mqtt.Client()
+    handle = client.channel("5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/", "test/", {Client.with_ttl(5), Client.with_retain(), Client.with_at_least_once()})
+
+    assert handle.topic == "5xZjIQp6GA9fpxso1Kslqnv8d4XVWCha/test/?ttl=5"
+    assert handle.qos == 1
+    assert handle.retain
+
+def test_message_decoding():
+    message = EmitterMessage(make_message("test/", u'{"text": "h\u00e9llo"}'.encode("utf-8")))
+
+    assert message.channel == "test/"
+    assert message.as_string() == u'{"text": "h\u00e9llo"}'
+    assert message.as_object() == {"text": u"h\u00e9llo"}
+    # Decoded once, then shared.
+    assert message.as_object() is message.as_object()
+    assert message.as_memoryview()[2:6].tobytes() == b"text"
+    assert message.as_binary() == message.binary
+
+def test_message_readonly_view():
+    message = EmitterMessage(make_message("test/", bytearray(b"abc")))
+
+    assert message.as_memoryview().readonly
+    assert EmitterMessage(make_message("test/", b"abc")).as_memoryview().readonly
+
+def test_message_invalid_json():
+    message = EmitterMessage(make_message("test/", b"not json"))
+
+    assert message.as_object() is None
+    assert message.as_string() == "not json"
+
+def test_message_pickle():
+    import pickle
+
+    message = EmitterMessage(make_message("test/", b'{"a": 1}'))
+    message.as_memoryview()
+    copy = pickle.loads(pickle.dumps(message))
+
+    assert copy.channel == "test/"
+    assert copy.as_object() == {"a": 1}
+
+def test_control_dispatch():
+    client = Client()
+    received = []
+    client.on_keygen = lambda r: received.append(("keygen", r))
+    client.on_me = lambda r: received.append(("me", r))
+    client.on_error = lambda r: received.append(("error", r))
+    client.on_presence = lambda r: received.append(("presence", r["channel"]))
+    client.on_message = lambda m: received.append(("message", m.channel))
+    client._handler_trie_presence.insert("p/", lambda r: received.append(("p", r["event"])))
+
+    client._on_message(None, None, make_message("emitter/keygen/", b'{"key": "k"}'))
+    client._on_message(None, None, make_message("emitter/me/", b'{"id": "1"}'))
+    client._on_message(None, None, make_message("emitter/error/", b'{"status": 400}'))
+    client._on_message(None, None, make_message("emitter/presence/", b'{"event": "status", "channel": "p/"}'))
+    client._on_message(None, None, make_message("emitter/presence/", b'{"event": "status", "channel": "q/"}'))
+    client._on_message(None, None, make_message("emitter/unknown/", b'{}'))
+    client._on_message(None, None, make_message("emitters/", b'{}'))
+
+    assert received == [
+        ("keygen", {"key": "k"}),
+        ("me", {"id": "1"}),
+        ("error", {"status": 400}),
+        ("p", "status"),
+        ("presence", "q/"),
+        ("message", "emitters/")]
+
 # Todo test shared
+
+def connected_client(broker):
+    import threading
+    client = Client()
+    connected = threading.Event()
+    client.on_connect = connected.set
+    client.connect(host="127.0.0.1", port=broker.port, secure=False)
+    client.loop_start()
+    assert connected.wait(5)
+    return client
+
+def test_publish_many():
+    import threading
+    try:
+        from .localbroker import LocalBroker
+    except ImportError:
+        from localbroker import LocalBroker
+
+    with LocalBroker() as broker:
+        client = connected_client(broker)
+        received = []
+        all_received = threading.Event()
+        def handler(m):
+            received.append(m.as_binary())
+            if len(received) == 200:
+                all_received.set()
+        client.subscribe("key", "test/", handler)
+
+        qos1 = {Client.with_at_least_once()}
+        batch = client.publish_many("key", [("test/", b"%d" % i, qos1 if i % 2 else None) for i in range(200)], window=10)
+        try:
+            assert batch.wait(5)
+            assert all_received.wait(5)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+
+    assert batch.done
+    assert batch.failures == []
+    assert batch.succeeded == 200
+    assert received == [b"%d" % i for i in range(200)]
+
+def test_publish_many_failures():
+    import paho.mqtt.client as mqtt
+
+    client = Client()
+    client._mqtt = mqtt.Client()
+    batch = client.publish_many("key", [("a/", "1", None), ("b/", "2", {Client.with_at_least_once()})])
+
+    # paho keeps the QoS1 message until reconnected, it completes once acknowledged.
+    assert not batch.done
+    assert [index for index, _ in batch.failures] == [0]
+    [(_, mid)] = client._publish_pending
+    client._on_publish(client._mqtt, None, mid)
+    assert batch.done
+    assert batch.succeeded == 1
+
+def test_max_inflight():
+    client = Client()
+    assert client._create_mqtt(False, None, 50)._max_inflight_messages == 50
+
+def test_request_futures():
+    client = Client()
+    client._mqtt = FakeMqtt()
+    keygen = client.keygen_async("master", "a/", "rw")
+    presence = client.presence_async("key", "a/")
+    me = client.me_async()
+
+    assert [(topic, qos) for topic, _, qos in client._mqtt.published] == [
+        ("emitter/keygen/", 1), ("emitter/presence/", 1), ("emitter/me/", 1)]
+
+    client._on_message(None, None, make_message("emitter/me/", b'{"id": "1"}'))
+    client._on_message(None, None, make_message("emitter/presence/", b'{"event": "subscribe", "channel": "a/"}'))
+    client._on_message(None, None, make_message("emitter/presence/", b'{"event": "status", "channel": "a/", "who": []}'))
+    client._on_message(None, None, make_message("emitter/keygen/", b'{"req": 1, "key": "k"}'))
+
+    assert me.result(0) == {"id": "1"}
+    assert presence.result(0)["event"] == "status"
+    assert keygen.result(0)["key"] == "k"
+
+def test_request_error():
+    try:
+        from .tracker import EmitterError
+    except ImportError:
+        from tracker import EmitterError
+
+    client = Client()
+    client._mqtt = FakeMqtt()
+    link = client.link_async("key", "a/", "l", True)
+    client._on_message(None, None, make_message("emitter/error/", b'{"req": 1, "status": 403, "message": "forbidden"}'))
+
+    with pytest.raises(EmitterError):
+        link.result(0)
+
+def test_subscribe_many_batches():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    channels = ["c%d/" % i for i in range(1200)]
+    client.subscribe_many("key", channels, lambda m: None)
+
+    packets = client._mqtt.published
+    assert [len(topics) for _, topics in packets] == [500, 500, 200]
+    assert packets[0][1][0] == ("key/c0/", 0)
+    assert len(client._handler_trie_message.lookup("c1199/")) == 1
+
+    client._mqtt.published = []
+    client.unsubscribe_many("key", channels[:600])
+    assert [len(topics) for _, topics in client._mqtt.published] == [500, 100]
+    assert len(client._handler_trie_message.lookup("c0/")) == 0
+
+def test_resubscribe_on_connect():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    client.subscribe("key", "a/", options={Client.with_last(5)})
+    client.subscribe_with_group("key", "b/", "g")
+    client.subscribe_many("key", ["c/", "d/"])
+    client.unsubscribe("key", "d/")
+
+    # Already sent on this connection.
+    client._mqtt.published = []
+    client._on_connect(client._mqtt, None, {"session present": 0}, 0)
+    assert client._mqtt.published == []
+
+    client._on_disconnect(client._mqtt, None, 1)
+    client._on_connect(client._mqtt, None, {"session present": 0}, 0)
+    # Stored messages are not requested again.
+    assert client._mqtt.published == [("subscribe", [("key/a/", 0), ("key/$share/g/b/", 0), ("key/c/", 0)])]
+
+    client._mqtt.published = []
+    client._on_disconnect(client._mqtt, None, 1)
+    client._on_connect(client._mqtt, None, {"session present": 1}, 0)
+    assert client._mqtt.published == []
+
+def test_resubscribe_unsent():
+    import paho.mqtt.client as mqtt
+
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    client.subscribe("key", "a/")
+    subscribe = client._mqtt.subscribe
+    # Not connected yet: only this one is replayed on the first CONNACK.
+    client._mqtt.subscribe = lambda topics: (mqtt.MQTT_ERR_NO_CONN, None)
+    client.subscribe("key", "b/")
+
+    client._mqtt.subscribe = subscribe
+    client._mqtt.published = []
+    client._on_connect(client._mqtt, None, {"session present": 0}, 0)
+    assert client._mqtt.published == [("subscribe", [("key/b/", 0)])]
+
+def test_subscribe_many_delivery():
+    import threading
+    try:
+        from .localbroker import LocalBroker
+    except ImportError:
+        from localbroker import LocalBroker
+
+    with LocalBroker() as broker:
+        client = connected_client(broker)
+        received = set()
+        done = threading.Event()
+        def handler(m):
+            received.add(m.channel)
+            if len(received) == 50:
+                done.set()
+        channels = ["many/%d/" % i for i in range(50)]
+        client.subscribe_many("key", channels, handler)
+        try:
+            for channel in channels:
+                client.publish("key", channel, "x")
+            assert done.wait(5)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+
+    assert received == set(channels)
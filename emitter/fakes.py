@@ -0,0 +1,47 @@
+"""
+Fakes of the paho client and of its messages, shared by the tests of this
+package. They record what the client sends instead of sending it.
+"""
+import paho.mqtt.client as mqtt
+
+
+def make_message(channel, payload=b""):
+    """
+    * Returns a paho message as received on a channel.
+    """
+    msg = mqtt.MQTTMessage(topic=channel.encode("utf-8"))
+    msg.payload = payload
+    return msg
+
+
+class FakeInfo(object):
+    def __init__(self, mid, rc=0):
+        self.mid = mid
+        self.rc = rc
+
+
+class FakeMqtt(object):
+    """
+    * Records the (topic, payload, qos) of published messages, the packet id
+    * of a message being its position in published.
+    """
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload, qos))
+        return FakeInfo(len(self.published))
+
+
+class RecordingMqtt(FakeMqtt):
+    """
+    * Records subscriptions along with the published messages.
+    """
+
+    def subscribe(self, topics):
+        self.published.append(("subscribe", topics))
+        return 0, len(self.published)
+
+    def unsubscribe(self, topics):
+        self.published.append(("unsubscribe", topics))
@@ -0,0 +1,206 @@
+"""
+Consumer groups: worker processes sharing the messages of a channel through
+an Emitter share group, supervised by the parent process.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+try:
+    from .dispatch import InboundQueue
+    from .emitter import Client
+except ImportError:
+    from dispatch import InboundQueue
+    from emitter import Client
+
+
+def _work(config, handler, conn):
+    """
+    * Runs a worker process: joins the share group and reports, every interval,
+    * the number of messages it handled and its backlog, until the parent
+    * writes to conn or goes away.
+    """
+    client = Client()
+    processed = [0]
+    def handle(message):
+        handler(message)
+        processed[0] += 1
+
+    # Messages wait in the inbound queue while the handler is busy, so its
+    # depth is the lag of the worker.
+    inbound = InboundQueue(maxsize=config["maxsize"])
+    client.inbound_queue = inbound
+    client.connect(host=config["host"], port=config["port"], secure=config["secure"], username=config["username"])
+    # Sent once, and replayed by the client on reconnection.
+    client.subscribe_with_group(config["key"], config["channel"], config["group"], handle, config["options"])
+    client.loop_start()
+
+    reported = 0
+    last = time.monotonic()
+    while not conn.poll(config["interval"]):
+        now = time.monotonic()
+        count = processed[0]
+        conn.send((count - reported, len(inbound), now - last))
+        reported = count
+        last = now
+
+    client.loop_stop()
+    client.disconnect()
+    inbound.close(wait=False)
+
+
+class ConsumerGroup(object):
+    """
+    * Runs workers processes which all join the same share group of a channel,
+    * so that the broker spreads its messages among them, and handle them with
+    * handler. Workers report their throughput and backlog to the parent every
+    * interval seconds, and the workers which exit without being stopped are
+    * restarted. A worker failing again and again is restarted after backoff
+    * seconds, then twice as long after each exit, up to max_backoff seconds;
+    * the delay is reset once it stays up for max_backoff seconds.
+    *
+    * handler runs in the workers, so it must be picklable, typically a module
+    * level function, when the multiprocessing start method is not fork.
+    *
+    * Each worker talks to the parent over a pipe of its own: a worker dying
+    * abruptly cannot leave a lock shared with the others held.
+    """
+
+    def __init__(self, key, channel, group, handler, workers=None, host="api.emitter.io", port=443,
+                 secure=True, username=None, options={}, interval=1.0, maxsize=10000, context=None,
+                 backoff=0.5, max_backoff=30.0):
+        self.handler = handler
+        self.workers = workers or multiprocessing.cpu_count()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.restarts = 0
+        self._config = {"key": key, "channel": channel, "group": group, "host": host, "port": port,
+                        "secure": secure, "username": username, "options": options,
+                        "interval": interval, "maxsize": maxsize}
+        self._context = context or multiprocessing.get_context()
+        self._processes = [None] * self.workers
+        self._pipes = [None] * self.workers
+        self._started = [0.0] * self.workers
+        self._failures = [0] * self.workers
+        # When the workers which exited are due to be restarted.
+        self._restart_at = [None] * self.workers
+        self._stats = [{"processed": 0, "throughput": 0.0, "lag": 0, "restarts": 0} for _ in range(self.workers)]
+        self._lock = threading.Lock()
+        self._supervisor = None
+        self._stopping = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        * Starts the workers and the thread supervising them.
+        """
+        for index in range(self.workers):
+            self._spawn(index)
+        self._supervisor = threading.Thread(target=self._supervise, name="emitter-group", daemon=True)
+        self._supervisor.start()
+
+    def _spawn(self, index):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_work, name="emitter-group-%d" % index,
+                                        args=(self._config, self.handler, child_conn))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        self._processes[index] = process
+        self._pipes[index] = conn
+        self._started[index] = time.monotonic()
+
+    def _restart_delay(self, index, now):
+        """
+        * Returns how long to wait before restarting a worker which just exited.
+        """
+        if now - self._started[index] >= self.max_backoff:
+            self._failures[index] = 0
+        delay = min(self.backoff * 2 ** self._failures[index], self.max_backoff)
+        self._failures[index] += 1
+        return delay
+
+    def _supervise(self):
+        interval = self._config["interval"]
+        while not self._stopping:
+            timeout = interval
+            due = [at for at in self._restart_at if at is not None]
+            if due:
+                timeout = min(timeout, max(0.0, min(due) - time.monotonic()))
+            for conn in multiprocessing.connection.wait([conn for conn in self._pipes if conn is not None], timeout):
+                index = self._pipes.index(conn)
+                try:
+                    processed, lag, elapsed = conn.recv()
+                except EOFError:
+                    # The worker exited, and is restarted below.
+                    continue
+                with self._lock:
+                    stats = self._stats[index]
+                    stats["processed"] += processed
+                    stats["throughput"] = processed / elapsed if elapsed > 0 else 0.0
+                    stats["lag"] = lag
+
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    break
+                if self._restart_at[index] is not None:
+                    if now >= self._restart_at[index]:
+                        self._restart_at[index] = None
+                        self._spawn(index)
+                elif not process.is_alive():
+                    delay = self._restart_delay(index, now)
+                    logging.warning("consumer group worker %d exited with code %s, restarting in %.1f s",
+                                    index, process.exitcode, delay)
+                    with self._lock:
+                        self.restarts += 1
+                        self._stats[index]["restarts"] += 1
+                        self._stats[index]["throughput"] = 0.0
+                        self._stats[index]["lag"] = 0
+                    self._pipes[index].close()
+                    self._pipes[index] = None
+                    self._restart_at[index] = now + delay
+
+    def stats(self):
+        """
+        * Returns the totals of the group, the number of handled messages, the
+        * messages handled per second and the backlog, along with the same
+        * figures and the restart count of each worker.
+        """
+        with self._lock:
+            workers = [dict(stats) for stats in self._stats]
+        return {"processed": sum(w["processed"] for w in workers),
+                "throughput": sum(w["throughput"] for w in workers),
+                "lag": sum(w["lag"] for w in workers),
+                "restarts": self.restarts,
+                "workers": workers}
+
+    def stop(self, timeout=None):
+        """
+        * Stops the workers, waiting up to timeout seconds for each of them
+        * before terminating it.
+        """
+        self._stopping = True
+        if self._supervisor is not None:
+            self._supervisor.join()
+        for conn in self._pipes:
+            try:
+                conn.send(None)
+            except (OSError, AttributeError):
+                pass
+        for process, conn in zip(self._processes, self._pipes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,59 @@
+import os
+import time
+try:
+    from .emitter import Client
+    from .group import ConsumerGroup
+    from .localbroker import LocalBroker
+except ImportError:
+    from emitter import Client
+    from group import ConsumerGroup
+    from localbroker import LocalBroker
+
+def crash_on_request(message):
+    if message.as_binary() == b"crash":
+        os._exit(3)
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_consumer_group():
+    with LocalBroker() as broker:
+        publisher = Client()
+        publisher.connect(host="127.0.0.1", port=broker.port, secure=False)
+        publisher.loop_start()
+
+        group = ConsumerGroup("key", "jobs/", "workers", crash_on_request, workers=2,
+                              host="127.0.0.1", port=broker.port, secure=False, interval=0.1)
+        with group:
+            # Until both workers joined, published messages may be missed.
+            def published_and_processed():
+                publisher.publish("key", "jobs/", "job")
+                return all(w["processed"] > 0 for w in group.stats()["workers"])
+            wait_until(published_and_processed)
+
+            publisher.publish("key", "jobs/", "crash")
+            wait_until(lambda: group.stats()["restarts"] > 0)
+
+            before = group.stats()["processed"]
+            wait_until(lambda: published_and_processed() and group.stats()["processed"] > before)
+
+        publisher.loop_stop()
+        publisher.disconnect()
+
+    stats = group.stats()
+    assert stats["throughput"] >= 0
+    assert stats["lag"] >= 0
+    assert sum(w["restarts"] for w in stats["workers"]) == stats["restarts"]
+    assert all(not p.is_alive() for p in group._processes)
+
+def test_restart_backoff():
+    group = ConsumerGroup("key", "jobs/", "workers", crash_on_request, workers=1, backoff=0.5, max_backoff=4)
+    delays = [group._restart_delay(0, 1.0) for _ in range(5)]
+    assert delays == [0.5, 1.0, 2.0, 4.0, 4.0]
+
+    # Reset once the worker stayed up for max_backoff seconds.
+    group._started[0] = 10.0
+    assert group._restart_delay(0, 14.0) == 0.5
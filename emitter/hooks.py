@@ -0,0 +1,140 @@
+"""
+Hooks observing the receive path of a client, and a profiler finding the
+handlers responsible for latency.
+"""
+import logging
+import threading
+import time
+
+
+def handler_name(handler):
+    """
+    * Returns the module and qualified name of a handler, unwrapping the
+    * handlers wrapped by the client, such as conflating ones.
+    """
+    while hasattr(handler, "handler"):
+        handler = handler.handler
+    name = getattr(handler, "__qualname__", None) or getattr(handler, "__name__", None)
+    if name is None:
+        name = type(handler).__name__
+    module = getattr(handler, "__module__", None)
+    return module + "." + name if module else name
+
+
+def _payload_size(message):
+    raw = message.raw
+    return 0 if raw is None else len(raw)
+
+
+class Hook(object):
+    """
+    * Observes the messages received by a client, once added with
+    * Client.add_hook(). Each method is called with the time taken by a step of
+    * the receive path, on the thread running it: the network thread, the
+    * inbound queue thread or a dispatcher worker. Hooks must be quick and must
+    * not raise.
+    """
+
+    def received(self, message):
+        """
+        * Called when a message arrives, before it is queued or dispatched.
+        """
+
+    def looked_up(self, message, handlers, seconds):
+        """
+        * Called once the handlers of a message are found in the trie.
+        """
+
+    def decoded(self, message, seconds):
+        """
+        * Called once the payload of a message is decoded by as_object().
+        """
+
+    def handled(self, handler, message, seconds):
+        """
+        * Called once a handler returns, or raises.
+        """
+
+
+class HookedHandler(object):
+    """
+    * Wraps a handler to report its duration to hooks where it runs, on a
+    * dispatcher worker.
+    """
+    __slots__ = ("handler", "hooks")
+
+    def __init__(self, handler, hooks):
+        self.handler = handler
+        self.hooks = hooks
+
+    def __call__(self, message):
+        start = time.perf_counter()
+        try:
+            self.handler(message)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.hooks:
+                hook.handled(self.handler, message, elapsed)
+
+
+class Profiler(Hook):
+    """
+    * Profiles the handlers of a client: logs the invocations exceeding budget
+    * seconds with their channel and payload size, and accumulates the time
+    * spent per handler for top().
+    *
+    * With every greater than 1, only one invocation in every is accumulated,
+    * which keeps the cost of the profiler down on busy clients; top() then
+    * estimates the totals. Slow invocations are always logged.
+    """
+
+    def __init__(self, budget=0.1, every=1, logger=None):
+        self.budget = budget
+        self.every = every
+        self.logger = logger or logging.getLogger("emitter.profiler")
+        self._lock = threading.Lock()
+        self._seen = 0
+        self._stats = {}
+
+    def handled(self, handler, message, seconds):
+        if seconds > self.budget:
+            self.logger.warning("slow handler %s: %.1f ms on channel %s, %d bytes",
+                                handler_name(handler), seconds * 1e3, message.channel, _payload_size(message))
+
+        with self._lock:
+            self._seen += 1
+            if self._seen % self.every:
+                return
+            name = handler_name(handler)
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def top(self, count=10):
+        """
+        * Returns the (name, calls, total, max) of the count handlers which spent
+        * the most time, totals in seconds.
+        """
+        with self._lock:
+            stats = [(name, calls * self.every, total * self.every, longest)
+                     for name, (calls, total, longest) in self._stats.items()]
+        stats.sort(key=lambda entry: entry[2], reverse=True)
+        return stats[:count]
+
+    def report(self, count=10):
+        """
+        * Returns top() as a table.
+        """
+        lines = ["%-60s %10s %12s %10s %10s" % ("handler", "calls", "total ms", "mean ms", "max ms")]
+        for name, calls, total, longest in self.top(count):
+            lines.append("%-60s %10d %12.1f %10.3f %10.3f" % (name, calls, total * 1e3, total * 1e3 / calls, longest * 1e3))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._seen = 0
+            self._stats.clear()
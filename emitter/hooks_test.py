@@ -0,0 +1,92 @@
+import logging
+import time
+try:
+    from .emitter import Client
+    from .fakes import RecordingMqtt, make_message
+    from .hooks import Hook, Profiler, handler_name
+except ImportError:
+    from emitter import Client
+    from fakes import RecordingMqtt, make_message
+    from hooks import Hook, Profiler, handler_name
+
+class RecordingHook(Hook):
+    def __init__(self):
+        self.calls = []
+
+    def received(self, message):
+        self.calls.append(("received", message.channel))
+
+    def looked_up(self, message, handlers, seconds):
+        self.calls.append(("looked_up", len(handlers)))
+
+    def decoded(self, message, seconds):
+        self.calls.append(("decoded", message.channel))
+
+    def handled(self, handler, message, seconds):
+        self.calls.append(("handled", handler_name(handler)))
+
+def fast(message):
+    message.as_object()
+
+def slow(message):
+    time.sleep(0.02)
+
+def test_hooks():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    hook = RecordingHook()
+    client.add_hook(hook)
+    client.subscribe("key", "a/", fast)
+    client._on_message(None, None, make_message("a/", b'{"v": 1}'))
+    client._on_message(None, None, make_message("emitter/me/", b"{}"))
+
+    assert hook.calls == [("received", "a/"), ("looked_up", 1), ("decoded", "a/"), ("handled", __name__ + ".fast")]
+
+    client.remove_hook(hook)
+    client._on_message(None, None, make_message("a/", b'{"v": 1}'))
+    assert len(hook.calls) == 4
+
+def test_profiler(caplog):
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    profiler = Profiler(budget=0.01)
+    client.add_hook(profiler)
+    client.subscribe("key", "a/", fast)
+    client.subscribe("key", "b/", slow)
+    for _ in range(3):
+        client._on_message(None, None, make_message("a/", b"{}"))
+    with caplog.at_level(logging.WARNING):
+        client._on_message(None, None, make_message("b/", b"12345"))
+
+    assert "slow handler %s.slow" % __name__ in caplog.text
+    assert "channel b/, 5 bytes" in caplog.text
+    top = profiler.top()
+    assert [(name, calls) for name, calls, _, _ in top] == [(__name__ + ".slow", 1), (__name__ + ".fast", 3)]
+    assert __name__ + ".slow" in profiler.report(1)
+    assert __name__ + ".fast" not in profiler.report(1)
+
+def test_profiler_conflated_handler():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    profiler = Profiler()
+    client.add_hook(profiler)
+    client.subscribe("key", "b/", slow, conflate=True)
+    client._on_message(None, None, make_message("b/", b"{}"))
+
+    # Timed where the handler runs, not where the message is queued.
+    deadline = time.time() + 5
+    while not profiler.top() and time.time() < deadline:
+        time.sleep(0.01)
+    [(name, calls, total, _)] = profiler.top()
+    assert (name, calls) == (__name__ + ".slow", 1)
+    assert total >= 0.02
+
+def test_profiler_sampling():
+    profiler = Profiler(every=4)
+    message = type("Message", (), {"channel": "a/", "raw": b""})()
+    for _ in range(8):
+        profiler.handled(fast, message, 0.001)
+
+    name, calls, total, _ = profiler.top()[0]
+    assert calls == 8
+    assert abs(total - 0.008) < 1e-9
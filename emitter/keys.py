@@ -0,0 +1,122 @@
+"""
+Generation and caching of channel keys, so that publishing and subscribing
+do not need keys handled by hand.
+"""
+import threading
+import time
+from concurrent.futures import Future
+try:
+    from .subtrie import SubTrie
+    from .tracker import EmitterError
+except ImportError:
+    from subtrie import SubTrie
+    from tracker import EmitterError
+
+
+class KeyManager(object):
+    """
+    * Generates channel keys with a master key and caches them per channel and
+    * permissions. Keys are refreshed once refresh (a fraction of their ttl) has
+    * elapsed: the cached key keeps being served while its replacement is
+    * generated, until it actually expires. Concurrent requests for the same key
+    * share a single keygen request.
+    *
+    * Channels resolve to the longest registered pattern covering them, see
+    * register(), or else to a key of their own.
+    """
+
+    def __init__(self, client, master_key, permissions="rw", ttl=0, refresh=0.8, timeout=10):
+        self.client = client
+        self.master_key = master_key
+        self.permissions = permissions
+        self.ttl = ttl
+        self.refresh = refresh
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._pending = {}
+        self._patterns = SubTrie()
+
+    def register(self, channel, permissions=None, ttl=None):
+        """
+        * Makes every channel below channel use a single key, generated for
+        * channel with the given permissions and ttl, by default the manager's.
+        * Wildcard keys such as "sensors/#/" are registered as "sensors/".
+        """
+        pattern = channel.strip("/").rstrip("#").strip("/")
+        depth = len(list(SubTrie._get_words(pattern + "/")))
+        self._patterns.insert(pattern + "/", (depth, channel, permissions, ttl))
+
+    def _resolve(self, channel, permissions):
+        matches = self._patterns.lookup(channel)
+        if matches:
+            _, pattern, pattern_permissions, ttl = max(matches, key=lambda match: match[0])
+            return pattern, permissions or pattern_permissions or self.permissions, self.ttl if ttl is None else ttl
+        return channel, permissions or self.permissions, self.ttl
+
+    def key_async(self, channel, permissions=None):
+        """
+        * Returns a Future of the key for channel, generated if need be.
+        """
+        channel, permissions, ttl = self._resolve(channel, permissions)
+        cache_key = (channel.strip("/"), permissions)
+        now = time.monotonic()
+        generate = None
+        with self._lock:
+            entry = self._keys.get(cache_key)
+            if entry is not None and now < entry[1]:
+                if now >= entry[2] and cache_key not in self._pending:
+                    generate = self._pending[cache_key] = Future()
+                future = Future()
+                future.set_result(entry[0])
+            else:
+                future = self._pending.get(cache_key)
+                if future is None:
+                    future = generate = self._pending[cache_key] = Future()
+
+        # Outside of the lock, a failed request completes right away.
+        if generate is not None:
+            request = self.client.keygen_async(self.master_key, channel, permissions, ttl, timeout=self.timeout)
+            request.add_done_callback(lambda r: self._generated(cache_key, ttl, r, generate))
+        return future
+
+    def key(self, channel, permissions=None, timeout=None):
+        """
+        * Returns the key for channel, waiting for it to be generated if need be.
+        * Do not call it from a handler before the key is cached: the response
+        * is read by the thread running the handler.
+        """
+        return self.key_async(channel, permissions).result(self.timeout if timeout is None else timeout)
+
+    def invalidate(self, channel=None, permissions=None):
+        """
+        * Forgets the cached keys of channel, or every cached key.
+        """
+        with self._lock:
+            if channel is None:
+                self._keys.clear()
+                return
+            channel, permissions, _ = self._resolve(channel, permissions)
+            self._keys.pop((channel.strip("/"), permissions), None)
+
+    def _generated(self, cache_key, ttl, request, future):
+        try:
+            response = request.result()
+            status = response.get("status", 200)
+            if status != 200:
+                raise EmitterError(status, response.get("message"))
+            key = response["key"]
+        except BaseException as exception:
+            with self._lock:
+                if self._pending.get(cache_key) is future:
+                    del self._pending[cache_key]
+            future.set_exception(exception)
+            return
+
+        now = time.monotonic()
+        expires = now + ttl if ttl else float("inf")
+        with self._lock:
+            self._keys[cache_key] = (key, expires, now + ttl * self.refresh if ttl else expires)
+            if self._pending.get(cache_key) is future:
+                del self._pending[cache_key]
+        future.set_result(key)
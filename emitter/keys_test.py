@@ -0,0 +1,129 @@
+import pytest
+try:
+    from .emitter import Client
+    from .fakes import RecordingMqtt, make_message
+    from .keys import KeyManager
+    from .tracker import EmitterError
+except ImportError:
+    from emitter import Client
+    from fakes import RecordingMqtt, make_message
+    from keys import KeyManager
+    from tracker import EmitterError
+
+def make_client():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    return client
+
+def respond(client, mid, key, status=200):
+    payload = client._json.encode({"req": mid, "key": key, "status": status})
+    client._on_message(None, None, make_message("emitter/keygen/", payload))
+
+def keygen_requests(client):
+    return [client._json.decode(payload) for topic, payload, _ in client._mqtt.published if topic == "emitter/keygen/"]
+
+def test_requests_are_coalesced_and_cached():
+    client = make_client()
+    manager = KeyManager(client, "master")
+    first = manager.key_async("a/")
+    second = manager.key_async("a")
+
+    assert first is second
+    assert len(keygen_requests(client)) == 1
+    respond(client, 1, "ka")
+
+    assert first.result(0) == "ka"
+    assert manager.key("a/") == "ka"
+    assert len(keygen_requests(client)) == 1
+
+def test_permissions_are_cached_apart():
+    client = make_client()
+    manager = KeyManager(client, "master")
+    manager.key_async("a/", "r")
+    manager.key_async("a/", "w")
+
+    assert [r["type"] for r in keygen_requests(client)] == ["r", "w"]
+
+def test_patterns():
+    client = make_client()
+    manager = KeyManager(client, "master")
+    manager.register("sensors/#/", ttl=60)
+    manager.register("sensors/private/", permissions="rwp")
+    manager.key_async("sensors/kitchen/")
+    manager.key_async("sensors/hall/")
+    manager.key_async("sensors/private/room/")
+
+    assert [(r["channel"], r["type"], r["ttl"]) for r in keygen_requests(client)] == [
+        ("sensors/#/", "rw", 60), ("sensors/private/", "rwp", 0)]
+
+def test_refresh_before_expiry():
+    client = make_client()
+    manager = KeyManager(client, "master", ttl=1, refresh=0.0)
+    manager.key_async("a/")
+    respond(client, 1, "old")
+
+    # Served from the cache while the refresh is in flight.
+    assert manager.key("a/") == "old"
+    assert len(keygen_requests(client)) == 2
+    respond(client, 2, "new")
+    assert manager.key("a/") == "new"
+
+def test_failure_is_not_cached():
+    client = make_client()
+    manager = KeyManager(client, "master")
+    future = manager.key_async("a/")
+    respond(client, 1, None, status=401)
+
+    with pytest.raises(EmitterError):
+        future.result(0)
+    manager.key_async("a/")
+    assert len(keygen_requests(client)) == 2
+
+def test_client_resolves_keys():
+    client = make_client()
+    client.key_manager = KeyManager(client, "master")
+    client.key_manager.key_async("a/")
+    respond(client, 1, "ka")
+
+    client.publish(None, "a/", "hello")
+    client.subscribe(None, "a/")
+
+    assert ("ka/a/", "hello", 0) in client._mqtt.published
+    assert ("subscribe", "ka/a/") in client._mqtt.published
+
+def test_client_requires_key_without_manager():
+    with pytest.raises(ValueError):
+        make_client().publish(None, "a/", "hello")
+
+def test_network_thread_defers_until_key():
+    client = make_client()
+    client.key_manager = KeyManager(client, "master")
+    # Subscribing from on_connect must not wait for a response read by the same thread.
+    client.on_connect = lambda: client.subscribe(None, "a/")
+    client._on_connect(client._mqtt, None, {}, 0)
+    client.publish(None, "a/", "hello")
+
+    assert ("subscribe", "ka/a/") not in client._mqtt.published
+    respond(client, 1, "ka")
+    assert ("subscribe", "ka/a/") in client._mqtt.published
+    assert ("ka/a/", "hello", 0) in client._mqtt.published
+
+def test_refreshed_keys_are_used():
+    client = make_client()
+    client.key_manager = KeyManager(client, "master")
+    client.key_manager.key_async("a/")
+    respond(client, 1, "ka")
+    handle = client.channel(None, "a/")
+    handle.publish("1")
+    client.subscribe(None, "a/")
+
+    client.key_manager.invalidate()
+    client.key_manager.key_async("a/")
+    respond(client, len(client._mqtt.published), "kb")
+    handle.publish("2")
+    client._on_disconnect(client._mqtt, None, 1)
+    client._on_connect(client._mqtt, None, {}, 0)
+
+    assert ("ka/a/", "1", 0) in client._mqtt.published
+    assert ("kb/a/", "2", 0) in client._mqtt.published
+    assert ("subscribe", [("kb/a/", 0)]) in client._mqtt.published
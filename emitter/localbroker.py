@@ -0,0 +1,437 @@
+"""
+A lightweight, in-process stand-in for an Emitter broker, meant for tests and
+benchmarks. It speaks enough MQTT 3.1.1 for the Emitter clients in this
+package and understands Emitter's key/channel/options topic format, $share
+groups and the keygen, keyban, link, me and presence control requests. Keys
+are not validated, and messages are neither stored nor retained.
+
+Run it on its own, for clients in other processes, with:
+    python -m emitter.localbroker [--host HOST] [--port PORT]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    from .subtrie import SubTrie
+except ImportError:
+    from subtrie import SubTrie
+
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length > 0:
+            byte |= 0x80
+        encoded.append(byte)
+        if length == 0:
+            return bytes(encoded)
+
+def _packet(packet_type, flags, body):
+    return bytes(bytearray([(packet_type << 4) | flags])) + _encode_length(len(body)) + body
+
+def _read_string(data, offset):
+    length, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+def parse_topic(topic):
+    """
+    * Splits an Emitter topic into its key, share group, channel and options.
+    * The channel is normalized to always end with a slash.
+    """
+    path, _, query = topic.partition("?")
+    options = {}
+    for option in filter(None, query.split("&")):
+        name, _, value = option.partition("=")
+        options[name] = value
+
+    words = [word for word in path.split("/") if word]
+    key = words.pop(0) if words else ""
+    group = None
+    if len(words) >= 2 and words[0] == "$share":
+        group = words[1]
+        words = words[2:]
+
+    return key, group, "/".join(words) + "/", options
+
+def _new_id():
+    return base64.b32encode(os.urandom(16)).decode("ascii").rstrip("=")
+
+def _new_key():
+    return base64.urlsafe_b64encode(os.urandom(24)).decode("ascii")
+
+
+class _Subscribers(object):
+    """
+    * The subscriptions to one channel: plain subscribers each get every
+    * message, while each share group gets it once, its members taking turns.
+    """
+    __slots__ = ("sessions", "groups", "turns")
+
+    def __init__(self):
+        self.sessions = {}
+        self.groups = {}
+        self.turns = {}
+
+    def __bool__(self):
+        return bool(self.sessions or self.groups)
+
+
+class _Session(object):
+    """
+    * One connected client on the broker side.
+    """
+
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.task = None
+        self.id = _new_id()
+        self.client_id = None
+        self.username = None
+        self.subscriptions = {}
+        self.links = {}
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def deliver(self, channel, payload):
+        topic = channel.encode("utf-8")
+        self.send(_packet(PUBLISH, 0, struct.pack("!H", len(topic)) + topic + payload))
+
+    async def run(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(1)
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if byte & 0x80 == 0:
+                        break
+                body = await self.reader.readexactly(length) if length else b""
+                if not self.handle(header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker._remove_session(self)
+            self.writer.close()
+
+    def handle(self, packet_type, flags, body):
+        if packet_type == CONNECT:
+            _, offset = _read_string(body, 0)
+            connect_flags = body[offset + 1]
+            self.client_id, offset = _read_string(body, offset + 4)
+            if connect_flags & 0x04:
+                _, offset = _read_string(body, offset)
+                _, offset = _read_string(body, offset)
+            if connect_flags & 0x80:
+                self.username, offset = _read_string(body, offset)
+            self.send(_packet(CONNACK, 0, b"\x00\x00"))
+
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, offset = _read_string(body, 0)
+            packet_id = None
+            if qos > 0:
+                packet_id, = struct.unpack_from("!H", body, offset)
+                self.send(_packet(PUBACK, 0, body[offset:offset + 2]))
+                offset += 2
+            self.broker._publish(self, topic, body[offset:], packet_id)
+
+        elif packet_type == SUBSCRIBE:
+            packet_id = body[:2]
+            offset = 2
+            granted = bytearray()
+            while offset < len(body):
+                topic, offset = _read_string(body, offset)
+                granted.append(min(body[offset], 1))
+                offset += 1
+                self.broker._subscribe(self, topic)
+            self.send(_packet(SUBACK, 0, packet_id + bytes(granted)))
+
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = body[:2]
+            offset = 2
+            while offset < len(body):
+                topic, offset = _read_string(body, offset)
+                self.broker._unsubscribe(self, topic)
+            self.send(_packet(UNSUBACK, 0, packet_id))
+
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP, 0, b""))
+
+        elif packet_type == DISCONNECT:
+            return False
+
+        return True
+
+
+class LocalBroker(object):
+    """
+    * Represents an in-process Emitter broker listening on a local TCP port.
+    * Use start()/stop() from a running event loop, or start_thread()/
+    * stop_thread() to run it on a background thread for synchronous clients.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._sessions = set()
+        self._subscribers = {}
+        self._trie = SubTrie(cache_size=0)
+        self._watchers = {}
+        self._control = {
+            "keygen": self._keygen,
+            "keyban": self._keyban,
+            "link": self._link,
+            "me": self._me,
+            "presence": self._presence,
+        }
+        self._loop = None
+        self._thread = None
+
+    async def start(self):
+        """
+        * Starts listening. With port 0, the chosen port is stored in self.port.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """
+        * Stops listening and drops every connected client.
+        """
+        self._server.close()
+        tasks = [session.task for session in self._sessions]
+        for session in list(self._sessions):
+            session.writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def start_thread(self):
+        """
+        * Runs the broker on its own event loop in a daemon thread.
+        """
+        started = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="emitter-localbroker", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        """
+        * Stops a broker started with start_thread().
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start_thread()
+
+    def __exit__(self, *args):
+        self.stop_thread()
+
+    async def _accept(self, reader, writer):
+        session = _Session(self, reader, writer)
+        session.task = asyncio.current_task()
+        self._sessions.add(session)
+        await session.run()
+
+    def _remove_session(self, session):
+        self._sessions.discard(session)
+        for topic in list(session.subscriptions):
+            self._unsubscribe(session, topic)
+        for watchers in self._watchers.values():
+            watchers.discard(session)
+
+    def _subscribe(self, session, topic):
+        _, group, channel, _ = parse_topic(topic)
+        if topic in session.subscriptions:
+            return
+        session.subscriptions[topic] = (channel, group)
+        subscribers = self._subscribers.get(channel)
+        if subscribers is None:
+            subscribers = self._subscribers[channel] = _Subscribers()
+            self._trie.insert(channel, subscribers)
+        if group is None:
+            subscribers.sessions[session] = topic
+        else:
+            subscribers.groups.setdefault(group, []).append(session)
+        self._notify(session, "subscribe", channel)
+
+    def _unsubscribe(self, session, topic):
+        channel, group = session.subscriptions.pop(topic, (None, None))
+        subscribers = self._subscribers.get(channel)
+        if subscribers is None:
+            return
+        if group is None:
+            subscribers.sessions.pop(session, None)
+        else:
+            members = subscribers.groups[group]
+            members.remove(session)
+            if not members:
+                del subscribers.groups[group]
+                subscribers.turns.pop(group, None)
+        if not subscribers:
+            del self._subscribers[channel]
+            self._trie.delete(channel)
+        self._notify(session, "unsubscribe", channel)
+
+    def _publish(self, sender, topic, payload, packet_id=None):
+        if topic.startswith("emitter/"):
+            handler = self._control.get(topic.split("/")[1])
+            try:
+                request = json.loads(payload) if payload else {}
+            except ValueError:
+                request = None
+            if handler is None or not isinstance(request, dict):
+                self._respond(sender, "error", packet_id, {"status": 400, "message": "the request was invalid"})
+            else:
+                handler(sender, request, packet_id)
+            return
+
+        # Messages published through a link go to its channel.
+        topic = sender.links.get(topic, topic)
+        _, _, channel, options = parse_topic(topic)
+        echo = options.get("me") != "0"
+
+        delivered = set()
+        for subscribers in self._trie.lookup(channel):
+            for session in subscribers.sessions:
+                if session in delivered or (session is sender and not echo):
+                    continue
+                delivered.add(session)
+                session.deliver(channel, payload)
+            for group, members in subscribers.groups.items():
+                turn = subscribers.turns.get(group, 0)
+                subscribers.turns[group] = turn + 1
+                session = members[turn % len(members)]
+                if session in delivered or (session is sender and not echo):
+                    continue
+                delivered.add(session)
+                session.deliver(channel, payload)
+
+    def _respond(self, session, kind, packet_id, response):
+        if packet_id is not None:
+            response["req"] = packet_id
+        session.deliver("emitter/" + kind + "/", json.dumps(response).encode("utf-8"))
+
+    @staticmethod
+    def _who(session):
+        who = {"id": session.id}
+        if session.username:
+            who["username"] = session.username
+        return who
+
+    def _notify(self, session, event, channel):
+        watchers = self._watchers.get(channel)
+        if not watchers:
+            return
+        payload = json.dumps({"time": int(time.time()), "event": event, "channel": channel,
+                              "who": self._who(session)}).encode("utf-8")
+        for watcher in watchers:
+            watcher.deliver("emitter/presence/", payload)
+
+    def _keygen(self, session, request, packet_id):
+        if not request.get("key") or not request.get("channel"):
+            self._respond(session, "error", packet_id, {"status": 400, "message": "the request was invalid"})
+            return
+        self._respond(session, "keygen", packet_id, {"status": 200, "key": _new_key(), "channel": request["channel"]})
+
+    def _keyban(self, session, request, packet_id):
+        self._respond(session, "keyban", packet_id, {"status": 200, "banned": bool(request.get("banned"))})
+
+    def _link(self, session, request, packet_id):
+        name = request.get("name")
+        channel = request.get("channel")
+        if not name or not channel:
+            self._respond(session, "error", packet_id, {"status": 400, "message": "the request was invalid"})
+            return
+        topic = request.get("key", "").strip("/") + "/" + channel
+        session.links[name] = topic
+        if request.get("subscribe"):
+            self._subscribe(session, topic)
+        self._respond(session, "link", packet_id, {"status": 200, "name": name, "channel": channel})
+
+    def _me(self, session, request, packet_id):
+        links = dict((name, parse_topic(topic)[2]) for name, topic in session.links.items())
+        self._respond(session, "me", packet_id, {"id": session.id, "links": links})
+
+    def _presence(self, session, request, packet_id):
+        channel = request.get("channel", "").strip("/") + "/"
+        if request.get("changes"):
+            self._watchers.setdefault(channel, set()).add(session)
+        else:
+            watchers = self._watchers.get(channel)
+            if watchers is not None:
+                watchers.discard(session)
+                if not watchers:
+                    del self._watchers[channel]
+        if request.get("status"):
+            subscribers = self._subscribers.get(channel)
+            who = []
+            if subscribers is not None:
+                sessions = list(subscribers.sessions)
+                for members in subscribers.groups.values():
+                    sessions.extend(members)
+                who = [self._who(s) for s in dict.fromkeys(sessions)]
+            self._respond(session, "presence", packet_id,
+                          {"time": int(time.time()), "event": "status", "channel": channel, "who": who})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local Emitter broker stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    async def serve():
+        broker = await LocalBroker(args.host, args.port).start()
+        print("listening on %s:%d" % (broker.host, broker.port))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,76 @@
+import threading
+try:
+    from .emitter import Client
+    from .localbroker import LocalBroker, parse_topic
+except ImportError:
+    from emitter import Client
+    from localbroker import LocalBroker, parse_topic
+
+def connect(broker):
+    client = Client()
+    connected = threading.Event()
+    client.on_connect = connected.set
+    client.connect(host="127.0.0.1", port=broker.port, secure=False)
+    client.loop_start()
+    assert connected.wait(5)
+    return client
+
+def close(*clients):
+    for client in clients:
+        client.disconnect()
+        client.loop_stop()
+
+def test_parse_topic():
+    assert parse_topic("key/a/b/?ttl=5&me=0") == ("key", None, "a/b/", {"ttl": "5", "me": "0"})
+    assert parse_topic("key/$share/g/a/") == ("key", "g", "a/", {})
+
+def test_share_groups():
+    with LocalBroker() as broker:
+        members = [connect(broker) for _ in range(3)]
+        received = [[] for _ in members]
+        for client, messages in zip(members, received):
+            client.subscribe_with_group("key", "jobs/", "g", messages.append)
+        observer = connect(broker)
+        everything = []
+        observer.subscribe("key", "jobs/", everything.append)
+        # Subscriptions are in place once a control request went through.
+        for client in members + [observer]:
+            client.me_async().result(5)
+
+        publisher = connect(broker)
+        for i in range(30):
+            publisher.publish("key", "jobs/", str(i))
+        publisher.me_async().result(5)
+        for client in members + [observer]:
+            client.me_async().result(5)
+
+        assert [len(messages) for messages in received] == [10, 10, 10]
+        assert len(everything) == 30
+        close(publisher, observer, *members)
+
+def test_control_requests():
+    with LocalBroker() as broker:
+        client = connect(broker)
+        keygen = client.keygen_async("master", "a/", "rw").result(5)
+        assert keygen["status"] == 200
+        assert keygen["channel"] == "a/"
+        assert len(keygen["key"]) == 32
+
+        received = []
+        client.subscribe("key", "a/", received.append)
+        link = client.link_async("key", "a/", "a0", False).result(5)
+        assert link["name"] == "a0"
+        client.publish_with_link("a0", "via link")
+        me = client.me_async().result(5)
+        assert me["links"] == {"a0": "a/"}
+        assert [m.as_string() for m in received] == ["via link"]
+
+        events = []
+        status = client.presence_async("key", "a/", changes=True, optional_handler=events.append).result(5)
+        assert [who["id"] for who in status["who"]] == [me["id"]]
+        other = connect(broker)
+        other.subscribe("key", "a/")
+        other.me_async().result(5)
+        client.me_async().result(5)
+        assert [event["event"] for event in events] == ["status", "subscribe"]
+        close(other, client)
@@ -0,0 +1,250 @@
+"""
+Opt-in metrics of a client: message counts, latency histograms and queue
+depths, with a snapshot API and a Prometheus text exporter.
+"""
+import threading
+try:
+    from .hooks import Hook, handler_name
+    from .subtrie import SubTrie
+except ImportError:
+    from hooks import Hook, handler_name
+    from subtrie import SubTrie
+
+
+# Histograms keep 16 buckets per power of two, for a relative error below 1/16.
+_SUB_BUCKETS = 16
+_BUCKETS = 64 * _SUB_BUCKETS
+
+
+def _bucket(value):
+    shift = max(value.bit_length() - 5, 0)
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_value(index):
+    # The middle of the values falling in the bucket.
+    shift = max(index // _SUB_BUCKETS - 1, 0)
+    low = (index - shift * _SUB_BUCKETS) << shift
+    return low + ((1 << shift) - 1) / 2.0
+
+
+class Histogram(object):
+    """
+    * A latency histogram in the manner of HdrHistogram: durations are counted
+    * in logarithmic buckets of microseconds, so percentiles cost a fixed amount
+    * of memory whatever the number of values, within a few percent.
+    """
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._counts = [0] * _BUCKETS
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6)
+        self._counts[min(_bucket(micros), _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        * Returns the value, in seconds, below which a fraction q of the values fall.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= rank:
+                return min(_bucket_value(index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        result = {"count": self.count, "sum": self.total, "max": self.max}
+        for q in self.QUANTILES:
+            result["p%g" % (q * 100)] = self.quantile(q)
+        return result
+
+
+class Metrics(Hook):
+    """
+    * Collects the metrics of a client, once assigned to its metrics property:
+    *  - counters: messages and bytes published and received, per channel,
+    *  - histograms: trie lookup and decoding time per channel, and handler
+    *    time per handler,
+    *  - gauges: paho's outgoing queue, the inbound queue, the dispatcher
+    *    queue and the outbox, read when taking a snapshot.
+    *
+    * Channels are labelled with the longest pattern registered with pattern()
+    * matching them, or else with their own name, up to max_channels distinct
+    * ones beyond which they are counted as "other".
+    *
+    * Handler times are measured where handlers run: not with a process
+    * dispatcher.
+    """
+
+    def __init__(self, max_channels=1000):
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._patterns = SubTrie()
+        self._has_patterns = False
+        self._labels = {}
+        self._channels = 0
+
+    def pattern(self, channel):
+        """
+        * Labels the channels matching a pattern, wildcards included, with it.
+        """
+        depth = len(list(SubTrie._get_words(channel)))
+        self._patterns.insert(channel, (depth, channel))
+        self._has_patterns = True
+        with self._lock:
+            self._labels.clear()
+            self._channels = 0
+
+    def label(self, channel):
+        """
+        * Returns the label of a channel.
+        """
+        label = self._labels.get(channel)
+        if label is not None:
+            return label
+
+        matches = self._patterns.lookup(channel) if self._has_patterns else ()
+        if matches:
+            # Not kept here, as patterns may match any number of channels: the
+            # trie caches its recent lookups.
+            return max(matches, key=lambda match: match[0])[1]
+        if self._channels >= self.max_channels:
+            return "other"
+        self._channels += 1
+        self._labels[channel] = channel
+        return channel
+
+    def gauge(self, name, read):
+        """
+        * Registers a gauge, read by calling read() when taking a snapshot.
+        """
+        self._gauges[name] = read
+
+    def count(self, name, label, value=1):
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(self, name, label, seconds):
+        key = (name, label)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.record(seconds)
+
+    def published(self, channel, size):
+        label = self.label(channel)
+        with self._lock:
+            for name, value in (("published_messages", 1), ("published_bytes", size)):
+                key = (name, label)
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def received(self, message):
+        label = self.label(message.channel)
+        size = len(message.raw)
+        with self._lock:
+            for name, value in (("received_messages", 1), ("received_bytes", size)):
+                key = (name, label)
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def looked_up(self, message, handlers, seconds):
+        self.record("lookup_seconds", self.label(message.channel), seconds)
+
+    def decoded(self, message, seconds):
+        self.record("decode_seconds", self.label(message.channel), seconds)
+
+    def handled(self, handler, message, seconds):
+        self.record("handler_seconds", handler_name(handler), seconds)
+
+    def snapshot(self):
+        """
+        * Returns the current value of every metric, as a dictionary of counters,
+        * histograms and gauges, each by name and then by label.
+        """
+        result = {"counters": {}, "histograms": {}, "gauges": {}}
+        with self._lock:
+            for (name, label), value in self._counters.items():
+                result["counters"].setdefault(name, {})[label] = value
+            for (name, label), histogram in self._histograms.items():
+                result["histograms"].setdefault(name, {})[label] = histogram.snapshot()
+        for name, read in self._gauges.items():
+            try:
+                result["gauges"][name] = read()
+            except Exception:
+                result["gauges"][name] = None
+        return result
+
+    def prometheus(self, prefix="emitter_"):
+        """
+        * Returns the metrics in the Prometheus text exposition format. Histograms
+        * are exposed as summaries.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, values in sorted(snapshot["counters"].items()):
+            lines.append("# TYPE %s%s_total counter" % (prefix, name))
+            for label, value in sorted(values.items()):
+                lines.append("%s%s_total{%s} %s" % (prefix, name, _label_pair(name, label), value))
+        for name, values in sorted(snapshot["histograms"].items()):
+            lines.append("# TYPE %s%s summary" % (prefix, name))
+            for label, histogram in sorted(values.items()):
+                pair = _label_pair(name, label)
+                for q in Histogram.QUANTILES:
+                    lines.append('%s%s{%s,quantile="%g"} %.9f' % (prefix, name, pair, q, histogram["p%g" % (q * 100)]))
+                lines.append("%s%s_sum{%s} %.9f" % (prefix, name, pair, histogram["sum"]))
+                lines.append("%s%s_count{%s} %d" % (prefix, name, pair, histogram["count"]))
+        for name, value in sorted(snapshot["gauges"].items()):
+            if value is None:
+                continue
+            lines.append("# TYPE %s%s gauge" % (prefix, name))
+            lines.append("%s%s %s" % (prefix, name, value))
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port, host=""):
+        """
+        * Serves the metrics to Prometheus over HTTP, on a daemon thread. Returns
+        * the server, to shutdown() once done.
+        """
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="emitter-metrics", daemon=True)
+        thread.start()
+        return server
+
+
+def _label_pair(name, label):
+    kind = "handler" if name.startswith("handler") else "channel"
+    return '%s="%s"' % (kind, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
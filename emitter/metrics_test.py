@@ -0,0 +1,75 @@
+import pytest
+try:
+    from .emitter import Client
+    from .fakes import RecordingMqtt, make_message
+    from .metrics import Histogram, Metrics
+except ImportError:
+    from emitter import Client
+    from fakes import RecordingMqtt, make_message
+    from metrics import Histogram, Metrics
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for micros in range(1, 10001):
+        histogram.record(micros / 1e6)
+
+    assert histogram.count == 10000
+    assert histogram.max == pytest.approx(0.01)
+    for q in (0.5, 0.9, 0.99):
+        assert histogram.quantile(q) == pytest.approx(q * 0.01, rel=1.0 / 16)
+    assert Histogram().quantile(0.5) == 0.0
+
+def test_labels():
+    metrics = Metrics(max_channels=1)
+    metrics.pattern("sensors/+/temp/")
+    metrics.pattern("sensors/")
+
+    assert metrics.label("sensors/a/temp/") == "sensors/+/temp/"
+    assert metrics.label("sensors/a/humidity/") == "sensors/"
+    assert metrics.label("a/") == "a/"
+    assert metrics.label("b/") == "other"
+
+    for i in range(5000):
+        assert metrics.label("sensors/%d/temp/" % i) == "sensors/+/temp/"
+    assert len(metrics._labels) == 1
+
+def handle(message):
+    pass
+
+def test_client_metrics():
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    client._mqtt._out_messages = {}
+    client.metrics = metrics = Metrics()
+    client.subscribe("key", "a/", handle)
+    client.publish("key", "a/", b"hello")
+    client._on_message(None, None, make_message("a/", b"hello"))
+    client._on_message(None, None, make_message("emitter/me/", b"{}"))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["published_messages"] == {"a/": 1}
+    assert snapshot["counters"]["published_bytes"] == {"a/": 5}
+    assert snapshot["counters"]["received_messages"] == {"a/": 1}
+    assert snapshot["histograms"]["lookup_seconds"]["a/"]["count"] == 1
+    assert snapshot["histograms"]["handler_seconds"][__name__ + ".handle"]["count"] == 1
+    assert snapshot["gauges"]["paho_queue"] == 0
+
+    text = metrics.prometheus()
+    assert 'emitter_received_messages_total{channel="a/"} 1' in text
+    assert 'emitter_handler_seconds_count{handler="%s.handle"} 1' % __name__ in text
+    assert "emitter_inbound_queue 0" in text
+
+def test_prometheus_server():
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        from urllib2 import urlopen
+
+    metrics = Metrics()
+    metrics.count("received_messages", "a/")
+    server = metrics.serve_prometheus(0, "127.0.0.1")
+    try:
+        body = urlopen("http://127.0.0.1:%d/metrics" % server.server_address[1]).read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert 'emitter_received_messages_total{channel="a/"} 1' in body
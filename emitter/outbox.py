@@ -0,0 +1,214 @@
+"""
+A persistent queue of outgoing messages, kept in a memory-mapped file so
+that publishes made while disconnected survive a restart.
+"""
+import mmap
+import os
+import struct
+import threading
+
+
+# Magic, version, capacity, head, tail and count, the offsets being logical:
+# they only grow, and their position in the ring is the offset modulo capacity.
+_HEADER = struct.Struct("!4sIQQQQ")
+_HEADER_SIZE = 64
+_MAGIC = b"EMOB"
+_VERSION = 1
+
+# Payload length, topic length and flags, followed by the topic and payload.
+_RECORD = struct.Struct("!IHB")
+# A payload length marking the end of the ring, the next record is at its start.
+_WRAP = 0xffffffff
+_RETAIN = 4
+
+
+class OutboxFull(Exception):
+    """
+    * Raised when a message does not fit in an outbox with the ERROR policy.
+    """
+
+
+def _to_bytes(payload):
+    if payload is None:
+        return b""
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, bytearray):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    return str(payload).encode("ascii")
+
+
+class Outbox(object):
+    """
+    * A ring buffer of messages waiting to be published, in a memory-mapped
+    * file. Messages are appended and removed in order, and writes go to the
+    * page cache only: they survive the process but not the machine, unless
+    * flush() is called.
+    *
+    * size is the capacity of the ring in bytes, and max_messages optionally
+    * caps the number of messages. When a message does not fit, the policy
+    * decides what happens:
+    *  - DROP_OLDEST discards the oldest messages until it fits.
+    *  - DROP_NEWEST discards the message.
+    *  - ERROR raises OutboxFull.
+    *
+    * An existing file is reopened with its messages and its own size.
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    ERROR = "error"
+
+    def __init__(self, path, size=16 * 1024 * 1024, max_messages=None, policy=DROP_OLDEST, batch=100):
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST, self.ERROR):
+            raise ValueError("unknown policy: " + str(policy))
+        self.path = path
+        self.max_messages = max_messages
+        self.policy = policy
+        self.batch = batch
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing < _HEADER_SIZE:
+                os.ftruncate(fd, _HEADER_SIZE + size)
+            self._map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        if existing < _HEADER_SIZE:
+            self.capacity = size
+            self._head = self._tail = self._count = 0
+            self._write_header()
+        else:
+            magic, version, self.capacity, self._head, self._tail, self._count = _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC or version != _VERSION or self.capacity != len(self._map) - _HEADER_SIZE:
+                self._map.close()
+                raise ValueError("not an outbox file: " + path)
+
+    def __len__(self):
+        return self._count
+
+    def _write_header(self):
+        _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, self.capacity, self._head, self._tail, self._count)
+
+    def _record_at(self, offset):
+        # Returns the logical offset of the record found at offset, after any
+        # wrap, along with its payload and topic lengths and flags.
+        position = offset % self.capacity
+        remaining = self.capacity - position
+        if remaining >= _RECORD.size:
+            length, topic_length, flags = _RECORD.unpack_from(self._map, _HEADER_SIZE + position)
+            if length != _WRAP:
+                return offset, length, topic_length, flags
+        offset += remaining
+        length, topic_length, flags = _RECORD.unpack_from(self._map, _HEADER_SIZE)
+        return offset, length, topic_length, flags
+
+    def _fits(self, needed):
+        if self.max_messages is not None and self._count >= self.max_messages:
+            return False
+        remaining = self.capacity - self._tail % self.capacity
+        padding = remaining if remaining < needed else 0
+        return self._tail - self._head + padding + needed <= self.capacity
+
+    def _drop_oldest(self):
+        offset, length, topic_length, _ = self._record_at(self._head)
+        self._head = offset + _RECORD.size + topic_length + length
+        self._count -= 1
+        self.dropped += 1
+        self._rewind()
+
+    def _rewind(self):
+        if not self._count and self._tail % self.capacity:
+            # Empty, start over at the beginning of the ring.
+            self._head = self._tail = self._tail + self.capacity - self._tail % self.capacity
+
+    def append(self, topic, payload, qos=0, retain=False):
+        """
+        * Appends a message, applying the policy when it does not fit. Returns
+        * whether it was appended.
+        """
+        topic = topic.encode("utf-8")
+        payload = _to_bytes(payload)
+        needed = _RECORD.size + len(topic) + len(payload)
+        if needed > self.capacity:
+            raise ValueError("message larger than the outbox")
+
+        with self._lock:
+            self._rewind()
+            while not self._fits(needed):
+                if self.policy == self.ERROR:
+                    self._write_header()
+                    raise OutboxFull("outbox full: " + self.path)
+                if self.policy == self.DROP_NEWEST or not self._count:
+                    self.dropped += 1
+                    self._write_header()
+                    return False
+                self._drop_oldest()
+
+            position = self._tail % self.capacity
+            remaining = self.capacity - position
+            if remaining < needed:
+                if remaining >= _RECORD.size:
+                    _RECORD.pack_into(self._map, _HEADER_SIZE + position, _WRAP, 0, 0)
+                self._tail += remaining
+                position = 0
+
+            start = _HEADER_SIZE + position
+            _RECORD.pack_into(self._map, start, len(payload), len(topic), qos | (_RETAIN if retain else 0))
+            start += _RECORD.size
+            self._map[start:start + len(topic)] = topic
+            start += len(topic)
+            self._map[start:start + len(payload)] = payload
+            # The record is complete before the header points past it.
+            self._tail += needed
+            self._count += 1
+            self._write_header()
+            return True
+
+    def peek(self, count):
+        """
+        * Returns up to count of the oldest (topic, payload, qos, retain) messages
+        * without removing them, and the offset to commit() once they are sent.
+        """
+        messages = []
+        with self._lock:
+            offset = self._head
+            while len(messages) < count and offset < self._tail:
+                offset, length, topic_length, flags = self._record_at(offset)
+                start = _HEADER_SIZE + offset % self.capacity + _RECORD.size
+                topic = self._map[start:start + topic_length].decode("utf-8")
+                payload = self._map[start + topic_length:start + topic_length + length]
+                messages.append((topic, payload, flags & 3, bool(flags & _RETAIN)))
+                offset += _RECORD.size + topic_length + length
+        return messages, offset
+
+    def commit(self, offset):
+        """
+        * Removes the messages before offset, as returned by peek().
+        """
+        with self._lock:
+            # Some of them may have been dropped in the meantime.
+            while self._head < offset and self._count:
+                head, length, topic_length, _ = self._record_at(self._head)
+                self._head = head + _RECORD.size + topic_length + length
+                self._count -= 1
+            if not self._count:
+                self._head = self._tail
+            self._write_header()
+
+    def flush(self):
+        """
+        * Writes the outbox to disk.
+        """
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
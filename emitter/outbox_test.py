@@ -0,0 +1,162 @@
+import pytest
+try:
+    from .outbox import Outbox, OutboxFull
+except ImportError:
+    from outbox import Outbox, OutboxFull
+
+def drain(outbox, count=1000):
+    messages, offset = outbox.peek(count)
+    outbox.commit(offset)
+    return messages
+
+def test_order_and_flags(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox"), size=4096)
+    outbox.append("key/a/", b"1")
+    outbox.append("key/b/", u"hé", qos=1, retain=True)
+    outbox.append("key/c/", 3)
+
+    messages, offset = outbox.peek(2)
+    assert messages == [("key/a/", b"1", 0, False), ("key/b/", u"hé".encode("utf-8"), 1, True)]
+    assert len(outbox) == 3
+    outbox.commit(offset)
+    assert drain(outbox) == [("key/c/", b"3", 0, False)]
+    assert len(outbox) == 0
+
+def test_wrap_around(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox"), size=100)
+    received = []
+    for i in range(50):
+        assert outbox.append("t/", b"%02d" % i + b"x" * 20)
+        if i % 3 == 2:
+            received += drain(outbox)
+    received += drain(outbox)
+
+    assert [payload[:2] for _, payload, _, _ in received] == [b"%02d" % i for i in range(50)]
+    assert outbox.dropped == 0
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "outbox")
+    outbox = Outbox(path, size=1024)
+    for i in range(5):
+        outbox.append("t/", b"%d" % i)
+    messages, offset = outbox.peek(2)
+    outbox.commit(offset)
+    outbox.close()
+
+    reopened = Outbox(path, size=64)
+    assert reopened.capacity == 1024
+    assert len(reopened) == 3
+    assert [payload for _, payload, _, _ in drain(reopened)] == [b"2", b"3", b"4"]
+
+def test_overflow_policies(tmp_path):
+    oldest = Outbox(str(tmp_path / "oldest"), size=4096, max_messages=3)
+    for i in range(5):
+        assert oldest.append("t/", b"%d" % i)
+    assert oldest.dropped == 2
+    assert [payload for _, payload, _, _ in drain(oldest)] == [b"2", b"3", b"4"]
+
+    newest = Outbox(str(tmp_path / "newest"), size=4096, max_messages=3, policy=Outbox.DROP_NEWEST)
+    assert [newest.append("t/", b"%d" % i) for i in range(5)] == [True, True, True, False, False]
+    assert [payload for _, payload, _, _ in drain(newest)] == [b"0", b"1", b"2"]
+
+    error = Outbox(str(tmp_path / "error"), size=32, policy=Outbox.ERROR)
+    error.append("t/", b"x" * 10)
+    with pytest.raises(OutboxFull):
+        error.append("t/", b"x" * 10)
+    with pytest.raises(ValueError):
+        error.append("t/", b"x" * 100)
+
+def test_commit_after_drop(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox"), size=4096, max_messages=2)
+    outbox.append("t/", b"0")
+    outbox.append("t/", b"1")
+    messages, offset = outbox.peek(2)
+    # Dropped while the peeked messages were being sent.
+    outbox.append("t/", b"2")
+    outbox.commit(offset)
+
+    assert [payload for _, payload, _, _ in drain(outbox)] == [b"2"]
+
+def test_drop_until_empty(tmp_path):
+    path = str(tmp_path / "outbox")
+    outbox = Outbox(path, size=100)
+    outbox.append("t/", b"a" * 19)
+    drain(outbox)
+    outbox.append("t/", b"b" * 19)
+    outbox.append("t/", b"c" * 19)
+    drain(outbox, 1)
+
+    # Only fits once the ring is empty and starts over at its beginning.
+    assert outbox.append("t/", b"d" * 79)
+    assert outbox.dropped == 1
+    outbox.close()
+
+    reopened = Outbox(path)
+    assert [payload for _, payload, _, _ in drain(reopened)] == [b"d" * 79]
+
+def test_client_outbox(tmp_path):
+    import threading
+    try:
+        from .emitter import Client
+        from .localbroker import LocalBroker
+    except ImportError:
+        from emitter import Client
+        from localbroker import LocalBroker
+
+    client = Client()
+    client.outbox = Outbox(str(tmp_path / "outbox"))
+    # Published before connecting, kept in the outbox.
+    for i in range(150):
+        client.publish("key", "test/", b"%d" % i, {Client.with_at_least_once()} if i % 2 else {})
+    assert len(client.outbox) == 150
+
+    with LocalBroker() as broker:
+        subscriber = Client()
+        received = []
+        ready = threading.Event()
+        done = threading.Event()
+        def handler(m):
+            received.append(m.as_binary())
+            ready.set()
+            if len(received) == 201:
+                done.set()
+        subscribed = threading.Event()
+        subscriber.on_connect = subscribed.set
+        subscriber.connect(host="127.0.0.1", port=broker.port, secure=False)
+        subscriber.loop_start()
+        assert subscribed.wait(5)
+        subscriber.subscribe("key", "test/", handler)
+        subscriber.publish("key", "test/", "ready")
+        # Received before the client connects, on another connection.
+        assert ready.wait(5)
+
+        client.connect(host="127.0.0.1", port=broker.port, secure=False)
+        client.loop_start()
+        # Published while draining, kept in order behind the outbox.
+        for i in range(150, 200):
+            client.publish("key", "test/", b"%d" % i)
+        try:
+            assert done.wait(5)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+            subscriber.loop_stop()
+            subscriber.disconnect()
+
+    assert received == [b"ready"] + [b"%d" % i for i in range(200)]
+    assert len(client.outbox) == 0
+
+def test_client_outbox_batch(tmp_path):
+    try:
+        from .emitter import Client
+    except ImportError:
+        from emitter import Client
+
+    client = Client()
+    client.outbox = Outbox(str(tmp_path / "outbox"))
+    client.publish("key", "a/", b"0")
+    # Disconnected: queued behind the outbox, complete once stored.
+    batch = client.publish_many("key", [("a/", b"1", None), ("b/", b"2", {Client.with_at_least_once()})])
+
+    assert batch.done and batch.succeeded == 2
+    assert drain(client.outbox) == [("key/a/", b"0", 0, False), ("key/a/", b"1", 0, False), ("key/b/", b"2", 1, False)]
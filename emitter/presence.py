@@ -0,0 +1,112 @@
+"""
+A local view of the presence on channels, kept up to date from presence
+events instead of a status request per query.
+"""
+import threading
+
+
+class PresenceTracker(object):
+    """
+    * Tracks who is subscribed to channels. Each tracked channel starts from a
+    * status snapshot, then applies the subscribe and unsubscribe events the
+    * server sends. After a reconnection, the snapshot is requested again and
+    * replaces the membership, which may have missed events in the meantime.
+    *
+    * Members are indexed by connection id, so counts and membership checks do
+    * not depend on the number of members.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+        self._tracked = {}
+        self._members = {}
+        self._synced = set()
+        client._connection_listeners.append(self._on_connection)
+
+    def track(self, key, channel, optional_handler=None):
+        """
+        * Starts tracking a channel, which requires a key with the presence
+        * permission. Channels can be tracked before connecting. optional_handler
+        * also receives the presence events of the channel, once applied.
+        """
+        name = channel.strip("/")
+        with self._lock:
+            self._tracked[name] = (key, channel, optional_handler)
+            self._members.setdefault(name, {})
+        self._request(key, channel)
+
+    def untrack(self, channel):
+        """
+        * Stops tracking a channel and forgets its members.
+        """
+        name = channel.strip("/")
+        with self._lock:
+            tracked = self._tracked.pop(name, None)
+            self._members.pop(name, None)
+            self._synced.discard(name)
+        if tracked is not None:
+            key, channel, _ = tracked
+            self.client._handler_trie_presence.delete(channel)
+            if self.client._mqtt is not None:
+                self.client.presence(key, channel, status=False, changes=False)
+
+    def _request(self, key, channel):
+        if self.client._mqtt is None:
+            # Requested once connected.
+            return
+        self.client.presence(key, channel, status=True, changes=True, optional_handler=self._on_presence)
+
+    def _on_connection(self, connected):
+        with self._lock:
+            self._synced.clear()
+            tracked = list(self._tracked.values()) if connected else ()
+        for key, channel, _ in tracked:
+            self._request(key, channel)
+
+    def _on_presence(self, event):
+        name = event.get("channel", "").strip("/")
+        kind = event.get("event")
+        who = event.get("who")
+        with self._lock:
+            tracked = self._tracked.get(name)
+            if tracked is None:
+                return
+            if kind == "status":
+                self._members[name] = dict((member["id"], member) for member in who or ())
+                self._synced.add(name)
+            elif kind == "subscribe":
+                self._members[name][who["id"]] = who
+            elif kind == "unsubscribe":
+                self._members[name].pop(who["id"], None)
+
+        handler = tracked[2]
+        if handler is not None:
+            handler(event)
+
+    def synced(self, channel):
+        """
+        * Whether the membership of a channel reflects a snapshot received on the
+        * current connection.
+        """
+        return channel.strip("/") in self._synced
+
+    def count(self, channel):
+        """
+        * Returns the number of connections subscribed to a channel.
+        """
+        return len(self._members.get(channel.strip("/"), ()))
+
+    def contains(self, channel, id):
+        """
+        * Returns whether a connection id is subscribed to a channel.
+        """
+        return id in self._members.get(channel.strip("/"), ())
+
+    def members(self, channel):
+        """
+        * Returns the {"id", "username"} entries of the connections subscribed to
+        * a channel.
+        """
+        with self._lock:
+            return list(self._members.get(channel.strip("/"), {}).values())
@@ -0,0 +1,68 @@
+import json
+try:
+    from .emitter import Client
+    from .fakes import FakeMqtt, make_message
+    from .presence import PresenceTracker
+except ImportError:
+    from emitter import Client
+    from fakes import FakeMqtt, make_message
+    from presence import PresenceTracker
+
+def requests(client):
+    return [(topic, json.loads(payload)) for topic, payload, _ in client._mqtt.published]
+
+def event(client, payload):
+    client._on_message(None, None, make_message("emitter/presence/", json.dumps(payload).encode("utf-8")))
+
+def member(id):
+    return {"id": id, "username": "user" + id}
+
+def make_tracker():
+    client = Client()
+    client._mqtt = FakeMqtt()
+    return client, PresenceTracker(client)
+
+def test_snapshot_then_changes():
+    client, tracker = make_tracker()
+    events = []
+    tracker.track("key", "room/", events.append)
+
+    assert requests(client) == [("emitter/presence/", {"key": "key", "channel": "room/", "status": True, "changes": True})]
+    assert not tracker.synced("room/")
+
+    event(client, {"event": "status", "channel": "room/", "who": [member("1"), member("2")]})
+    event(client, {"event": "subscribe", "channel": "room/", "who": member("3")})
+    event(client, {"event": "unsubscribe", "channel": "room/", "who": member("1")})
+    # Events of sub-channels are not about the channel itself.
+    event(client, {"event": "subscribe", "channel": "room/sub/", "who": member("4")})
+
+    assert tracker.synced("room")
+    assert tracker.count("room/") == 2
+    assert tracker.contains("room/", "3")
+    assert not tracker.contains("room/", "1")
+    assert sorted(m["id"] for m in tracker.members("room/")) == ["2", "3"]
+    assert [e["event"] for e in events] == ["status", "subscribe", "unsubscribe"]
+
+def test_resync_on_reconnect():
+    client, tracker = make_tracker()
+    tracker.track("key", "room/")
+    event(client, {"event": "status", "channel": "room/", "who": [member("1")]})
+
+    client._on_disconnect(None, None, 1)
+    assert not tracker.synced("room/")
+    client._on_connect(None, None, None, 0)
+    assert len(client._mqtt.published) == 2
+
+    event(client, {"event": "status", "channel": "room/", "who": [member("2")]})
+    assert tracker.synced("room/")
+    assert not tracker.contains("room/", "1")
+    assert tracker.count("room/") == 1
+
+def test_untrack():
+    client, tracker = make_tracker()
+    tracker.track("key", "room/")
+    tracker.untrack("room/")
+    event(client, {"event": "status", "channel": "room/", "who": [member("1")]})
+
+    assert requests(client)[-1][1]["changes"] is False
+    assert tracker.count("room/") == 0
@@ -0,0 +1,123 @@
+"""
+Recording of the messages a client receives, and their replay against the
+handlers of a client without a broker, to load test them with real traffic.
+"""
+import collections
+import mmap
+import struct
+import threading
+import time
+try:
+    from .hooks import Hook
+except ImportError:
+    from hooks import Hook
+
+
+_MAGIC = b"EMRC\x01"
+# Reception time in microseconds since the epoch, payload and channel lengths,
+# followed by the channel and the payload.
+_RECORD = struct.Struct("!QIH")
+
+# What Client._on_message reads of a paho message.
+_Received = collections.namedtuple("_Received", ("topic", "payload"))
+
+
+class Recorder(Hook):
+    """
+    * Records the messages received by a client, once added with
+    * Client.add_hook(), to a file of length-prefixed records: the reception
+    * time, the channel and the raw payload. Control messages are not recorded.
+    * An existing file is appended to.
+    """
+
+    def __init__(self, path, buffering=1024 * 1024):
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "ab", buffering)
+        if self._file.tell() == 0:
+            self._file.write(_MAGIC)
+
+    def received(self, message):
+        channel = message.channel.encode("utf-8")
+        payload = message.raw
+        header = _RECORD.pack(int(time.time() * 1e6), len(payload), len(channel))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(channel)
+            self._file.write(payload)
+            self.recorded += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Replayer(object):
+    """
+    * Reads a file written by a Recorder, memory-mapped, and replays its
+    * messages through the handlers of a client, as if they were received.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            self._map.close()
+            raise ValueError("not a recording: " + path)
+
+    def __iter__(self):
+        """
+        * Yields the (timestamp, channel, payload) of the recorded messages, the
+        * timestamp in seconds since the epoch.
+        """
+        data = self._map
+        offset = len(_MAGIC)
+        end = len(data)
+        while offset + _RECORD.size <= end:
+            micros, length, channel_length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if offset + channel_length + length > end:
+                # Cut short while being written.
+                return
+            channel = data[offset:offset + channel_length].decode("utf-8")
+            offset += channel_length
+            yield micros / 1e6, channel, data[offset:offset + length]
+            offset += length
+
+    def replay(self, client, speed=1.0):
+        """
+        * Feeds the recorded messages to client, through its inbound queue,
+        * dispatcher and hooks if any, and returns the number of messages, the
+        * payload bytes, the elapsed seconds and the messages per second.
+        *
+        * speed scales the recorded pace: 1 replays it as recorded, 10 ten times
+        * faster, and None as fast as possible. With an inbound queue or a
+        * dispatcher, the figures are those of handing messages over to them.
+        """
+        count = 0
+        size = 0
+        first = None
+        start = time.perf_counter()
+        for timestamp, channel, payload in self:
+            if speed:
+                if first is None:
+                    first = timestamp
+                delay = start + (timestamp - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            client._on_message(None, None, _Received(channel, payload))
+            count += 1
+            size += len(payload)
+
+        elapsed = time.perf_counter() - start
+        return {"messages": count, "bytes": size, "seconds": elapsed,
+                "throughput": count / elapsed if elapsed > 0 else 0.0}
+
+    def close(self):
+        self._map.close()
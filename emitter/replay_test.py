@@ -0,0 +1,66 @@
+import pytest
+import time
+try:
+    from .emitter import Client
+    from .fakes import RecordingMqtt, make_message
+    from .replay import Recorder, Replayer
+except ImportError:
+    from emitter import Client
+    from fakes import RecordingMqtt, make_message
+    from replay import Recorder, Replayer
+
+def record(path, messages):
+    client = Client()
+    recorder = Recorder(path)
+    client.add_hook(recorder)
+    for channel, payload in messages:
+        client._on_message(None, None, make_message(channel, payload))
+    client._on_message(None, None, make_message("emitter/me/", b"{}"))
+    recorder.close()
+    return recorder
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "recording")
+    recorder = record(path, [("a/", b'{"v": 1}'), ("b/c/", b""), ("a/", b"\x00\xff")])
+    assert recorder.recorded == 3
+
+    replayer = Replayer(path)
+    assert [(channel, payload) for _, channel, payload in replayer] == [
+        ("a/", b'{"v": 1}'), ("b/c/", b""), ("a/", b"\x00\xff")]
+
+    client = Client()
+    client._mqtt = RecordingMqtt()
+    received = []
+    client.subscribe("key", "a/", received.append)
+    stats = replayer.replay(client, speed=None)
+    replayer.close()
+
+    assert stats["messages"] == 3
+    assert stats["bytes"] == 10
+    assert stats["throughput"] > 0
+    assert received[0].as_object() == {"v": 1}
+    assert received[1].as_binary() == b"\x00\xff"
+
+def test_replay_pace(tmp_path, monkeypatch):
+    path = str(tmp_path / "recording")
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    recorder = Recorder(path)
+    client = Client()
+    client.add_hook(recorder)
+    for _ in range(3):
+        client._on_message(None, None, make_message("a/", b"x"))
+        now[0] += 0.1
+    recorder.close()
+    monkeypatch.undo()
+
+    replayer = Replayer(path)
+    assert replayer.replay(Client(), speed=1)["seconds"] >= 0.2
+    assert replayer.replay(Client(), speed=10)["seconds"] < 0.1
+    replayer.close()
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        Replayer(str(path))
@@ -0,0 +1,193 @@
+"""
+A client spreading its channels over several MQTT connections, each with its
+own socket and network loop.
+"""
+import bisect
+import re
+import threading
+import time
+import zlib
+
+try:
+    from .emitter import Client, PublishBatch
+except ImportError:
+    from emitter import Client, PublishBatch
+
+
+class HashRing(object):
+    """
+    * Maps channels to shards with consistent hashing: each shard owns replicas
+    * points of a hash ring, and a channel belongs to the shard owning the first
+    * point following its hash. Adding a shard only moves the channels landing
+    * on its own points.
+    """
+
+    def __init__(self, shards, replicas=64):
+        self.shards = shards
+        points = sorted((self._hash("%d-%d" % (shard, replica)), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._owners = [shard for _, shard in points]
+        self._cache = {}
+
+    @staticmethod
+    def _hash(value):
+        return zlib.crc32(value.encode("utf-8")) & 0xffffffff
+
+    def shard(self, channel):
+        """
+        * Returns the shard owning a channel.
+        """
+        shard = self._cache.get(channel)
+        if shard is None:
+            if len(self._cache) >= 65536:
+                self._cache.clear()
+            i = bisect.bisect(self._hashes, self._hash(channel.strip("/")))
+            shard = self._cache[channel] = self._owners[i % len(self._owners)]
+        return shard
+
+
+class ShardedClient(Client):
+    """
+    * Represents a pool of connections to an Emitter server, used as a single
+    * client. Each channel is published and subscribed through the connection
+    * its hash maps to, and messages from every connection go to the same
+    * handlers. Control requests (keygen, presence, me, ...) use the first one.
+    *
+    * Each connection runs its own network loop, so handlers of channels mapped
+    * to different connections may run concurrently. Messages are only ordered
+    * per channel, and without_echo() does not apply across connections: a
+    * message is echoed when published and subscribed on different ones.
+    """
+
+    def __init__(self, connections=4, replicas=64):
+        super(ShardedClient, self).__init__()
+        self._ring = HashRing(connections, replicas)
+        self._shards = []
+        self._connected = set()
+        self._state_lock = threading.Lock()
+
+    @property
+    def connections(self):
+        return self._ring.shards
+
+    def connect(self, host="api.emitter.io", port=443, secure=True, keepalive=30, username=None, max_inflight=100):
+        """
+        * Opens every connection to an Emitter server. on_connect is called once
+        * all of them are established.
+        """
+        formatted_host = re.sub(r"/.*?:\/\//g", "", host)
+        self._shards = [self._create_mqtt(secure, username, max_inflight) for _ in range(self._ring.shards)]
+        self._mqtt = self._shards[0]
+        for shard in self._shards:
+            shard.connect(host=formatted_host, port=port, keepalive=keepalive)
+
+    def disconnect(self):
+        for shard in self._shards:
+            shard.disconnect()
+
+    def loop(self, timeout):
+        for shard in self._shards:
+            shard.loop(timeout=timeout / len(self._shards))
+
+    def loop_forever(self):
+        for shard in self._shards[1:]:
+            shard.loop_start()
+        try:
+            self._shards[0].loop_forever()
+        finally:
+            for shard in self._shards[1:]:
+                shard.loop_stop()
+
+    def loop_start(self):
+        for shard in self._shards:
+            shard.loop_start()
+
+    def loop_stop(self):
+        for shard in self._shards:
+            shard.loop_stop()
+
+    def _mqtt_for(self, channel):
+        return self._shards[self._ring.shard(channel)]
+
+    def _on_connect(self, client, userdata, flags, rc):
+        self._network_threads[client] = threading.get_ident()
+        if rc != 0:
+            super(ShardedClient, self)._on_connect(client, userdata, flags, rc)
+            return
+        with self._state_lock:
+            self._connected.add(client)
+            complete = len(self._connected) == len(self._shards)
+        if complete:
+            super(ShardedClient, self)._on_connect(client, userdata, flags, rc)
+        else:
+            # The last connection to come up replays its own in Client._on_connect.
+            self._resubscribe(client, flags)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connection_lost(client)
+        with self._state_lock:
+            was_complete = len(self._connected) == len(self._shards)
+            self._connected.discard(client)
+        # Reported once, when the pool stops being fully connected.
+        if was_complete:
+            super(ShardedClient, self)._on_disconnect(client, userdata, rc)
+
+    def publish_many(self, key, messages, window=100):
+        """
+        * Publishes a batch of (channel, message, options) tuples, see
+        * Client.publish_many(). The batch is split per connection, and messages
+        * are only sent in order within a connection, so within a channel. window
+        * applies to each connection.
+        """
+        messages = list(messages)
+        groups = {}
+        for index, message in enumerate(messages):
+            groups.setdefault(self._ring.shard(message[0]), []).append(index)
+
+        batches = []
+        for shard, indices in sorted(groups.items()):
+            batch = PublishBatch(self, key, [messages[i] for i in indices], window, self._shards[shard])
+            batches.append((batch, indices))
+        def start(keys):
+            for batch, _ in batches:
+                batch._start(keys)
+        self._with_keys(key, set(channel for channel, _, _ in messages), start)
+        return ShardedBatch(batches, len(messages))
+
+
+class ShardedBatch(object):
+    """
+    * Represents a batch of messages sent with ShardedClient.publish_many(),
+    * with the same interface as PublishBatch.
+    """
+
+    def __init__(self, batches, length):
+        self._batches = batches
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def done(self):
+        return all(batch.done for batch, _ in self._batches)
+
+    @property
+    def succeeded(self):
+        return sum(batch.succeeded for batch, _ in self._batches)
+
+    @property
+    def failures(self):
+        """
+        * The (index, error) of the failed messages, indexed in the whole batch.
+        """
+        return sorted((indices[i], error) for batch, indices in self._batches for i, error in batch.failures)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for batch, _ in self._batches:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not batch.wait(remaining):
+                return False
+        return True
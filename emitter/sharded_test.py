@@ -0,0 +1,67 @@
+import threading
+try:
+    from .emitter import Client
+    from .localbroker import LocalBroker
+    from .sharded import HashRing, ShardedClient
+except ImportError:
+    from emitter import Client
+    from localbroker import LocalBroker
+    from sharded import HashRing, ShardedClient
+
+def test_hash_ring():
+    ring = HashRing(4)
+    channels = ["channel/%d/" % i for i in range(1000)]
+    shards = [ring.shard(c) for c in channels]
+
+    assert set(shards) == {0, 1, 2, 3}
+    assert min(shards.count(s) for s in range(4)) > 100
+    assert ring.shard("channel/1") == ring.shard("channel/1/")
+
+    # Adding a shard only moves channels to the new one.
+    grown = HashRing(5)
+    assert all(grown.shard(c) in (shard, 4) for c, shard in zip(channels, shards))
+
+def test_sharded_client():
+    with LocalBroker() as broker:
+        client = ShardedClient(connections=3)
+        connected = threading.Event()
+        client.on_connect = connected.set
+        client.connect(host="127.0.0.1", port=broker.port, secure=False)
+        client.loop_start()
+        try:
+            assert connected.wait(5)
+            channels = ["c%d/" % i for i in range(12)]
+            assert len(set(client._mqtt_for(c) for c in channels)) > 1
+
+            received = {}
+            lock = threading.Lock()
+            synced = threading.Event()
+            all_received = threading.Event()
+            def handler(m):
+                with lock:
+                    received.setdefault(m.channel, []).append(m.as_binary())
+                    count = sum(len(v) for v in received.values())
+                if count == len(channels):
+                    synced.set()
+                elif count == len(channels) + 120:
+                    all_received.set()
+            for channel in channels:
+                client.subscribe("key", channel, handler)
+            # A channel is published through the connection it is subscribed on,
+            # so this arrives once every subscription is in place.
+            for channel in channels:
+                client.publish("key", channel, "sync")
+            assert synced.wait(5)
+
+            qos1 = {Client.with_at_least_once()}
+            batch = client.publish_many("key", [(channels[i % 12], b"%d" % i, qos1) for i in range(120)], window=5)
+            assert batch.wait(5)
+            assert all_received.wait(5)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+
+    assert batch.failures == []
+    assert batch.succeeded == len(batch) == 120
+    for i, channel in enumerate(channels):
+        assert received[channel] == [b"sync"] + [b"%d" % n for n in range(i, 120, 12)]
@@ -1,59 +1,355 @@
-class SubTrieNode:
-    def __init__(self, parent, word, handler):
-        self.parent = parent
-        self.word = word
-        self.children = {}
+import threading
+from collections import OrderedDict
+try:
+    from sys import intern
+except ImportError:
+    pass # Python 2, intern is a builtin.
+
+
+# Nodes with more children than this keep them in a _FrozenChildren shared by
+# the snapshots, and a batch of writes to it goes through a _ChildMap overlay.
+_FLAT_CHILDREN = 32
+_MISSING = object()
+_DELETED = object()
+
+
+class _FrozenChildren(dict):
+    """
+    * The children of a wide node as a dict which is never modified once in a
+    * trie, so that versions of the node can share it and reads stay dict reads.
+    """
+    __slots__ = ()
+
+    def set(self, key, value):
+        return _ChildMap(self).set(key, value)
+
+    def delete(self, key):
+        return _ChildMap(self).delete(key)
+
+
+class _ChildMap(object):
+    """
+    * A persistent map of the children of a wide node: a _FrozenChildren base
+    * shared by every version of the map, and a small dict of the changes
+    * since, which setting or deleting a key copies. Once the changes outnumber
+    * the square root of the base, they are merged into a new base. Overlays
+    * only live while a batch is edited, a published snapshot compacts them.
+    """
+    __slots__ = ("_base", "_changes", "_length")
+
+    def __init__(self, base, changes=None, length=None):
+        self._base = base
+        self._changes = changes or {}
+        self._length = len(base) if length is None else length
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def items(self):
+        changes = self._changes
+        for item in self._base.items():
+            if item[0] not in changes:
+                yield item
+        for item in changes.items():
+            if item[1] is not _DELETED:
+                yield item
+
+    def get(self, key, default=None):
+        changes = self._changes
+        if changes:
+            value = changes.get(key, _MISSING)
+            if value is not _MISSING:
+                return default if value is _DELETED else value
+        return self._base.get(key, default)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def _with(self, key, value, length):
+        changes = dict(self._changes)
+        changes[key] = value
+        if len(changes) * len(changes) <= len(self._base):
+            return _ChildMap(self._base, changes, length)
+        return _ChildMap(self._base, changes, length).compact()
+
+    def compact(self):
+        base = _FrozenChildren(self._base)
+        for key, value in self._changes.items():
+            if value is _DELETED:
+                base.pop(key, None)
+            else:
+                base[key] = value
+        return base
+
+    def set(self, key, value):
+        return self._with(key, value, self._length + (key not in self))
+
+    def delete(self, key):
+        if key not in self:
+            return self
+        return self._with(key, _DELETED, self._length - 1)
+
+
+class SubTrieNode(object):
+    # Nodes carry no per-instance __dict__, and leaves have no children map
+    # until a word is inserted below them.
+    __slots__ = ("children", "handler")
+
+    def __init__(self, handler=None):
+        self.children = None
         self.handler = handler
 
-class SubTrie:
-    def __init__(self):
-        self.root = SubTrieNode(None, None, None)
+class SubTrieSnapshot(object):
+    """
+    * An immutable view of a SubTrie. Nodes reachable from a snapshot are never
+    * modified, so lookups need no locking while the trie is being written to.
+    """
+    __slots__ = ("root", "_trie", "_cache")
 
-    @staticmethod
-    def _get_words(topic):
-        return filter(None, topic.split("/"))
-    
-    def insert(self, topic, handler):
-        cur_node = self.root
-        for word in self._get_words(topic):
-            if word not in cur_node.children:
-                cur_node.children[word] = SubTrieNode(cur_node, word, None)
-            cur_node = cur_node.children[word]
-        cur_node.handler = handler
+    def __init__(self, trie, root):
+        self.root = root
+        self._trie = trie
+        # Resolved handlers per full topic, least recently used first. The cache
+        # lives and dies with the snapshot, so it can never serve stale handlers.
+        self._cache = OrderedDict()
 
-    def _lookup(self, route, children):
+    def _lookup(self, route):
+        # Depth-first walk with an explicit stack. Exact matches are pushed last
+        # so they are visited before "+" wildcards, and every node's handler is
+        # emitted before its descendants.
         handlers = []
+        depth = len(route)
+        if depth == 0:
+            return handlers
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        append = handlers.append
 
-        if len(route) == 0:
+        children = self.root.children
+        if not children:
             return handlers
+        child = children.get("+")
+        if child is not None:
+            push((child, 1))
+        child = children.get(route[0])
+        if child is not None:
+            push((child, 1))
+
+        while stack:
+            node, i = pop()
+            if node.handler is not None:
+                append(node.handler)
+
+            if i == depth:
+                continue
+
+            children = node.children
+            if children:
+                word = route[i]
+                i += 1
+                child = children.get("+")
+                if child is not None:
+                    push((child, i))
+                child = children.get(word)
+                if child is not None:
+                    push((child, i))
 
-        if route[0] in children:
-            if children[route[0]].handler != None:
-                handlers.append(children[route[0]].handler)
-            handlers = handlers + self._lookup(route[1:], children[route[0]].children)
-        
-        if "+" in children:
-            if children["+"].handler != None:
-                handlers.append(children["+"].handler)
-            handlers = handlers + self._lookup(route[1:], children["+"].children)
-        
         return handlers
 
     def lookup(self, topic):
-        route = list(self._get_words(topic))
-        return self._lookup(route, self.root.children)
-    
+        cache = self._cache
+        handlers = cache.get(topic)
+        if handlers is not None:
+            try:
+                cache.move_to_end(topic)
+            except KeyError:
+                # Evicted or invalidated by another thread in the meantime.
+                pass
+            self._trie.cache_hits += 1
+            return handlers
+
+        self._trie.cache_misses += 1
+        route = [word for word in topic.split("/") if word]
+        handlers = tuple(self._lookup(route))
+        cache_size = self._trie.cache_size
+        if cache_size > 0:
+            cache[topic] = handlers
+            while len(cache) > cache_size:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    break
+        return handlers
+
+
+class _SubTrieEditor(object):
+    """
+    * Applies a batch of changes to a trie by copying the nodes on the modified
+    * paths. Each node is copied at most once per batch, and its children along
+    * with it when they fit in a small dict.
+    """
+
+    def __init__(self, root):
+        self._owned = set()
+        self._overlaid = set()
+        self.root = self._own(root)
+        self.changed = False
+
+    def compact(self):
+        # Readers only ever see plain dicts, whatever the width of a node.
+        for node in self._overlaid:
+            if type(node.children) is _ChildMap:
+                node.children = node.children.compact()
+        self._overlaid.clear()
+
+    def _own(self, node):
+        if node in self._owned:
+            return node
+        copy = SubTrieNode(node.handler)
+        children = node.children
+        if children:
+            # Wide children are never modified, they are shared until written to.
+            copy.children = dict(children) if type(children) is dict else children
+        self._owned.add(copy)
+        return copy
+
+    def _own_child(self, node, word):
+        child = node.children[word]
+        if child not in self._owned:
+            child = self._own(child)
+            self._set_child(node, word, child)
+        return child
+
+    def _set_child(self, node, word, child):
+        children = node.children
+        if type(children) is dict:
+            children[word] = child
+            if len(children) > _FLAT_CHILDREN:
+                node.children = _FrozenChildren(children)
+        else:
+            node.children = children.set(word, child)
+            self._overlaid.add(node)
+
+    def _delete_child(self, node, word):
+        children = node.children
+        if type(children) is dict:
+            del children[word]
+        else:
+            children = children.delete(word)
+            if len(children) <= _FLAT_CHILDREN // 2:
+                children = dict(children.items())
+            node.children = children
+            self._overlaid.add(node)
+        if not node.children:
+            node.children = None
+
+    def insert(self, topic, handler):
+        cur_node = self.root
+        for word in SubTrie._get_words(topic):
+            children = cur_node.children
+            if children is None:
+                children = cur_node.children = {}
+            if word in children:
+                cur_node = self._own_child(cur_node, word)
+            else:
+                # Channel segments repeat across subscriptions, share a single copy.
+                next_node = SubTrieNode()
+                self._set_child(cur_node, intern(word), next_node)
+                self._owned.add(next_node)
+                cur_node = next_node
+        cur_node.handler = handler
+        self.changed = True
+
     def delete(self, topic):
+        words = []
         cur_node = self.root
-        for word in self._get_words(topic):
-            if word not in cur_node.children:
+        for word in SubTrie._get_words(topic):
+            if not cur_node.children or word not in cur_node.children:
                 return
+            words.append(word)
             cur_node = cur_node.children[word]
 
+        path = []
+        cur_node = self.root
+        for word in words:
+            path.append((cur_node, word))
+            cur_node = self._own_child(cur_node, word)
+
         cur_node.handler = None
-        
-        while cur_node != self.root and cur_node.handler == None and len(cur_node.children) == 0:
-            del cur_node.parent.children[cur_node.word]
-            cur_node = cur_node.parent
+        self.changed = True
+
+        # Prune the branch up to the first ancestor that is still in use.
+        while path and cur_node.handler is None and not cur_node.children:
+            cur_node, word = path.pop()
+            self._delete_child(cur_node, word)
+
+class SubTrie:
+    """
+    * A copy-on-write trie of handlers. Writers build new nodes along the paths
+    * they change and publish a new snapshot atomically, readers always work on
+    * a consistent snapshot without taking any lock.
+    """
+
+    def __init__(self, cache_size=1024):
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._write_lock = threading.Lock()
+        self._snapshot = SubTrieSnapshot(self, SubTrieNode())
+
+    @property
+    def root(self):
+        return self._snapshot.root
+
+    @staticmethod
+    def _get_words(topic):
+        return filter(None, topic.split("/"))
+
+    def snapshot(self):
+        return self._snapshot
+
+    def lookup(self, topic):
+        return self._snapshot.lookup(topic)
+
+    def insert(self, topic, handler):
+        self.insert_many(((topic, handler),))
+
+    def insert_many(self, items):
+        with self._write_lock:
+            editor = _SubTrieEditor(self._snapshot.root)
+            for topic, handler in items:
+                editor.insert(topic, handler)
+            self._publish(editor)
+
+    def delete(self, topic):
+        self.delete_many((topic,))
+
+    def delete_many(self, topics):
+        with self._write_lock:
+            editor = _SubTrieEditor(self._snapshot.root)
+            for topic in topics:
+                editor.delete(topic)
+            self._publish(editor)
+
+    def _publish(self, editor):
+        if editor.changed:
+            editor.compact()
+            # A single attribute assignment, readers see either trie but never a mix.
+            self._snapshot = SubTrieSnapshot(self, editor.root)
 
-        return
\ No newline at end of file
+    def cache_clear(self):
+        self._snapshot._cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
@@ -1,8 +1,8 @@
 import pytest
 try:
-    from .subtrie import SubTrie
+    from .subtrie import SubTrie, _ChildMap
 except ImportError:
-    from subtrie import SubTrie
+    from subtrie import SubTrie, _ChildMap
 
 
 def test_lookup_with_wildcard():
@@ -90,4 +90,184 @@ def test_delete_root():
     t.delete("a")
 
     results = t.lookup("a")
-    assert len(results) == 0
\ No newline at end of file
+    assert len(results) == 0
+
+def test_lookup_cache_hits():
+    t = SubTrie()
+    t.insert("a/", lambda: None)
+
+    assert len(t.lookup("a/b/")) == 1
+    assert len(t.lookup("a/b/")) == 1
+    assert t.cache_misses == 1
+    assert t.cache_hits == 1
+
+def test_lookup_cache_invalidated_on_insert():
+    t = SubTrie()
+    t.insert("a/", lambda: None)
+    assert len(t.lookup("a/b/")) == 1
+
+    t.insert("a/+/", lambda: None)
+    assert len(t.lookup("a/b/")) == 2
+
+def test_lookup_cache_invalidated_on_delete():
+    t = SubTrie()
+    t.insert("a/", lambda: None)
+    t.insert("a/b/", lambda: None)
+    assert len(t.lookup("a/b/")) == 2
+
+    t.delete("a/b/")
+    assert len(t.lookup("a/b/")) == 1
+
+def test_lookup_cache_eviction():
+    t = SubTrie(cache_size=2)
+    t.insert("a/", lambda: None)
+
+    t.lookup("a/1/")
+    t.lookup("a/2/")
+    t.lookup("a/1/")
+    t.lookup("a/3/")
+
+    # "a/2/" was the least recently used entry and has been evicted.
+    t.lookup("a/1/")
+    assert t.cache_hits == 2
+    t.lookup("a/2/")
+    assert t.cache_misses == 4
+
+def test_lookup_cache_disabled():
+    t = SubTrie(cache_size=0)
+    t.insert("a/", lambda: None)
+
+    t.lookup("a/")
+    t.lookup("a/")
+    assert t.cache_hits == 0
+    assert t.cache_misses == 2
+
+def test_lookup_order():
+    t = SubTrie()
+    for topic in ["a/", "a/b/", "a/+/", "a/b/c/", "a/+/c/", "a/b/+/", "a/+/+/"]:
+        t.insert(topic, topic)
+
+    assert list(t.lookup("a/b/c/")) == ["a/", "a/b/", "a/b/c/", "a/b/+/", "a/+/", "a/+/c/", "a/+/+/"]
+    assert list(t.lookup("a/x/c/")) == ["a/", "a/+/", "a/+/c/", "a/+/+/"]
+    assert list(t.lookup("a/b/")) == ["a/", "a/b/", "a/+/"]
+    assert list(t.lookup("b/")) == []
+    assert list(t.lookup("")) == []
+
+def test_delete_prunes_branch():
+    t = SubTrie()
+    t.insert("a/b/c/", lambda: None)
+    t.insert("a/x/", lambda: None)
+
+    t.delete("a/b/c/")
+    assert list(t.root.children["a"].children) == ["x"]
+    assert t.root.children["a"].children["x"].children is None
+
+    t.delete("a/x/")
+    assert t.root.children is None
+    assert len(t.lookup("a/x/")) == 0
+
+def test_snapshot_is_immutable():
+    t = SubTrie()
+    t.insert("a/", "a")
+    snapshot = t.snapshot()
+
+    t.insert("a/b/", "ab")
+    t.delete("a/")
+
+    assert list(snapshot.lookup("a/b/")) == ["a"]
+    assert list(t.lookup("a/b/")) == ["ab"]
+
+def test_insert_many():
+    t = SubTrie()
+    t.insert("x/", "x")
+    snapshot = t.snapshot()
+
+    t.insert_many(("a/%d/" % i, i) for i in range(100))
+
+    assert t.snapshot() is not snapshot
+    assert list(t.lookup("a/42/")) == [42]
+    assert list(t.lookup("x/")) == ["x"]
+    assert list(snapshot.lookup("a/42/")) == []
+
+def test_delete_many():
+    t = SubTrie()
+    t.insert_many(("a/%d/" % i, i) for i in range(100))
+
+    t.delete_many("a/%d/" % i for i in range(100) if i != 7)
+
+    assert list(t.root.children["a"].children) == ["7"]
+    assert list(t.lookup("a/7/")) == [7]
+
+def test_delete_inexistent_keeps_snapshot():
+    t = SubTrie()
+    t.insert("a/", "a")
+    snapshot = t.snapshot()
+
+    t.delete("b/")
+    assert t.snapshot() is snapshot
+
+def test_concurrent_lookup_during_writes():
+    import threading
+
+    t = SubTrie(cache_size=16)
+    t.insert("a/", "a")
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        try:
+            while not done.is_set():
+                handlers = t.lookup("a/%d/" % (len(errors) % 50))
+                assert handlers[0] == "a"
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for th in threads:
+        th.start()
+    for i in range(500):
+        t.insert("a/%d/" % (i % 50), i)
+        t.delete("a/%d/" % ((i + 25) % 50))
+    done.set()
+    for th in threads:
+        th.join()
+
+    assert errors == []
+
+def test_wide_nodes():
+    t = SubTrie()
+    for i in range(2000):
+        t.insert("a/%d/" % i, i)
+    t.insert("a/+/", "any")
+    snapshot = t.snapshot()
+    # Published snapshots only hold dicts, never change overlays.
+    assert isinstance(t.root.children["a"].children, dict)
+
+    for i in range(0, 2000, 2):
+        t.delete("a/%d/" % i)
+    assert list(t.lookup("a/3/")) == [3, "any"]
+    assert list(t.lookup("a/4/")) == ["any"]
+    assert list(snapshot.lookup("a/4/")) == [4, "any"]
+    assert isinstance(t.root.children["a"].children, dict)
+    assert len(snapshot.root.children["a"].children) == 2001
+
+    for i in range(1, 2000, 2):
+        t.delete("a/%d/" % i)
+    # Back to a plain dict once narrow again.
+    assert t.root.children["a"].children == {"+": t.root.children["a"].children["+"]}
+
+def test_child_map_versions():
+    m = _ChildMap(dict((i, i) for i in range(100)))
+    versions = [m]
+    for i in range(100, 150):
+        versions.append(versions[-1].set(i, i))
+    for i in range(0, 150, 3):
+        versions.append(versions[-1].delete(i))
+
+    last = versions[-1]
+    assert len(last) == 100
+    assert sorted(last) == [i for i in range(150) if i % 3]
+    assert 3 not in last and 4 in last and last[149] == 149
+    # Earlier versions are untouched.
+    assert len(m) == 100 and 120 not in m
+    assert len(versions[50]) == 150 and versions[50][0] == 0
@@ -0,0 +1,183 @@
+"""
+Correlation of control requests (keygen, presence, me, ...) with their
+responses, exposed as futures.
+"""
+import collections
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+
+class EmitterError(Exception):
+    """
+    * Raised for a request the broker answered with an error.
+    """
+
+    def __init__(self, status, message):
+        super(EmitterError, self).__init__("%s: %s" % (status, message))
+        self.status = status
+        self.message = message
+
+
+class _Request(object):
+    __slots__ = ("kind", "request_id", "future", "match")
+
+    def __init__(self, kind, request_id, future, match):
+        self.kind = kind
+        self.request_id = request_id
+        self.future = future
+        self.match = match
+
+
+class RequestTracker(object):
+    """
+    * Tracks the control requests awaiting a response. Responses are matched on
+    * the request id the broker echoes in their "req" field, and dropped when
+    * no pending request has that id. Responses without one are matched with
+    * the oldest pending request of the same kind, the broker answering the
+    * requests of a connection in order. Requests sent without a future are
+    * registered with add_untracked, so that their responses are not taken for
+    * the response of a tracked request.
+    *
+    * Error responses only fail the request whose id they echo: without one,
+    * they may as well be about a regular publish.
+    *
+    * Pending requests fail with a TimeoutError once their timeout expires, and
+    * are forgotten when their future is cancelled.
+    """
+
+    def __init__(self):
+        # Reentrant, so that requests can be sent from a response handler.
+        self.lock = threading.RLock()
+        self._cond = threading.Condition(self.lock)
+        self._by_id = {}
+        self._by_kind = collections.defaultdict(collections.OrderedDict)
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, kind, request_id, timeout=None, match=None):
+        """
+        * Registers a request and returns the future of its response. match is
+        * an optional predicate responses must satisfy to complete the request.
+        """
+        future = Future()
+        request = _Request(kind, request_id, future, match)
+        with self.lock:
+            previous = self._by_id.pop(request_id, None)
+            if previous is not None:
+                # The id was reused, the previous request can no longer be answered.
+                self._forget(previous)
+                if previous.future.set_running_or_notify_cancel():
+                    previous.future.set_exception(TimeoutError())
+            self._by_id[request_id] = request
+            self._by_kind[kind][request_id] = request
+            if timeout is not None:
+                heapq.heappush(self._deadlines, (time.monotonic() + timeout, next(self._sequence), request))
+                self._start_reaper()
+                self._cond.notify()
+
+        future.add_done_callback(lambda f: self._cancelled(request) if f.cancelled() else None)
+        return future
+
+    def add_untracked(self, kind, timeout=None, match=None):
+        """
+        * Registers a request of which the response is to be dropped.
+        """
+        request = _Request(kind, (None, next(self._sequence)), None, match)
+        with self.lock:
+            self._by_kind[kind][request.request_id] = request
+            if timeout is not None:
+                heapq.heappush(self._deadlines, (time.monotonic() + timeout, next(self._sequence), request))
+                self._start_reaper()
+                self._cond.notify()
+
+    def _forget(self, request):
+        if self._by_id.get(request.request_id) is request:
+            del self._by_id[request.request_id]
+        pending = self._by_kind.get(request.kind)
+        if pending is not None and pending.get(request.request_id) is request:
+            del pending[request.request_id]
+
+    def _cancelled(self, request):
+        with self.lock:
+            self._forget(request)
+
+    def _find(self, kind, response):
+        if not isinstance(response, dict):
+            return None
+        if "req" in response:
+            request = self._by_id.get(response["req"])
+            if request is not None and request.kind == kind:
+                return request if request.match is None or request.match(response) else None
+            return None
+
+        for request in self._by_kind.get(kind, {}).values():
+            if request.match is None or request.match(response):
+                return request
+        return None
+
+    def resolve(self, kind, response):
+        """
+        * Completes the request a response of the given kind answers, if any.
+        """
+        with self.lock:
+            request = self._find(kind, response)
+            if request is None:
+                return False
+            self._forget(request)
+            if request.future is None:
+                # The response of an untracked request.
+                return False
+
+        if request.future.set_running_or_notify_cancel():
+            request.future.set_result(response)
+        return True
+
+    def fail(self, response):
+        """
+        * Fails the request an error response answers, if any.
+        """
+        request_id = response.get("req") if isinstance(response, dict) else None
+        with self.lock:
+            request = self._by_id.get(request_id)
+            if request is None:
+                return False
+            self._forget(request)
+
+        if request.future.set_running_or_notify_cancel():
+            request.future.set_exception(EmitterError(response.get("status"), response.get("message")))
+        return True
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name="emitter-requests", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        expired = []
+        while True:
+            with self.lock:
+                while not self._deadlines:
+                    self._cond.wait()
+                deadline = self._deadlines[0][0]
+                now = time.monotonic()
+                if deadline > now:
+                    self._cond.wait(deadline - now)
+                    continue
+
+                _, _, request = heapq.heappop(self._deadlines)
+                if self._by_kind[request.kind].get(request.request_id) is request:
+                    self._forget(request)
+                    if request.future is not None:
+                        expired.append(request)
+
+            for request in expired:
+                if request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(TimeoutError())
+            del expired[:]
@@ -0,0 +1,99 @@
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+try:
+    from .tracker import EmitterError, RequestTracker
+except ImportError:
+    from tracker import EmitterError, RequestTracker
+
+def test_resolve_by_request_id():
+    tracker = RequestTracker()
+    first = tracker.add("keygen", 1)
+    second = tracker.add("keygen", 2)
+
+    assert tracker.resolve("keygen", {"req": 2, "key": "b"})
+    assert tracker.resolve("keygen", {"req": 1, "key": "a"})
+    assert first.result(0) == {"req": 1, "key": "a"}
+    assert second.result(0) == {"req": 2, "key": "b"}
+    assert len(tracker) == 0
+
+def test_resolve_in_order_without_request_id():
+    tracker = RequestTracker()
+    keygen = tracker.add("keygen", 1)
+    me = tracker.add("me", 2)
+
+    assert tracker.resolve("me", {"id": "x"})
+    assert not keygen.done()
+    assert me.result(0) == {"id": "x"}
+    assert not tracker.resolve("me", {"id": "y"})
+    assert not tracker.resolve("keygen", None)
+
+def test_match():
+    tracker = RequestTracker()
+    future = tracker.add("presence", 1, match=lambda r: r["event"] == "status")
+
+    assert not tracker.resolve("presence", {"event": "subscribe"})
+    assert tracker.resolve("presence", {"event": "status"})
+    assert future.done()
+
+def test_fail():
+    tracker = RequestTracker()
+    future = tracker.add("keygen", 7)
+
+    # Errors without a request id are not attributed to a request.
+    assert not tracker.fail({"status": 400, "message": "bad request"})
+    assert tracker.fail({"req": 7, "status": 401, "message": "unauthorized"})
+    with pytest.raises(EmitterError) as error:
+        future.result(0)
+    assert error.value.status == 401
+
+def test_timeout():
+    tracker = RequestTracker()
+    slow = tracker.add("keygen", 1, timeout=0.05)
+    fast = tracker.add("keygen", 2, timeout=5)
+    tracker.resolve("keygen", {"req": 2})
+
+    with pytest.raises(TimeoutError):
+        slow.result(1)
+    assert fast.result(0) == {"req": 2}
+    assert len(tracker) == 0
+
+def test_cancel_forgets_request():
+    tracker = RequestTracker()
+    future = tracker.add("me", 1, timeout=5)
+
+    assert future.cancel()
+    assert len(tracker) == 0
+    assert not tracker.resolve("me", {})
+
+def test_unknown_request_id_is_dropped():
+    tracker = RequestTracker()
+    first = tracker.add("keygen", 5)
+    second = tracker.add("keygen", 7)
+
+    first.cancel()
+    assert not tracker.resolve("keygen", {"req": 5, "key": "KEY_FOR_A"})
+    assert not second.done()
+    assert tracker.resolve("keygen", {"req": 7, "key": "b"})
+    assert second.result(0) == {"req": 7, "key": "b"}
+
+def test_untracked_responses_are_dropped():
+    tracker = RequestTracker()
+    tracker.add_untracked("keygen")
+    future = tracker.add("keygen", 1)
+
+    # Answers the untracked request, sent first.
+    assert not tracker.resolve("keygen", {"key": "a"})
+    assert not future.done()
+    assert tracker.resolve("keygen", {"key": "b"})
+    assert future.result(0) == {"key": "b"}
+
+def test_untracked_requests_expire():
+    tracker = RequestTracker()
+    tracker.add_untracked("me", timeout=0.01)
+    future = tracker.add("me", 1)
+
+    time.sleep(0.1)
+    assert tracker.resolve("me", {"id": "x"})
+    assert future.result(0) == {"id": "x"}
@@ -23,5 +23,9 @@ setuptools.setup(
         "Programming Language :: Python :: 3"
     ],
     keywords="emitter mqtt realtime cloud service",
-    install_requires=["paho-mqtt"]
+    install_requires=["paho-mqtt"],
+    extras_require={
+        "fast": ["orjson"],
+        "msgpack": ["msgpack"]
+    }
 )